@@ -1,15 +1,75 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-import databutton as db
-import requests
+from typing import Dict, List, Optional
+import asyncio
+import math
+import os
 import json
 from app.auth import AuthorizedUser
+from app.libs.blocking import run_blocking
+from app.libs.chat_cache import ChatResponseCache
+from app.libs.chat_providers import (
+    ChatProvider,
+    ChatProviderError,
+    get_chat_provider,
+    parse_fake_providers,
+)
+from app.libs.chat_router import ChatRouter, router_stats
+from app.libs.connection_health import health_monitor
+from app.libs import connections as conn_store
+from app.libs import conversations as convo
+from app.libs.http_client import close_http_client
+from app.libs.provider_clients import UserClients, provider_clients
+from app.libs.storage_utils import KeyedLocks
+from app.libs.usage import usage_meter
+from app.libs.rate_limit import (
+    BATCH,
+    INTERACTIVE,
+    Limit,
+    RateLimitExceeded,
+    RateLimitedProvider,
+    RateLimiter,
+    current_priority,
+)
 
 router = APIRouter()
 
-# Gemini API configuration
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent"
+# Release pooled provider connections when the app stops
+router.add_event_handler("shutdown", close_http_client)
+
+# Usage events are buffered in memory and written in batches
+router.add_event_handler("startup", usage_meter.start)
+router.add_event_handler("shutdown", usage_meter.stop)
+
+# Replies to repeated prompts are served from memory instead of the provider;
+# entries are scoped to the user they were generated for
+response_cache = ChatResponseCache()
+
+# Optional token-bucket limits per user and per provider key (see app.libs.rate_limit).
+# Nothing is limited unless CHAT_USER_RPM/TPM or CHAT_PROVIDER_RPM/TPM are set.
+# Users wait in a queue when over their limit; a provider that is over its limit
+# answers 429 so the router can try another one.
+def limit_from_env(prefix: str) -> Optional[Limit]:
+    """Limit from {prefix}_RPM / _TPM / _BURST_SECONDS; the burst defaults to a full minute of capacity"""
+    rpm = os.environ.get(f"{prefix}_RPM")
+    tpm = os.environ.get(f"{prefix}_TPM")
+    if not rpm and not tpm:
+        return None
+    return Limit(
+        requests_per_minute=float(rpm) if rpm else None,
+        tokens_per_minute=float(tpm) if tpm else None,
+        burst_seconds=float(os.environ.get(f"{prefix}_BURST_SECONDS", "60")),
+    )
+
+USER_LIMIT = limit_from_env("CHAT_USER")
+PROVIDER_LIMIT = limit_from_env("CHAT_PROVIDER")
+user_limiter = RateLimiter(
+    lambda key: USER_LIMIT,
+    max_queue=int(os.environ.get("CHAT_QUEUE_SIZE", "200")),
+    max_wait=float(os.environ.get("CHAT_QUEUE_TIMEOUT", "30")),
+)
+provider_limiter = RateLimiter(lambda key: PROVIDER_LIMIT, max_queue=int(os.environ.get("CHAT_QUEUE_SIZE", "200")), max_wait=5.0)
 
 # Message schemas
 class Message(BaseModel):
@@ -23,73 +83,579 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     response: str
+
+MAX_BATCH_SIZE = 500
+MAX_BATCH_CONCURRENCY = 32
+
+class BatchChatRequest(BaseModel):
+    requests: List[ChatRequest]
+    # Completions in flight at once for this batch
+    concurrency: Optional[int] = 8
+
+class ConversationMessage(BaseModel):
+    role: str
+    content: str
+    createdAt: str
+
+class Conversation(BaseModel):
+    id: str
+    title: str
+    createdAt: str
+    updatedAt: str
+    messages: List[ConversationMessage]
+    summary: Optional[str] = None
+
+class ConversationInfo(BaseModel):
+    id: str
+    title: str
+    updatedAt: str
+    messageCount: int
+
+class CreateConversationRequest(BaseModel):
+    title: Optional[str] = None
+
+class ConversationMessageRequest(BaseModel):
+    content: str
+    temperature: Optional[float] = 0.7
+    max_output_tokens: Optional[int] = 800
+    # Fold turns that no longer fit the context window into a running summary
+    summarize_history: bool = True
+
+class ConversationReply(BaseModel):
+    response: str
+    conversationId: str
+    contextMessages: int
+    contextTokens: int
+
+class ProviderRouteStats(BaseModel):
+    requests: int
+    failures: int
+    latency_ewma: Optional[float] = None
+    error_ewma: float
+    p95: Optional[float] = None
+    cooling_down: bool
+
+class ChatCacheStats(BaseModel):
+    hits: int
+    semantic_hits: int
+    misses: int
+    bypassed: int
+    evictions: int
+    size: int
+    hit_rate: float
+    
+def hedging_enabled() -> bool:
+    return os.environ.get("CHAT_HEDGE_REQUESTS", "").lower() in ("1", "true", "yes")
+
+async def load_provider_clients(user_id: str) -> UserClients:
+    """Clients for each of the user's usable chat connections (and shared legacy ones), plus the app's GEMINI_API_KEY"""
+    cached = provider_clients.user_clients(user_id)
+    if cached is not None:
+        return cached
+    # Connections and their keys are stored by the api_connections API, which invalidates this cache
+    own, shared = await asyncio.gather(
+        run_blocking(conn_store.load_connections, user_id),
+        run_blocking(conn_store.load_shared_connections),
+    )
+    connections = {
+        connection_id: {
+            "service": connection.get("service"),
+            "status": connection.get("status"),
+            "owner": user_id if connection_id in own else None,
+        }
+        for connection_id, connection in {**shared, **own}.items()
+    }
+    lookups = [
+        provider_clients.get(connection_id, connection["service"])
+        for connection_id, connection in connections.items()
+        if connection["status"] != "failed"
+    ]
+    lookups.append(provider_clients.get("GEMINI_API_KEY", "gemini", "GEMINI_API_KEY"))
+    clients = [client for client in await asyncio.gather(*lookups) if client is not None]
+    entry = UserClients(clients, connections)
+    provider_clients.cache_user_clients(user_id, entry)
+    return entry
+
+def outcome_recorder(connections: Dict[str, dict]):
+    """on_outcome for a ChatRouter: feeds the breaker, and has the health monitor watch connections actually used"""
+    def on_outcome(connection_id: str, error: Optional[BaseException]) -> None:
+        connection = connections.get(connection_id)
+        if connection is not None:
+            health_monitor.watch(connection_id, connection["service"], connection["status"], connection["owner"])
+        health_monitor.record_outcome(connection_id, error)
+    return on_outcome
+
+def estimate_request_tokens(messages: List[dict], max_output_tokens: Optional[int]) -> int:
+    """Tokens a request may use: its prompt plus the most it can generate"""
+    return sum(convo.estimate_tokens(m["content"]) for m in messages) + (max_output_tokens or 0)
+
+async def admit(user_id: str, messages: List[dict], max_output_tokens: Optional[int],
+                priority: int = INTERACTIVE) -> Dict[str, str]:
+    """Wait for the user's rate limit, returning rate limit headers for the response"""
+    key = f"user:{user_id}"
+    try:
+        waited = await user_limiter.acquire([key], estimate_request_tokens(messages, max_output_tokens), priority)
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    status = user_limiter.status(key)
+    if status is None:
+        return {}
+    headers = {"X-RateLimit-Queued-Ms": str(int(waited * 1000))}
+    for name in ("requests", "tokens"):
+        if f"limit_{name}" in status:
+            headers[f"X-RateLimit-Limit-{name.capitalize()}"] = str(status[f"limit_{name}"])
+            headers[f"X-RateLimit-Remaining-{name.capitalize()}"] = str(status[f"remaining_{name}"])
+    return headers
+
+async def get_provider(user_id: str) -> ChatProvider:
+    """Chat provider for this request: a router over every provider the user has configured"""
+    if os.environ.get("CHAT_PROVIDER") == "fake":
+        spec = os.environ.get("FAKE_CHAT_PROVIDERS")
+        raw_providers = parse_fake_providers(spec) if spec else {"fake": get_chat_provider()}
+        connections = {}
+    else:
+        configured = await load_provider_clients(user_id)
+        connections = configured.connections
+        # Connections whose circuit breaker is open are skipped without trying them
+        clients = [client for client in configured.clients if health_monitor.is_available(client.connection_id)]
+        if configured.clients and not clients:
+            raise HTTPException(status_code=503, detail="All chat providers are currently unavailable")
+        # With a single provider its own retries are the only recovery; with several, fail over instead
+        max_retries = 0 if len(clients) > 1 else None
+        raw_providers = {}
+        for client in clients:
+            provider = client.chat_provider(max_retries)
+            if provider is not None:
+                raw_providers[client.connection_id] = provider
     
+    providers = {
+        provider_id: RateLimitedProvider(provider, f"provider:{provider_id}", provider_limiter, estimate_request_tokens)
+        for provider_id, provider in raw_providers.items()
+    }
+    if not providers:
+        raise HTTPException(status_code=500, detail="No chat provider configured (add a connection or GEMINI_API_KEY)")
+    return ChatRouter(providers, hedge=hedging_enabled(), on_outcome=outcome_recorder(connections))
+
+async def generate_metered(provider: ChatProvider, user_id: str, kind: str, messages: List[dict],
+                           temperature: Optional[float], max_output_tokens: Optional[int]) -> str:
+    """provider.generate, recording tokens and latency for the user"""
+    with usage_meter.track(user_id, kind, messages) as call:
+        call.completion = await provider.generate(messages, temperature, max_output_tokens)
+    return call.completion
+
+def record_cache_hit(user_id: str, kind: str, messages: List[dict]) -> None:
+    with usage_meter.track(user_id, kind, messages) as call:
+        call.cached = True
+
+def cache_config(provider: ChatProvider, request: ChatRequest) -> dict:
+    """Generation settings that must match for a cached reply to be reused"""
+    return {
+        # The services and models configured for this request, not just "router"
+        "providers": provider.identity(),
+        "temperature": request.temperature,
+        "max_output_tokens": request.max_output_tokens,
+    }
+
+def cache_status(cached: Optional[str], config: dict) -> str:
+    """X-Cache header value"""
+    if cached is not None:
+        return "HIT"
+    return "BYPASS" if response_cache.should_bypass(config) else "MISS"
+
 @router.post("/chat")
-async def chat_with_gemini(request: ChatRequest, user: AuthorizedUser):
+async def chat_with_gemini(request: ChatRequest, response: Response, user: AuthorizedUser):
     """
     Chat with the Gemini API.
     This endpoint forwards the request to Gemini API and returns the response.
+    Repeated prompts are answered from the response cache (see the X-Cache header).
     """
     try:
-        # Get API key from secrets
-        api_key = db.secrets.get("GEMINI_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="GEMINI_API_KEY not configured")
+        provider = await get_provider(user.sub)
+        messages = [msg.dict() for msg in request.messages]
+        config = cache_config(provider, request)
         
-        # Convert our messages format to Gemini format
-        formatted_messages = []
-        for msg in request.messages:
-            if msg.role == "user":
-                formatted_messages.append({"role": "user", "parts": [{"text": msg.content}]})
-            elif msg.role == "model":
-                formatted_messages.append({"role": "model", "parts": [{"text": msg.content}]})
+        cached = response_cache.get(messages, config, user.sub)
+        response.headers["X-Cache"] = cache_status(cached, config)
+        if cached is not None:
+            record_cache_hit(user.sub, "chat", messages)
+            return ChatResponse(response=cached)
         
-        # Prepare request payload
-        payload = {
-            "contents": formatted_messages,
-            "generationConfig": {
-                "temperature": request.temperature,
-                "maxOutputTokens": request.max_output_tokens,
-                "topP": 0.95,
-                "topK": 40
-            }
-        }
-        
-        # Make request to Gemini API
-        response = requests.post(
-            f"{GEMINI_API_URL}?key={api_key}",
-            headers={"Content-Type": "application/json"},
-            data=json.dumps(payload)
+        response.headers.update(await admit(user.sub, messages, request.max_output_tokens))
+        generated_text = await generate_metered(
+            provider,
+            user.sub,
+            "chat",
+            messages,
+            request.temperature,
+            request.max_output_tokens,
         )
+        response_cache.put(messages, config, generated_text, user.sub)
+        return ChatResponse(response=generated_text)
+    
+    except HTTPException:
+        raise
+    except ChatProviderError as e:
+        print(f"Gemini API error: {e.status_code} - {str(e)}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        print(f"Error in chat_with_gemini: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Format a Server-Sent Event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@router.post("/chat/stream")
+async def stream_chat_with_gemini(request: ChatRequest, http_request: Request, user: AuthorizedUser):
+    """
+    Chat with the Gemini API, streaming the reply as Server-Sent Events.
+    Each chunk is sent as `data: {"text": ...}`, followed by a final `done` event,
+    or an `error` event if the provider fails mid-stream.
+    """
+    messages = [msg.dict() for msg in request.messages]
+    try:
+        provider = await get_provider(user.sub)
+        config = cache_config(provider, request)
+        cached = response_cache.get(messages, config, user.sub)
+        rate_limit_headers = {} if cached is not None else await admit(user.sub, messages, request.max_output_tokens)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in stream_chat_with_gemini: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def event_stream():
+        if cached is not None:
+            record_cache_hit(user.sub, "chat_stream", messages)
+            yield sse_event({"text": cached})
+            yield sse_event({}, event="done")
+            return
         
-        # Check for errors
-        if response.status_code != 200:
-            print(f"Gemini API error: {response.status_code} - {response.text}")
-            raise HTTPException(
-                status_code=response.status_code, 
-                detail=f"Gemini API error: {response.text}"
-            )
-        
-        # Parse response
-        response_data = response.json()
-        
-        # Extract the generated text
-        generated_text = ""
-        if ("candidates" in response_data and 
-            len(response_data["candidates"]) > 0 and 
-            "content" in response_data["candidates"][0] and
-            "parts" in response_data["candidates"][0]["content"] and
-            len(response_data["candidates"][0]["content"]["parts"]) > 0 and
-            "text" in response_data["candidates"][0]["content"]["parts"][0]):
-            
-            generated_text = response_data["candidates"][0]["content"]["parts"][0]["text"]
-        else:
-            # Handle unexpected response format
-            print(f"Unexpected Gemini API response format: {response_data}")
-            raise HTTPException(status_code=500, detail="Unexpected response format from Gemini API")
+        chunks = []
+        completed = False
+        try:
+            with usage_meter.track(user.sub, "chat_stream", messages) as call:
+                async for text in provider.stream(messages, request.temperature, request.max_output_tokens):
+                    if await http_request.is_disconnected():
+                        # Stop reading from the provider as soon as the browser goes away
+                        break
+                    chunks.append(text)
+                    yield sse_event({"text": text})
+                else:
+                    completed = True
+                call.completion = "".join(chunks)
+            if completed:
+                # Only complete replies are cached
+                response_cache.put(messages, config, call.completion, user.sub)
+                yield sse_event({}, event="done")
+        except asyncio.CancelledError:
+            raise
+        except ChatProviderError as e:
+            print(f"Gemini API error: {e.status_code} - {str(e)}")
+            yield sse_event({"status": e.status_code, "error": str(e)}, event="error")
+        except Exception as e:
+            print(f"Error in stream_chat_with_gemini: {str(e)}")
+            yield sse_event({"status": 500, "error": str(e)}, event="error")
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Cache": cache_status(cached, config),
+            **rate_limit_headers,
+        },
+    )
+
+def batch_item_key(item: ChatRequest) -> str:
+    """Identical requests share one completion"""
+    return json.dumps(item.dict(), sort_keys=True)
+
+@router.post("/chat/batch")
+async def chat_batch(request: BatchChatRequest, http_request: Request, user: AuthorizedUser):
+    """
+    Run many independent chat requests in one call.
+    Identical requests are answered once. Results stream back as NDJSON lines in
+    completion order, either {"index", "response", "cached"} or {"index", "status", "error"};
+    a failing item doesn't affect the others.
+    """
+    if len(request.requests) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"A batch can hold at most {MAX_BATCH_SIZE} requests")
+    try:
+        provider = await get_provider(user.sub)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in chat_batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    # Indices of every item that shares a unique request
+    groups: Dict[str, List[int]] = {}
+    for index, item in enumerate(request.requests):
+        groups.setdefault(batch_item_key(item), []).append(index)
+    unique = [(request.requests[indices[0]], indices) for indices in groups.values()]
+    concurrency = max(1, min(request.concurrency or 1, MAX_BATCH_CONCURRENCY))
+    
+    async def run_item(item: ChatRequest) -> dict:
+        messages = [msg.dict() for msg in item.messages]
+        config = cache_config(provider, item)
+        cached = response_cache.get(messages, config, user.sub)
+        if cached is not None:
+            record_cache_hit(user.sub, "batch", messages)
+            return {"response": cached, "cached": True}
+        try:
+            await admit(user.sub, messages, item.max_output_tokens, priority=BATCH)
+            text = await generate_metered(provider, user.sub, "batch", messages, item.temperature, item.max_output_tokens)
+        except HTTPException as e:
+            return {"status": e.status_code, "error": str(e.detail)}
+        except ChatProviderError as e:
+            return {"status": e.status_code, "error": str(e)}
+        except Exception as e:
+            print(f"Error in chat_batch item: {str(e)}")
+            return {"status": 500, "error": str(e)}
+        response_cache.put(messages, config, text, user.sub)
+        return {"response": text, "cached": False}
+    
+    async def results():
+        current_priority.set(BATCH)
+        pending = iter(unique)
+        running: Dict[asyncio.Task, List[int]] = {}
         
-        return ChatResponse(response=generated_text)
+        def start_next() -> None:
+            item = next(pending, None)
+            if item is not None:
+                running[asyncio.create_task(run_item(item[0]))] = item[1]
         
+        for _ in range(concurrency):
+            start_next()
+        try:
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    indices = running.pop(task)
+                    result = task.result()
+                    for index in indices:
+                        yield json.dumps({"index": index, **result}) + "\n"
+                    start_next()
+                if await http_request.is_disconnected():
+                    break
+        finally:
+            # Stop outstanding completions if the client went away
+            for task in running:
+                task.cancel()
+    
+    return StreamingResponse(
+        results(),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Size": str(len(request.requests)), "X-Batch-Unique": str(len(unique))},
+    )
+
+@router.get("/chat/providers/stats")
+def get_chat_provider_stats(user: AuthorizedUser) -> Dict[str, ProviderRouteStats]:
+    """Latency and error averages the chat router uses to pick providers"""
+    return {provider_id: ProviderRouteStats(**stats) for provider_id, stats in router_stats().items()}
+
+@router.get("/chat/cache/stats")
+def get_chat_cache_stats(user: AuthorizedUser) -> ChatCacheStats:
+    """Hit/miss counters for the current user's entries in the chat response cache"""
+    return ChatCacheStats(**response_cache.stats(user.sub))
+
+# Conversations
+#
+# The client sends only the new message; history lives on the server and is
+# trimmed to a token budget before each provider call (see app.libs.conversations).
+
+_conversation_locks = KeyedLocks()
+
+def conversation_lock(user_id: str) -> asyncio.Lock:
+    """Lock guarding updates to one user's conversations"""
+    return _conversation_locks.get(user_id)
+
+async def prepare_user_turn(user_id: str, conversation_id: str, content: str):
+    """The conversation with the user's message added (not yet stored) and the provider context for it"""
+    conversation = await run_blocking(convo.load_conversation, user_id, conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    convo.append_message(conversation, "user", content)
+    context, start = convo.build_context(conversation)
+    return conversation, context, start
+
+async def add_turns(user_id: str, conversation_id: str, content: str, reply: str) -> None:
+    """Store the user's message together with the reply to it.
+
+    Nothing is stored until the reply is complete, so a provider error, a 429 or
+    a client that went away leaves the conversation as it was.
+    """
+    async with conversation_lock(user_id):
+        conversation = await run_blocking(convo.load_conversation, user_id, conversation_id)
+        if conversation is None:
+            # Deleted while the reply was being generated
+            return
+        convo.append_message(conversation, "user", content)
+        convo.append_message(conversation, "model", reply)
+        await run_blocking(convo.save_conversation, user_id, conversation)
+
+async def update_summary(provider: ChatProvider, user_id: str, conversation: dict, through: int) -> None:
+    """Background task folding messages that left the context window into the summary"""
+    current_priority.set(BATCH)
+    try:
+        with usage_meter.track(user_id, "summary", conversation["messages"][conversation["summarizedThrough"]:through]) as call:
+            summary = await convo.summarize_history(provider, conversation, through)
+            call.completion = summary
+        async with conversation_lock(user_id):
+            latest = await run_blocking(convo.load_conversation, user_id, conversation["id"])
+            if latest is None or latest["summarizedThrough"] != conversation["summarizedThrough"]:
+                # Deleted, or another summary landed first
+                return
+            latest["summary"] = summary
+            latest["summarizedThrough"] = through
+            await run_blocking(convo.save_conversation, user_id, latest)
     except Exception as e:
-        print(f"Error in chat_with_gemini: {str(e)}")
+        print(f"Error summarizing conversation {conversation['id']}: {str(e)}")
+
+def schedule_summary(background_tasks: BackgroundTasks, provider: ChatProvider, user_id: str,
+                     conversation: dict, start: int, enabled: bool) -> None:
+    if enabled and convo.needs_summary(conversation, start):
+        background_tasks.add_task(update_summary, provider, user_id, conversation, start)
+
+@router.get("/chat/conversations")
+async def list_conversations(user: AuthorizedUser) -> List[ConversationInfo]:
+    """List the current user's conversations, newest first"""
+    try:
+        items = await run_blocking(convo.list_conversations, user.sub)
+        return [ConversationInfo(**item) for item in items]
+    except Exception as e:
+        print(f"Error listing conversations: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/conversations")
+async def create_conversation(request: CreateConversationRequest, user: AuthorizedUser) -> Conversation:
+    """Start a new conversation"""
+    try:
+        async with conversation_lock(user.sub):
+            conversation = await run_blocking(convo.create_conversation, user.sub, request.title)
+        return Conversation(**conversation)
+    except Exception as e:
+        print(f"Error creating conversation: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/chat/conversations/{conversation_id}")
+async def get_conversation(conversation_id: str, user: AuthorizedUser) -> Conversation:
+    """Get a conversation with its full message history"""
+    try:
+        conversation = await run_blocking(convo.load_conversation, user.sub, conversation_id)
+        if conversation is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        return Conversation(**conversation)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error getting conversation: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/chat/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str, user: AuthorizedUser):
+    """Delete a conversation"""
+    try:
+        async with conversation_lock(user.sub):
+            deleted = await run_blocking(convo.delete_conversation, user.sub, conversation_id)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        return {"success": True, "message": "Conversation deleted successfully"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error deleting conversation: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/conversations/{conversation_id}/messages")
+async def send_conversation_message(
+    conversation_id: str,
+    request: ConversationMessageRequest,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    user: AuthorizedUser,
+) -> ConversationReply:
+    """Add a message to a conversation and return the model's reply"""
+    try:
+        provider = await get_provider(user.sub)
+        conversation, context, start = await prepare_user_turn(user.sub, conversation_id, request.content)
+        # Charged for the whole context it will send, history included
+        response.headers.update(await admit(user.sub, context, request.max_output_tokens))
+        generated_text = await generate_metered(
+            provider, user.sub, "conversation", context, request.temperature, request.max_output_tokens
+        )
+        await add_turns(user.sub, conversation_id, request.content, generated_text)
+        schedule_summary(background_tasks, provider, user.sub, conversation, start, request.summarize_history)
+        return ConversationReply(
+            response=generated_text,
+            conversationId=conversation_id,
+            contextMessages=len(context),
+            contextTokens=convo.context_tokens(context),
+        )
+    except HTTPException:
+        raise
+    except ChatProviderError as e:
+        print(f"Gemini API error: {e.status_code} - {str(e)}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        print(f"Error in send_conversation_message: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/conversations/{conversation_id}/messages/stream")
+async def stream_conversation_message(
+    conversation_id: str,
+    request: ConversationMessageRequest,
+    http_request: Request,
+    background_tasks: BackgroundTasks,
+    user: AuthorizedUser,
+):
+    """
+    Add a message to a conversation and stream the reply as Server-Sent Events,
+    using the same events as /chat/stream. The message and the reply are stored
+    once the reply completes.
+    """
+    try:
+        provider = await get_provider(user.sub)
+        conversation, context, start = await prepare_user_turn(user.sub, conversation_id, request.content)
+        rate_limit_headers = await admit(user.sub, context, request.max_output_tokens)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in stream_conversation_message: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def event_stream():
+        chunks = []
+        completed = False
+        try:
+            with usage_meter.track(user.sub, "conversation_stream", context) as call:
+                async for text in provider.stream(context, request.temperature, request.max_output_tokens):
+                    if await http_request.is_disconnected():
+                        break
+                    chunks.append(text)
+                    yield sse_event({"text": text})
+                else:
+                    completed = True
+                call.completion = "".join(chunks)
+            if completed:
+                await add_turns(user.sub, conversation_id, request.content, call.completion)
+                yield sse_event({}, event="done")
+        except asyncio.CancelledError:
+            raise
+        except ChatProviderError as e:
+            print(f"Gemini API error: {e.status_code} - {str(e)}")
+            yield sse_event({"status": e.status_code, "error": str(e)}, event="error")
+        except Exception as e:
+            print(f"Error in stream_conversation_message: {str(e)}")
+            yield sse_event({"status": 500, "error": str(e)}, event="error")
+    
+    schedule_summary(background_tasks, provider, user.sub, conversation, start, request.summarize_history)
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **rate_limit_headers},
+        background=background_tasks,
+    )
@@ -1,13 +1,33 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, List, Optional
-import databutton as db
+from typing import Dict, List, Optional, Tuple
+import asyncio
 import json
-import re
+from datetime import datetime
 from app.auth import AuthorizedUser
+from app.libs.blocking import run_blocking
+from app.libs import connections as conn_store
+from app.libs.chat_providers import GEMINI_API_BASE_URL, vertex_ai_base_url
+from app.libs.connection_health import health_monitor
+from app.libs.connections import api_key_name
+from app.libs.http_client import close_http_client, get_http_client
+from app.libs.provider_clients import ProviderClient, provider_clients
+from app.libs.secrets_cache import secrets_cache
+from app.libs.storage_utils import KeyedLocks
 
 router = APIRouter()
 
+# Release pooled provider connections when the app stops
+router.add_event_handler("shutdown", close_http_client)
+
+# Each owner's connections are one blob; serialize its read-modify-write cycles
+_connections_locks = KeyedLocks()
+
+def connections_lock(owner: str) -> asyncio.Lock:
+    """Lock guarding updates to one owner's connections"""
+    return _connections_locks.get(owner)
+
 # API Connection schemas
 class ApiConnectionBase(BaseModel):
     name: str
@@ -19,6 +39,7 @@ class ApiConnectionCreate(ApiConnectionBase):
 
 class ApiConnectionResponse(ApiConnectionBase):
     id: str
+    shared: bool = False  # Legacy connection without an owner: usable by everyone, editable by no one
     status: str = "untested"  # untested, connected, failed
     last_tested: Optional[str] = None
 
@@ -36,53 +57,191 @@ class ApiConnectionTestResponse(BaseModel):
     status: str
     message: str
 
-# Helper functions
-def sanitize_key(key: str) -> str:
-    """Sanitize storage key to only allow alphanumeric and ._- symbols"""
-    return re.sub(r'[^a-zA-Z0-9._-]', '', key)
+class ApiConnectionHealth(BaseModel):
+    state: str  # closed, open, half_open
+    consecutive_failures: int
+    retry_in: Optional[float] = None
+    next_probe_in: Optional[float] = None
+    last_error: Optional[str] = None
+
+class ApiConnectionBulkTest(BaseModel):
+    ids: Optional[List[str]] = None  # If omitted, every connection is tested
 
-def get_connections() -> Dict:
-    """Get stored API connections metadata"""
+# Seconds a connection test may take before it counts as failed
+SERVICE_TEST_TIMEOUTS = {"openai": 10.0, "gemini": 10.0, "vertex_ai": 15.0}
+DEFAULT_TEST_TIMEOUT = 10.0
+MAX_CONCURRENT_TESTS = 32
+
+# Helper functions
+def get_connections(owner: str) -> Dict:
+    """Get the owner's stored API connections metadata"""
     try:
-        connections = db.storage.json.get("api_connections_metadata", default={})
-        return connections
+        return conn_store.load_connections(owner)
     except Exception as e:
         print(f"Error getting connections: {str(e)}")
         return {}
 
-def save_connections(connections: Dict) -> None:
-    """Save API connections metadata"""
+def get_shared_connections() -> Dict:
+    """Get legacy connections that have no owner yet (read-only, see app.libs.connections)"""
     try:
-        db.storage.json.put("api_connections_metadata", connections)
+        return conn_store.load_shared_connections()
+    except Exception as e:
+        print(f"Error getting shared connections: {str(e)}")
+        return {}
+
+def get_usable_connections(owner: str) -> Tuple[Dict, Dict]:
+    """The owner's connections and the shared legacy ones (excluding any the owner now has)"""
+    connections = get_connections(owner)
+    shared = {conn_id: conn for conn_id, conn in get_shared_connections().items() if conn_id not in connections}
+    return connections, shared
+
+def check_not_shared(connection_id: str) -> None:
+    if connection_id in get_shared_connections():
+        raise HTTPException(status_code=403, detail="Shared legacy connections are read-only until an admin assigns them an owner")
+
+def save_connections(owner: str, connections: Dict) -> None:
+    """Save the owner's API connections metadata, dropping the chat clients resolved from the old ones"""
+    try:
+        conn_store.save_connections(owner, connections)
+        provider_clients.invalidate_user(owner)
     except Exception as e:
         print(f"Error saving connections: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to save connections: {str(e)}")
 
-def store_api_key(connection_id: str, api_key: str) -> None:
-    """Store API key securely"""
+async def store_api_key(connection_id: str, api_key: str) -> None:
+    """Store API key securely, replacing any cached copy and client built with the old key"""
     try:
-        key_name = f"API_CONNECTION_{sanitize_key(connection_id)}"
-        db.secrets.put(key_name, api_key)
+        await secrets_cache.put(api_key_name(connection_id), api_key)
+        provider_clients.invalidate(connection_id)
     except Exception as e:
         print(f"Error storing API key: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to store API key: {str(e)}")
 
-def get_api_key(connection_id: str) -> str:
-    """Get API key securely"""
+async def get_api_key(connection_id: str) -> str:
+    """Get API key securely (cached, see app.libs.secrets_cache)"""
     try:
-        key_name = f"API_CONNECTION_{sanitize_key(connection_id)}"
-        return db.secrets.get(key_name)
+        return await secrets_cache.get(api_key_name(connection_id))
     except Exception as e:
         print(f"Error getting API key: {str(e)}")
         return ""
 
+async def check_service_connection(client: ProviderClient) -> Tuple[str, str]:
+    """Call the provider to verify a connection's API key, returns (status, message)"""
+    service, api_key = client.service, client.api_key
+    status = "connected"
+    message = "Connection successful"
+    
+    # Implement service-specific connection tests
+    if service == "vertex_ai":
+        # Test Vertex AI connection
+        try:
+            headers = {"Authorization": f"Bearer {api_key}"}
+            response = await get_http_client().get(
+                f"{vertex_ai_base_url()}/projects",
+                headers=headers
+            )
+            if response.status_code != 200:
+                status = "failed"
+                message = f"Failed to connect to Vertex AI: {response.text}"
+        except Exception as e:
+            status = "failed"
+            message = f"Error connecting to Vertex AI: {str(e)}"
+    
+    elif service == "openai":
+        # Test OpenAI connection
+        try:
+            response = await client.openai().models.list()
+            if not response:
+                status = "failed"
+                message = "Failed to connect to OpenAI API"
+        except Exception as e:
+            status = "failed"
+            message = f"Error connecting to OpenAI: {str(e)}"
+    
+    elif service == "gemini":
+        # Test Gemini API connection
+        try:
+            url = f"{GEMINI_API_BASE_URL}/models?key={api_key}"
+            response = await get_http_client().get(url)
+            if response.status_code != 200:
+                status = "failed"
+                message = f"Failed to connect to Gemini API: {response.text}"
+        except Exception as e:
+            status = "failed"
+            message = f"Error connecting to Gemini API: {str(e)}"
+    
+    else:
+        # Generic connection test (just verify the key is not empty)
+        if not api_key:
+            status = "failed"
+            message = "API key is empty"
+    
+    return status, message
+
+async def run_connection_test(connection_id: str, service: str) -> Tuple[str, str]:
+    """Test the connection's client, with the service's timeout; returns (status, message)"""
+    client = await provider_clients.get(connection_id, service)
+    if client is None:
+        return "failed", "API key not found or empty"
+    timeout = SERVICE_TEST_TIMEOUTS.get(service, DEFAULT_TEST_TIMEOUT)
+    try:
+        return await asyncio.wait_for(check_service_connection(client), timeout)
+    except asyncio.TimeoutError:
+        return "failed", f"Connection test timed out after {timeout:g}s"
+
+async def save_test_results(owner: str, results: Dict[str, Tuple[str, str]]) -> None:
+    """Persist test statuses in one write, re-reading so concurrent edits aren't overwritten"""
+    if not results:
+        return
+    async with connections_lock(owner):
+        connections = await run_blocking(get_connections, owner)
+        for connection_id, (status, tested_at) in results.items():
+            if connection_id in connections:
+                connections[connection_id]["status"] = status
+                connections[connection_id]["last_tested"] = tested_at
+        await run_blocking(save_connections, owner, connections)
+
+def record_test_result(connection_id: str, status: str, message: str) -> None:
+    """Let a manual test open or close the connection's circuit breaker"""
+    breaker = health_monitor.breaker(connection_id)
+    if status == "connected":
+        breaker.record_success()
+    else:
+        breaker.record_failure(message)
+
+def watch_connection(connection_id: str, connection: Dict, owner: Optional[str]) -> None:
+    """Have the health monitor keep an in-use connection's breaker and stored status current"""
+    health_monitor.watch(connection_id, connection["service"], connection.get("status"), owner)
+
+async def save_health_results(results: Dict[str, Tuple[str, str]]) -> None:
+    """Save the monitor's verdicts, one write per owner (shared legacy connections aren't written)"""
+    by_owner: Dict[str, Dict[str, Tuple[str, str]]] = {}
+    for connection_id, result in results.items():
+        owner = health_monitor.owner(connection_id)
+        if owner is not None:
+            by_owner.setdefault(owner, {})[connection_id] = result
+    for owner, owner_results in by_owner.items():
+        await save_test_results(owner, owner_results)
+
+# Probe connections in the background and keep their circuit breakers current
+async def start_health_monitor() -> None:
+    health_monitor.start(run_connection_test, save_health_results)
+
+router.add_event_handler("startup", start_health_monitor)
+router.add_event_handler("shutdown", health_monitor.stop)
+
 # Endpoints
 @router.get("/connections", response_model=List[ApiConnectionResponse])
 async def list_connections(user: AuthorizedUser):
-    """List all API connections"""
+    """List the caller's API connections, followed by the shared legacy ones"""
     try:
-        connections = get_connections()
-        return [ApiConnectionResponse(id=conn_id, **conn_data) for conn_id, conn_data in connections.items()]
+        connections = await run_blocking(get_connections, user.sub)
+        shared = await run_blocking(get_shared_connections)
+        return [ApiConnectionResponse(id=conn_id, **conn_data) for conn_id, conn_data in connections.items()] + [
+            ApiConnectionResponse(id=conn_id, shared=True, **conn_data)
+            for conn_id, conn_data in shared.items()
+            if conn_id not in connections
+        ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -90,37 +249,55 @@ async def list_connections(user: AuthorizedUser):
 async def create_connection(connection: ApiConnectionCreate, user: AuthorizedUser):
     """Create a new API connection"""
     try:
-        connections = get_connections()
-        
-        # Generate a unique ID
-        connection_id = sanitize_key(f"{connection.service}_{len(connections) + 1}")
-        
-        # Store connection metadata
-        connections[connection_id] = {
-            "name": connection.name,
-            "service": connection.service,
-            "description": connection.description,
-            "status": "untested",
-            "last_tested": None
-        }
-        save_connections(connections)
+        async with connections_lock(user.sub):
+            connections = await run_blocking(get_connections, user.sub)
+            
+            # Generate a unique ID
+            connection_id = conn_store.new_connection_id(connection.service)
+            
+            # Store connection metadata
+            connections[connection_id] = {
+                "name": connection.name,
+                "service": connection.service,
+                "description": connection.description,
+                "status": "untested",
+                "last_tested": None
+            }
+            await run_blocking(save_connections, user.sub, connections)
         
         # Store API key securely
-        store_api_key(connection_id, connection.api_key)
+        await store_api_key(connection_id, connection.api_key)
+        watch_connection(connection_id, connections[connection_id], user.sub)
         
         return ApiConnectionResponse(id=connection_id, **connections[connection_id])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/connections/health")
+async def get_connections_health(user: AuthorizedUser) -> Dict[str, ApiConnectionHealth]:
+    """Circuit breaker state of each of the caller's connections, as maintained by the health monitor"""
+    try:
+        connections, shared = await run_blocking(get_usable_connections, user.sub)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        connection_id: ApiConnectionHealth(**health)
+        for connection_id, health in health_monitor.snapshot().items()
+        if connection_id in connections or connection_id in shared
+    }
+
 @router.get("/connections/{connection_id}", response_model=ApiConnectionResponse)
 async def get_connection(connection_id: str, user: AuthorizedUser):
     """Get API connection details"""
     try:
-        connections = get_connections()
-        if connection_id not in connections:
-            raise HTTPException(status_code=404, detail="Connection not found")
+        connections = await run_blocking(get_connections, user.sub)
+        if connection_id in connections:
+            return ApiConnectionResponse(id=connection_id, **connections[connection_id])
         
-        return ApiConnectionResponse(id=connection_id, **connections[connection_id])
+        shared = await run_blocking(get_shared_connections)
+        if connection_id not in shared:
+            raise HTTPException(status_code=404, detail="Connection not found")
+        return ApiConnectionResponse(id=connection_id, shared=True, **shared[connection_id])
     except HTTPException:
         raise
     except Exception as e:
@@ -130,23 +307,28 @@ async def get_connection(connection_id: str, user: AuthorizedUser):
 async def update_connection(connection_id: str, connection: ApiConnectionUpdate, user: AuthorizedUser):
     """Update an API connection"""
     try:
-        connections = get_connections()
-        if connection_id not in connections:
-            raise HTTPException(status_code=404, detail="Connection not found")
-        
-        # Update connection metadata
-        if connection.name is not None:
-            connections[connection_id]["name"] = connection.name
-        if connection.service is not None:
-            connections[connection_id]["service"] = connection.service
-        if connection.description is not None:
-            connections[connection_id]["description"] = connection.description
-        
-        save_connections(connections)
+        async with connections_lock(user.sub):
+            connections = await run_blocking(get_connections, user.sub)
+            if connection_id not in connections:
+                await run_blocking(check_not_shared, connection_id)
+                raise HTTPException(status_code=404, detail="Connection not found")
+            
+            # Update connection metadata
+            if connection.name is not None:
+                connections[connection_id]["name"] = connection.name
+            if connection.service is not None:
+                connections[connection_id]["service"] = connection.service
+            if connection.description is not None:
+                connections[connection_id]["description"] = connection.description
+            
+            await run_blocking(save_connections, user.sub, connections)
         
         # Update API key if provided
         if connection.api_key is not None:
-            store_api_key(connection_id, connection.api_key)
+            await store_api_key(connection_id, connection.api_key)
+            # A new key starts with a clean slate
+            health_monitor.forget(connection_id)
+        watch_connection(connection_id, connections[connection_id], user.sub)
         
         return ApiConnectionResponse(id=connection_id, **connections[connection_id])
     except HTTPException:
@@ -158,17 +340,20 @@ async def update_connection(connection_id: str, connection: ApiConnectionUpdate,
 async def delete_connection(connection_id: str, user: AuthorizedUser):
     """Delete an API connection"""
     try:
-        connections = get_connections()
-        if connection_id not in connections:
-            raise HTTPException(status_code=404, detail="Connection not found")
-        
-        # Delete connection metadata
-        del connections[connection_id]
-        save_connections(connections)
+        async with connections_lock(user.sub):
+            connections = await run_blocking(get_connections, user.sub)
+            if connection_id not in connections:
+                await run_blocking(check_not_shared, connection_id)
+                raise HTTPException(status_code=404, detail="Connection not found")
+            
+            # Delete connection metadata
+            del connections[connection_id]
+            await run_blocking(save_connections, user.sub, connections)
         
         # Delete API key - Note: Databutton doesn't have a method to delete secrets,
         # so we'll just overwrite it with an empty string
-        store_api_key(connection_id, "")
+        await store_api_key(connection_id, "")
+        health_monitor.forget(connection_id)
         
         return {"message": "Connection deleted successfully"}
     except HTTPException:
@@ -181,79 +366,17 @@ async def test_connection(test_request: ApiConnectionTest, user: AuthorizedUser)
     """Test an API connection"""
     try:
         connection_id = test_request.id
-        connections = get_connections()
+        own, shared = await run_blocking(get_usable_connections, user.sub)
+        connections = {**shared, **own}
         
         if connection_id not in connections:
             raise HTTPException(status_code=404, detail="Connection not found")
-        
-        # Get the API key
-        api_key = get_api_key(connection_id)
-        if not api_key:
-            return ApiConnectionTestResponse(
-                id=connection_id,
-                status="failed",
-                message="API key not found or empty"
-            )
+        watch_connection(connection_id, connections[connection_id], user.sub if connection_id in own else None)
         
         # Test connection based on service
-        service = connections[connection_id]["service"]
-        status = "connected"
-        message = "Connection successful"
-        
-        # Implement service-specific connection tests
-        if service == "vertex_ai":
-            # Test Vertex AI connection
-            import requests
-            try:
-                headers = {"Authorization": f"Bearer {api_key}"}
-                response = requests.get(
-                    "https://us-central1-aiplatform.googleapis.com/v1/projects",
-                    headers=headers
-                )
-                if response.status_code != 200:
-                    status = "failed"
-                    message = f"Failed to connect to Vertex AI: {response.text}"
-            except Exception as e:
-                status = "failed"
-                message = f"Error connecting to Vertex AI: {str(e)}"
-        
-        elif service == "openai":
-            # Test OpenAI connection
-            import openai
-            try:
-                client = openai.OpenAI(api_key=api_key)
-                response = client.models.list()
-                if not response:
-                    status = "failed"
-                    message = "Failed to connect to OpenAI API"
-            except Exception as e:
-                status = "failed"
-                message = f"Error connecting to OpenAI: {str(e)}"
-        
-        elif service == "gemini":
-            # Test Gemini API connection
-            import requests
-            try:
-                url = f"https://generativelanguage.googleapis.com/v1beta/models?key={api_key}"
-                response = requests.get(url)
-                if response.status_code != 200:
-                    status = "failed"
-                    message = f"Failed to connect to Gemini API: {response.text}"
-            except Exception as e:
-                status = "failed"
-                message = f"Error connecting to Gemini API: {str(e)}"
-        
-        else:
-            # Generic connection test (just verify the key is not empty)
-            if not api_key:
-                status = "failed"
-                message = "API key is empty"
-        
-        # Update connection status
-        from datetime import datetime
-        connections[connection_id]["status"] = status
-        connections[connection_id]["last_tested"] = datetime.now().isoformat()
-        save_connections(connections)
+        status, message = await run_connection_test(connection_id, connections[connection_id]["service"])
+        record_test_result(connection_id, status, message)
+        await save_test_results(user.sub, {connection_id: (status, datetime.now().isoformat())})
         
         return ApiConnectionTestResponse(
             id=connection_id,
@@ -264,3 +387,51 @@ async def test_connection(test_request: ApiConnectionTest, user: AuthorizedUser)
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/connections/test/bulk")
+async def test_connections_bulk(request: ApiConnectionBulkTest, user: AuthorizedUser):
+    """
+    Test several of the caller's connections at once (all of them unless ids are given).
+    Results stream back as NDJSON lines, one ApiConnectionTestResponse per
+    connection in the order they finish; statuses are saved in a single write
+    once all tests are done (shared legacy connections are tested but not updated).
+    """
+    try:
+        own, shared = await run_blocking(get_usable_connections, user.sub)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    connections = {**shared, **own}
+    
+    ids = request.ids if request.ids is not None else list(connections)
+    missing = [connection_id for connection_id in ids if connection_id not in connections]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Connections not found: {', '.join(missing)}")
+    for connection_id in ids:
+        watch_connection(connection_id, connections[connection_id], user.sub if connection_id in own else None)
+    
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TESTS)
+    
+    async def test_one(connection_id: str) -> ApiConnectionTestResponse:
+        async with semaphore:
+            try:
+                status, message = await run_connection_test(connection_id, connections[connection_id]["service"])
+            except Exception as e:
+                status, message = "failed", f"Error testing connection: {str(e)}"
+        record_test_result(connection_id, status, message)
+        return ApiConnectionTestResponse(id=connection_id, status=status, message=message)
+    
+    async def results():
+        tasks = [asyncio.create_task(test_one(connection_id)) for connection_id in dict.fromkeys(ids)]
+        finished: Dict[str, Tuple[str, str]] = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                finished[result.id] = (result.status, datetime.now().isoformat())
+                yield result.json() + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Keep what was learned even if the client went away; shielded so it completes
+            await asyncio.shield(save_test_results(user.sub, finished))
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
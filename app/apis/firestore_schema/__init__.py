@@ -5,22 +5,54 @@
 ## THEN READ THE INTERNAL STORAGE FILES THAT ARE GENERATED USING THE GET METHOD.
 
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+import asyncio
+import functools
+import os
 import firebase_admin
 from firebase_admin import credentials, firestore
-import databutton as db
+from app.libs.storage import storage, secrets
 import json
 import datetime
 import time
-from typing import Dict, Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple, TypeVar
+from app.libs.blocking import run_blocking
 
 router = APIRouter()
 
+T = TypeVar("T")
+
+# Firestore calls in flight at once per schema run; each one occupies a Firestore worker
+DEFAULT_PARALLELISM = int(os.environ.get("FIRESTORE_SCHEMA_PARALLELISM", "8"))
+MAX_PARALLELISM = 32
+
+# Firestore calls run on their own threads rather than the shared blocking I/O pool, so a
+# schema run can't hold every worker that request handlers need for storage
+_firestore_executor = ThreadPoolExecutor(max_workers=MAX_PARALLELISM, thread_name_prefix="firestore")
+
+
+async def run_firestore(fn: Callable[..., T], *args: Any) -> T:
+    """Run a blocking Firestore call on the Firestore thread pool and await the result"""
+    return await asyncio.get_running_loop().run_in_executor(_firestore_executor, functools.partial(fn, *args))
+
+# Per-collection results from earlier runs, reused while a collection's fingerprint is unchanged.
+# Not prefixed "firestore-schema-", which save_schema_files treats as old schema files.
+SCHEMA_CACHE_KEY = "firestore_schema_cache"
+# Cached collections are sampled again after this long even if their fingerprint matches,
+# since edits that keep the document count (and watermark) don't change it
+SCHEMA_CACHE_MAX_AGE = datetime.timedelta(hours=int(os.environ.get("FIRESTORE_SCHEMA_CACHE_MAX_AGE_HOURS", "24")))
+# Optional field holding each document's last-modified time (e.g. "updatedAt"); when set, the
+# newest value is part of the fingerprint, so edits are noticed without waiting for the max age
+WATERMARK_FIELD = os.environ.get("FIRESTORE_SCHEMA_WATERMARK_FIELD") or None
+
 
 class SchemaGenerationRequest(BaseModel):
     collections: Optional[List[str]] = None  # If provided, only analyze these collections
     depth: int = 3  # How deep to analyze nested subcollections
     sample_limit: int = 10  # Maximum number of documents to sample per collection
+    parallelism: int = Field(DEFAULT_PARALLELISM, ge=1, le=MAX_PARALLELISM)  # Collections analyzed concurrently
+    incremental: bool = True  # Reuse cached results for collections whose fingerprint hasn't changed
 
 
 class SchemaGenerationResponse(BaseModel):
@@ -48,7 +80,7 @@ def get_firestore_client():
             except ValueError:
                 # No app exists, initialize a new one
                 # Get the Firebase service account JSON from secrets
-                firebase_service_account = db.secrets.get("FIREBASE_SERVICE_ACCOUNT")
+                firebase_service_account = secrets.get("FIREBASE_SERVICE_ACCOUNT")
 
                 # Convert JSON string to dict if it's a string
                 if isinstance(firebase_service_account, str):
@@ -132,17 +164,23 @@ def merge_schemas(schema1: Dict[str, Any], schema2: Dict[str, Any]) -> Dict[str,
     return merged
 
 
-async def analyze_collection(db, collection_path: str, sample_limit: int = 10) -> Dict[str, Any]:
-    """Analyze a collection's schema by sampling documents"""
+def sample_collection(db, collection_path: str, sample_limit: int = 10) -> Tuple[Dict[str, Any], List[Any]]:
+    """
+    Sample a collection's documents once (blocking Firestore calls, one read per document).
+    Returns the schema inferred from them and their document references, so subcollections
+    can be discovered without reading the documents again.
+    """
     print(f"Analyzing collection: {collection_path}")
     collection_ref = db.collection(collection_path)
     docs = collection_ref.limit(sample_limit).stream()
 
     merged_schema = {}
     doc_count = 0
+    doc_refs = []
 
     for doc in docs:
         doc_count += 1
+        doc_refs.append(doc.reference)
         doc_data = doc.to_dict()
         doc_schema = analyze_document_schema(doc_data)
 
@@ -151,39 +189,139 @@ async def analyze_collection(db, collection_path: str, sample_limit: int = 10) -
         else:
             merged_schema = merge_schemas(merged_schema, doc_schema)
 
-    return {"document_count_sampled": doc_count, "fields": merged_schema}
+    return {"document_count_sampled": doc_count, "fields": merged_schema}, doc_refs
 
 
-async def analyze_collections_recursive(db, collection_paths: List[str], depth: int = 3, sample_limit: int = 10):
-    """Recursively analyze collections and their subcollections up to specified depth"""
-    result = {}
+def list_subcollection_ids(doc_ref) -> List[str]:
+    """IDs of a document's subcollections (blocking Firestore call, no document reads)"""
+    return [subcollection.id for subcollection in doc_ref.collections()]
 
-    for collection_path in collection_paths:
-        result[collection_path] = await analyze_collection(db, collection_path, sample_limit)
 
-        # Stop recursion if we've reached maximum depth
-        if depth <= 0:
-            continue
+def update_mark(doc) -> str:
+    return f"{doc.id}@{doc.update_time.isoformat()}"
+
 
-        # Get subcollections
-        collection_ref = db.collection(collection_path)
-        docs = collection_ref.limit(sample_limit).stream()
+def count_documents(db, collection_path: str) -> int:
+    """Number of documents in a collection, via a count aggregation (blocking Firestore call)"""
+    return int(db.collection(collection_path).count().get()[0][0].value)
 
-        for doc in docs:
-            subcollections = doc.reference.collections()
-            subcollection_paths = []
 
-            for subcollection in subcollections:
-                subcollection_path = f"{collection_path}/{doc.id}/{subcollection.id}"
-                subcollection_paths.append(subcollection_path)
+def collection_fingerprint(db, collection_path: str) -> Dict[str, Any]:
+    """
+    Cheap change marker for a collection (blocking Firestore calls): its document count,
+    from a count aggregation billed as one read per 1000 documents (at least one), and
+    with WATERMARK_FIELD set the newest document by that field, one more read. Projection
+    queries are billed per document like full reads, so no documents are fetched otherwise.
+    """
+    fingerprint: Dict[str, Any] = {"count": count_documents(db, collection_path)}
+    if WATERMARK_FIELD:
+        query = db.collection(collection_path).order_by(WATERMARK_FIELD, direction=firestore.Query.DESCENDING)
+        newest = list(query.limit(1).stream())
+        fingerprint["watermark"] = update_mark(newest[0]) if newest else None
+    return fingerprint
 
-            if subcollection_paths:
-                # Recursively analyze subcollections with reduced depth
-                subcollection_schemas = await analyze_collections_recursive(
-                    db, subcollection_paths, depth - 1, sample_limit
-                )
-                result.update(subcollection_schemas)
 
+def is_stale(entry: Dict[str, Any]) -> bool:
+    """Whether a cache entry is older than SCHEMA_CACHE_MAX_AGE"""
+    try:
+        return datetime.datetime.now() - datetime.datetime.fromisoformat(entry["analyzed_at"]) > SCHEMA_CACHE_MAX_AGE
+    except (KeyError, TypeError, ValueError):
+        return True
+
+
+async def list_subcollections(collection_path: str, doc_refs: List[Any], semaphore: asyncio.Semaphore) -> List[str]:
+    """Subcollection paths under the given documents, listed concurrently"""
+
+    async def list_one(doc_ref) -> List[str]:
+        async with semaphore:
+            subcollection_ids = await run_firestore(list_subcollection_ids, doc_ref)
+        return [f"{collection_path}/{doc_ref.id}/{subcollection_id}" for subcollection_id in subcollection_ids]
+
+    listings = await asyncio.gather(*(list_one(doc_ref) for doc_ref in doc_refs))
+    return [path for listing in listings for path in listing]
+
+
+async def analyze_collections_recursive(
+    db,
+    collection_paths: List[str],
+    depth: int = 3,
+    sample_limit: int = 10,
+    parallelism: int = DEFAULT_PARALLELISM,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    cache: Optional[Dict[str, Any]] = None,
+    stats: Optional[Dict[str, int]] = None,
+):
+    """
+    Recursively analyze collections and their subcollections up to specified depth.
+    Each collection's documents are read once, for both its schema and its subcollections.
+    Collections at every level are analyzed concurrently, with at most `parallelism`
+    Firestore calls in flight across the whole tree. Results keep the depth-first order
+    of a sequential walk: each collection followed by its subcollections.
+
+    With a `cache` (collection path -> entry, updated in place), each collection is
+    fingerprinted first and its cached schema is reused when the fingerprint matches and
+    the entry is younger than SCHEMA_CACHE_MAX_AGE, so only changed collections are
+    sampled again. Subcollections are listed again either way, under the documents the
+    last sample read, so new ones are found under unchanged collections.
+
+    Reads billed per collection: the fingerprint (see collection_fingerprint) whenever a
+    cache is used, plus `sample_limit` document reads when the collection is sampled.
+    Listing subcollections reads no documents. `stats` counts collections that were
+    "reanalyzed" or "reused".
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(parallelism)
+    if stats is None:
+        stats = {}
+
+    async def analyze_tree(collection_path: str) -> Dict[str, Any]:
+        entry = cache.get(collection_path) if cache is not None else None
+        if entry is not None and (entry.get("sample_limit") != sample_limit or is_stale(entry)):
+            entry = None
+        fingerprint = None
+        if cache is not None:
+            # Taken even without a usable entry: it is stored with the new sample
+            async with semaphore:
+                fingerprint = await run_firestore(collection_fingerprint, db, collection_path)
+            if entry is not None and (entry["fingerprint"] != fingerprint or "documents" not in entry):
+                entry = None
+
+        if entry is not None:
+            stats["reused"] = stats.get("reused", 0) + 1
+            schema = entry["schema"]
+            # References are built locally; nothing is read until their subcollections are listed
+            doc_refs = [db.collection(collection_path).document(doc_id) for doc_id in entry["documents"]]
+        else:
+            stats["reanalyzed"] = stats.get("reanalyzed", 0) + 1
+            async with semaphore:
+                schema, doc_refs = await run_firestore(sample_collection, db, collection_path, sample_limit)
+            if cache is not None:
+                cache[collection_path] = {
+                    "fingerprint": fingerprint,
+                    "sample_limit": sample_limit,
+                    "schema": schema,
+                    "documents": [doc_ref.id for doc_ref in doc_refs],
+                    "analyzed_at": datetime.datetime.now().isoformat(),
+                }
+        result = {collection_path: schema}
+
+        # Stop recursion if we've reached maximum depth
+        if depth <= 0:
+            return result
+
+        subcollection_paths = await list_subcollections(collection_path, doc_refs, semaphore)
+        if subcollection_paths:
+            # Recursively analyze subcollections with reduced depth; the slot is released
+            # first so nested levels can't starve waiting on their parents
+            result.update(await analyze_collections_recursive(
+                db, subcollection_paths, depth - 1, sample_limit, semaphore=semaphore,
+                cache=cache, stats=stats,
+            ))
+        return result
+
+    result = {}
+    for tree in await asyncio.gather(*(analyze_tree(path) for path in dict.fromkeys(collection_paths))):
+        result.update(tree)
     return result
 
 
@@ -191,55 +329,67 @@ async def analyze_collections_recursive(db, collection_paths: List[str], depth:
 async def generate_schema(request: SchemaGenerationRequest) -> SchemaGenerationResponse:
     """Generate schema from Firestore collections"""
     try:
-        firestore_db = get_firestore_client()
+        firestore_db = await run_firestore(get_firestore_client)
 
         # Get all top-level collections if not specified
         if not request.collections:
-            all_collections = firestore_db.collections()
-            collection_paths = [collection.id for collection in all_collections]
+            collection_paths = await run_firestore(
+                lambda: [collection.id for collection in firestore_db.collections()]
+            )
         else:
             collection_paths = request.collections
 
+        # A full (non-incremental) run starts from an empty cache and rebuilds it
+        cache = await run_blocking(load_schema_cache) if request.incremental else {}
+        stats = {"reanalyzed": 0, "reused": 0}
+
         # Analyze collections recursively
         schema = await analyze_collections_recursive(
-            firestore_db, collection_paths, request.depth, request.sample_limit
+            firestore_db, collection_paths, request.depth, request.sample_limit, request.parallelism,
+            cache=cache, stats=stats,
         )
 
+        # Drop cache entries for collections that no longer turned up under the walked roots
+        roots = collection_paths if request.collections else None
+        cache = {path: entry for path, entry in cache.items() if path in schema or not is_under(path, roots)}
+
+        if request.collections:
+            # Only some collections were analyzed; keep the rest of the previous schema
+            previous = await run_blocking(load_latest_schema)
+            previous_collections = (previous or {}).get("collections", {})
+            schema = {
+                **{path: data for path, data in previous_collections.items() if not is_under(path, roots)},
+                **schema,
+            }
+
         # Add metadata
         result = {
             "metadata": {
                 "generated_at": datetime.datetime.now().isoformat(),
                 "collections_analyzed": len(schema),
+                "collections_reanalyzed": stats["reanalyzed"],
+                "collections_reused": stats["reused"],
                 "depth": request.depth,
                 "sample_limit": request.sample_limit,
+                "parallelism": request.parallelism,
+                "incremental": request.incremental,
                 "timestamp": int(time.time()),
             },
             "collections": schema,
         }
 
-        # Delete previous schema files
-        all_json_files = db.storage.json.list()
-        for file in all_json_files:
-            if file.name.startswith("firestore-schema-"):
-                print(f"Deleting previous schema file: {file.name}")
-                db.storage.json.delete(file.name)
-
-        # Create dynamic filename with timestamp
-        schema_filename = f"firestore-schema-{int(time.time())}"
-
-        # Save schema to storage using databutton db
-        db.storage.json.put(schema_filename, result)
-
         # Generate Markdown structure diagram
         markdown_content = generate_structure_diagram(schema)
 
-        # Structure diagram automatically overwrites previous version
-        db.storage.text.put("firestore_structure_diagram", markdown_content)
+        await run_blocking(save_schema_files, result, markdown_content, cache)
 
         return SchemaGenerationResponse(
             status="success",
             schema_data=result,
-            message=f"Successfully analyzed {len(schema)} collections and saved schema and diagram to storage",
+            message=(
+                f"Successfully analyzed {len(schema)} collections ({stats['reanalyzed']} re-sampled, "
+                f"{stats['reused']} unchanged) and saved schema and diagram to storage"
+            ),
         )
 
     except Exception as e:
@@ -247,6 +397,54 @@ async def generate_schema(request: SchemaGenerationRequest) -> SchemaGenerationR
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def is_under(path: str, roots: Optional[List[str]]) -> bool:
+    """Whether a collection path is one of the roots or nested below one (every path when roots is None)"""
+    if roots is None:
+        return True
+    return any(path == root or path.startswith(f"{root}/") for root in roots)
+
+
+def load_schema_cache() -> Dict[str, Any]:
+    """Per-collection results of earlier runs (blocking storage call)"""
+    try:
+        return storage.json.get(SCHEMA_CACHE_KEY, default={})
+    except Exception as e:
+        print(f"Error loading schema cache, analyzing every collection: {str(e)}")
+        return {}
+
+
+def load_latest_schema() -> Optional[Dict[str, Any]]:
+    """The newest stored schema file, or None (blocking storage calls)"""
+    schema_files = [file.name for file in storage.json.list() if file.name.startswith("firestore-schema-")]
+    if not schema_files:
+        return None
+    # Sort by timestamp (newest first)
+    schema_files.sort(reverse=True)
+    return storage.json.get(schema_files[0])
+
+
+def save_schema_files(result: Dict[str, Any], markdown_content: str, cache: Optional[Dict[str, Any]] = None) -> None:
+    """Replace the stored schema, structure diagram and per-collection cache (blocking storage calls)"""
+    # Delete previous schema files
+    all_json_files = storage.json.list()
+    for file in all_json_files:
+        if file.name.startswith("firestore-schema-"):
+            print(f"Deleting previous schema file: {file.name}")
+            storage.json.delete(file.name)
+
+    # Create dynamic filename with timestamp
+    schema_filename = f"firestore-schema-{int(time.time())}"
+
+    # Save schema to storage
+    storage.json.put(schema_filename, result)
+
+    # Structure diagram automatically overwrites previous version
+    storage.text.put("firestore_structure_diagram", markdown_content)
+
+    if cache is not None:
+        storage.json.put(SCHEMA_CACHE_KEY, cache)
+
+
 def generate_structure_diagram(schema_data: Dict[str, Any]) -> str:
     """Generate a Markdown structure diagram from schema data"""
     markdown = '\n# Firestore Database Structure\n\n```\n{\n  "collections": {\n'
@@ -303,7 +501,7 @@ async def get_structure_diagram() -> Dict[str, Any]:
     """Get the structure diagram from storage"""
     try:
         # Get the structure diagram
-        diagram = db.storage.text.get("firestore_structure_diagram")
+        diagram = await run_blocking(storage.text.get, "firestore_structure_diagram")
 
         return {"status": "success", "diagram": diagram}
     except Exception as e:
@@ -319,7 +517,7 @@ async def get_schema() -> Dict[str, Any]:
     """Get the latest generated schema from storage"""
     try:
         # List all schema files
-        all_json_files = db.storage.json.list()
+        all_json_files = await run_blocking(storage.json.list)
         schema_files = [file.name for file in all_json_files if file.name.startswith("firestore-schema-")]
 
         # Sort by timestamp (newest first)
@@ -334,7 +532,7 @@ async def get_schema() -> Dict[str, Any]:
 
         # Get the latest schema
         latest_schema_file = schema_files[0]
-        schema = db.storage.json.get(latest_schema_file)
+        schema = await run_blocking(storage.json.get, latest_schema_file)
 
         return {
             "status": "success",
@@ -0,0 +1,83 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+import datetime
+from app.auth import AuthorizedUser
+from app.libs.usage import get_usage, usage_meter
+
+router = APIRouter()
+
+MAX_RANGE_DAYS = 366
+
+# Usage schemas
+class ModelUsage(BaseModel):
+    requests: int
+    promptTokens: int
+    completionTokens: int
+
+class DailyUsage(BaseModel):
+    date: str
+    requests: int
+    errors: int
+    cached: int
+    promptTokens: int
+    completionTokens: int
+    avgLatencyMs: float
+    models: Dict[str, ModelUsage]
+
+class UsageResponse(BaseModel):
+    start: str
+    end: str
+    days: List[DailyUsage]
+    totals: DailyUsage
+
+def to_daily_usage(rollup: dict) -> DailyUsage:
+    requests = rollup["requests"]
+    return DailyUsage(
+        date=rollup["date"],
+        requests=requests,
+        errors=rollup["errors"],
+        cached=rollup["cached"],
+        promptTokens=rollup["promptTokens"],
+        completionTokens=rollup["completionTokens"],
+        avgLatencyMs=round(rollup["latencyMsTotal"] / requests, 1) if requests else 0.0,
+        models=rollup["models"],
+    )
+
+def sum_rollups(rollups: List[dict], label: str) -> dict:
+    totals = {"date": label, "requests": 0, "errors": 0, "cached": 0, "promptTokens": 0,
+              "completionTokens": 0, "latencyMsTotal": 0.0, "models": {}}
+    for rollup in rollups:
+        for field in ("requests", "errors", "cached", "promptTokens", "completionTokens", "latencyMsTotal"):
+            totals[field] += rollup[field]
+        for name, usage in rollup["models"].items():
+            model_totals = totals["models"].setdefault(name, {"requests": 0, "promptTokens": 0, "completionTokens": 0})
+            for field in model_totals:
+                model_totals[field] += usage[field]
+    return totals
+
+@router.get("/usage")
+async def get_my_usage(user: AuthorizedUser, start: Optional[datetime.date] = None,
+                       end: Optional[datetime.date] = None) -> UsageResponse:
+    """
+    AI usage for the current user: requests, tokens and latency per day (UTC),
+    defaulting to the last 30 days.
+    """
+    end = end or datetime.datetime.now(datetime.timezone.utc).date()
+    start = start or end - datetime.timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_RANGE_DAYS} days can be requested at once")
+    
+    try:
+        rollups = await get_usage(usage_meter, user.sub, start, end)
+        return UsageResponse(
+            start=start.isoformat(),
+            end=end.isoformat(),
+            days=[to_daily_usage(rollup) for rollup in rollups],
+            totals=to_daily_usage(sum_rollups(rollups, "total")),
+        )
+    except Exception as e:
+        print(f"Error getting usage: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
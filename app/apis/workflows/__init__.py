@@ -1,11 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel, Field
-from typing import Dict, List, Optional, Any, Union
-import databutton as db
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, List, Optional, Any, Tuple, Union
+from app.libs.storage import storage
+from app.libs.storage_utils import KeyedLocks, sanitize_key
 import json
-import re
+import orjson
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from app.auth import AuthorizedUser
+from app.libs.blocking import run_blocking
+from app.libs.workflow_codec import encode_document, to_json_bytes
+from app.libs import workflow_history
+from app.libs.workflow_search import WorkflowSearchIndex, index_entry, shard_of
 from random import randint
 
 router = APIRouter()
@@ -42,6 +53,7 @@ class Workflow(BaseModel):
     createdAt: str = Field(default_factory=lambda: datetime.now().isoformat())
     updatedAt: Optional[str] = None
     createdBy: Optional[str] = None
+    version: int = 0  # Incremented on every save, exposed as the ETag
 
 class WorkflowCreate(BaseModel):
     name: str
@@ -55,6 +67,32 @@ class WorkflowUpdate(BaseModel):
     nodes: Optional[List[WorkflowNode]] = None
     edges: Optional[List[WorkflowEdge]] = None
 
+class WorkflowVersionInfo(BaseModel):
+    version: int
+    kind: str  # 'snapshot' or 'delta'
+    savedAt: Optional[str] = None
+    size: int
+
+class WorkflowSearchResult(BaseModel):
+    id: str
+    name: Optional[str] = None
+    description: Optional[str] = None
+    score: float
+
+class WorkflowSearchResponse(BaseModel):
+    results: List[WorkflowSearchResult]
+    truncated: bool = False  # True when a broad prefix left matches out; refine the query to see them
+
+class WorkflowImportError(BaseModel):
+    line: int
+    error: str
+
+class WorkflowImportResult(BaseModel):
+    imported: int
+    failed: int
+    errors: List[WorkflowImportError]
+    truncatedErrors: bool = False  # True when more errors occurred than are listed
+
 class WorkflowExecuteInput(BaseModel):
     workflowId: str
     input: Dict[str, Any] = Field(default_factory=dict)
@@ -70,36 +108,270 @@ class WorkflowExecuteResult(BaseModel):
     nodeResults: Optional[Dict[str, Any]] = None
 
 # Helper functions
-def sanitize_key(key: str) -> str:
-    """Sanitize storage key to only allow alphanumeric and ._- symbols"""
-    return re.sub(r'[^a-zA-Z0-9._-]', '', key)
+# Workflows are stored one document per key in the compact format from
+# app.libs.workflow_codec, plus a small per-user index holding the current version
+# and content hash of each workflow. Validation happens once on write; read paths hand
+# canonical JSON bytes (cached per version and content hash) straight back to the client.
+#
+# Storage calls are blocking, so endpoints run them through run_blocking. Changes
+# to a user's index are serialized with a per-user lock, since the read-modify-write
+# now spans several awaits.
+WORKFLOW_BYTES_CACHE_SIZE = 512
+_workflow_bytes_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+_workflow_bytes_cache_lock = threading.Lock()
+_index_locks = KeyedLocks()
+
+def workflow_index_lock(user_id: str) -> asyncio.Lock:
+    """Lock guarding updates to one user's workflow index"""
+    return _index_locks.get(user_id)
+
+def workflow_index_key(user_id: str) -> str:
+    return f"workflows_index_{sanitize_key(user_id)}"
+
+def workflow_doc_key(user_id: str, workflow_id: str) -> str:
+    return f"workflow_{sanitize_key(user_id)}_{sanitize_key(workflow_id)}"
+
+def content_hash(data: bytes) -> str:
+    """Short hash of a workflow's canonical JSON bytes"""
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+def _cache_workflow_bytes(doc_key: str, version: int, data: bytes) -> str:
+    """Cache a revision's bytes under their content hash, and return the hash"""
+    digest = content_hash(data)
+    with _workflow_bytes_cache_lock:
+        _workflow_bytes_cache[(doc_key, version, digest)] = data
+        _workflow_bytes_cache.move_to_end((doc_key, version, digest))
+        while len(_workflow_bytes_cache) > WORKFLOW_BYTES_CACHE_SIZE:
+            _workflow_bytes_cache.popitem(last=False)
+    return digest
+
+def migrate_legacy_workflows(user_id: str) -> Dict[str, Dict[str, Any]]:
+    """Move workflows from the old single-blob layout to per-workflow documents"""
+    legacy_key = f"workflows_{sanitize_key(user_id)}"
+    legacy = storage.json.get(legacy_key, default={})
+    if not legacy:
+        return {}
+    
+    index = {}
+    for workflow_id, data in legacy.items():
+        workflow = Workflow(**data)
+        _, digest = store_workflow(user_id, workflow)
+        index[workflow_id] = {"version": workflow.version, "hash": digest}
+    save_workflow_index(user_id, index)
+    storage.json.delete(legacy_key)
+    print(f"Migrated {len(index)} workflows to per-workflow storage")
+    return index
 
-def get_workflows(user_id: str) -> Dict[str, Workflow]:
-    """Get stored workflows for a user"""
+def get_workflow_index(user_id: str) -> Dict[str, Dict[str, Any]]:
+    """Get the workflow index (id -> version info) for a user"""
     try:
-        storage_key = f"workflows_{sanitize_key(user_id)}"
-        workflows = db.storage.json.get(storage_key, default={})
-        return workflows
+        index = storage.json.get(workflow_index_key(user_id), default={})
+        if not index:
+            index = migrate_legacy_workflows(user_id)
+        return index
     except Exception as e:
         print(f"Error getting workflows: {str(e)}")
         return {}
 
-def save_workflows(user_id: str, workflows: Dict[str, Workflow]) -> None:
-    """Save workflows for a user"""
+def save_workflow_index(user_id: str, index: Dict[str, Dict[str, Any]]) -> None:
+    """Save the workflow index for a user"""
     try:
-        storage_key = f"workflows_{sanitize_key(user_id)}"
-        db.storage.json.put(storage_key, workflows)
+        storage.json.put(workflow_index_key(user_id), index)
     except Exception as e:
         print(f"Error saving workflows: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to save workflows: {str(e)}")
 
+def load_workflow_revision(user_id: str, workflow_id: str, entry: Dict[str, Any]) -> Tuple[bytes, str]:
+    """Get the stored JSON bytes of a workflow's index entry and their content hash, served from cache when possible"""
+    doc_key = workflow_doc_key(user_id, workflow_id)
+    cache_key = (doc_key, entry["version"], entry["hash"])
+    with _workflow_bytes_cache_lock:
+        cached = _workflow_bytes_cache.get(cache_key)
+        if cached is not None:
+            _workflow_bytes_cache.move_to_end(cache_key)
+            return cached, entry["hash"]
+    
+    data = to_json_bytes(storage.binary.get(doc_key))
+    return data, _cache_workflow_bytes(doc_key, entry["version"], data)
+
+def load_workflow_bytes(user_id: str, workflow_id: str, entry: Dict[str, Any]) -> bytes:
+    """Get the stored JSON bytes of a workflow's index entry, served from cache when possible"""
+    return load_workflow_revision(user_id, workflow_id, entry)[0]
+
+def load_all_workflow_bytes(user_id: str, index: Dict[str, Dict[str, Any]]) -> List[bytes]:
+    """Get the stored JSON bytes of every workflow in an index"""
+    return [load_workflow_bytes(user_id, workflow_id, entry) for workflow_id, entry in index.items()]
+
+def load_workflow(user_id: str, workflow_id: str, entry: Dict[str, Any]) -> Workflow:
+    """Get a stored workflow as a model, for paths that need to work with it"""
+    return Workflow(**orjson.loads(load_workflow_bytes(user_id, workflow_id, entry)))
+
+def store_workflow(user_id: str, workflow: Workflow) -> Tuple[bytes, str]:
+    """Write a validated workflow and return its canonical JSON bytes and their content hash"""
+    try:
+        doc = workflow.dict()
+        doc_key = workflow_doc_key(user_id, workflow.id)
+        storage.binary.put(doc_key, encode_document(doc))
+        
+        data = orjson.dumps(doc, option=orjson.OPT_SORT_KEYS)
+        return data, _cache_workflow_bytes(doc_key, workflow.version, data)
+    except Exception as e:
+        print(f"Error saving workflows: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to save workflows: {str(e)}")
+
+def record_history(user_id: str, previous: Optional[Workflow], current: Workflow) -> None:
+    """Add a saved workflow to its version history; failures don't fail the save"""
+    try:
+        workflow_history.record_version(
+            user_id, previous.dict() if previous is not None else None, current.dict()
+        )
+    except Exception as e:
+        print(f"Error recording workflow history: {str(e)}")
+
+# Search indexes are loaded once per process and then updated in place on writes
+# (like the index lock above, this assumes one process serves a user's workflows);
+# a failed update drops the cached copy so the next search reloads it. The stored
+# forward index is split into SEARCH_INDEX_SHARDS shards by workflow id, so a write
+# rewrites one shard; the key without a shard number holds {"shards": n}.
+SEARCH_INDEX_SHARDS = 64
+_search_indexes: Dict[str, WorkflowSearchIndex] = {}
+
+def workflow_search_key(user_id: str) -> str:
+    return f"workflows_search_{sanitize_key(user_id)}"
+
+def workflow_search_shard_key(user_id: str, shard: int) -> str:
+    return f"workflows_search.{shard}_{sanitize_key(user_id)}"
+
+def save_search_index(user_id: str, search_index: WorkflowSearchIndex) -> None:
+    """Write every shard of a user's search index"""
+    for shard, data in enumerate(search_index.to_shards(SEARCH_INDEX_SHARDS)):
+        storage.json.put(workflow_search_shard_key(user_id, shard), data)
+    storage.json.put(workflow_search_key(user_id), {"shards": SEARCH_INDEX_SHARDS})
+
+def load_search_index(user_id: str, cache: bool = True) -> WorkflowSearchIndex:
+    """Load a user's search index from storage, building it if it doesn't exist yet"""
+    data = storage.json.get(workflow_search_key(user_id), default={})
+    if data.get("shards") == SEARCH_INDEX_SHARDS:
+        search_index = WorkflowSearchIndex.from_shards(
+            storage.json.get(workflow_search_shard_key(user_id, shard), default={})
+            for shard in range(SEARCH_INDEX_SHARDS)
+        )
+    else:
+        search_index = WorkflowSearchIndex()
+        for workflow_id, entry in get_workflow_index(user_id).items():
+            search_index.add(orjson.loads(load_workflow_bytes(user_id, workflow_id, entry)))
+        save_search_index(user_id, search_index)
+    
+    if cache:
+        _search_indexes[user_id] = search_index
+    return search_index
+
+def get_search_index(user_id: str) -> WorkflowSearchIndex:
+    """Get a user's search index, from the process cache once loaded"""
+    cached = _search_indexes.get(user_id)
+    if cached is not None:
+        return cached
+    return load_search_index(user_id)
+
+def update_search_index(
+    user_id: str,
+    workflows: Optional[List[Dict[str, Any]]] = None,
+    removed_ids: Optional[List[str]] = None,
+) -> None:
+    """Apply workflow changes to the search index, rewriting only the shards they fall in.
+    
+    Failures don't fail the save.
+    """
+    try:
+        if storage.json.get(workflow_search_key(user_id), default={}).get("shards") != SEARCH_INDEX_SHARDS:
+            # Not stored sharded yet; building it picks up these (already stored) changes
+            load_search_index(user_id)
+            return
+        
+        entries: Dict[str, Optional[Dict[str, Any]]] = {workflow_id: None for workflow_id in removed_ids or []}
+        for workflow in workflows or []:
+            entries[workflow["id"]] = index_entry(workflow)
+        by_shard: Dict[int, Dict[str, Optional[Dict[str, Any]]]] = {}
+        for workflow_id, entry in entries.items():
+            by_shard.setdefault(shard_of(workflow_id, SEARCH_INDEX_SHARDS), {})[workflow_id] = entry
+        
+        for shard, shard_entries in by_shard.items():
+            shard_key = workflow_search_shard_key(user_id, shard)
+            docs = storage.json.get(shard_key, default={}).get("docs", {})
+            for workflow_id, entry in shard_entries.items():
+                if entry is None:
+                    docs.pop(workflow_id, None)
+                else:
+                    docs[workflow_id] = entry
+            storage.json.put(shard_key, {"docs": docs})
+        
+        cached = _search_indexes.get(user_id)
+        if cached is not None:
+            for workflow_id, entry in entries.items():
+                if entry is None:
+                    cached.remove(workflow_id)
+                else:
+                    cached.set_entry(workflow_id, entry)
+    except Exception as e:
+        _search_indexes.pop(user_id, None)
+        print(f"Error updating workflow search index: {str(e)}")
+
+def commit_workflow(
+    user_id: str,
+    index: Dict[str, Dict[str, Any]],
+    previous: Optional[Workflow],
+    workflow: Workflow,
+) -> bytes:
+    """Store a new workflow revision and update the index, history and search index"""
+    data, digest = store_workflow(user_id, workflow)
+    index[workflow.id] = {"version": workflow.version, "hash": digest}
+    save_workflow_index(user_id, index)
+    record_history(user_id, previous, workflow)
+    update_search_index(user_id, workflows=[workflow.dict()])
+    return data
+
+def remove_workflow(user_id: str, index: Dict[str, Dict[str, Any]], workflow_id: str) -> None:
+    """Delete a workflow with its history and search entry"""
+    del index[workflow_id]
+    save_workflow_index(user_id, index)
+    storage.binary.delete(workflow_doc_key(user_id, workflow_id))
+    workflow_history.delete_history(user_id, workflow_id)
+    update_search_index(user_id, removed_ids=[workflow_id])
+
+def workflow_response(data: bytes, etag: str) -> Response:
+    """Return stored workflow bytes as-is, without re-validating or re-serializing"""
+    return Response(content=data, media_type="application/json", headers={"ETag": etag})
+
+def workflow_etag(workflow_id: str, version: int, digest: str) -> str:
+    """Build the ETag for a stored workflow revision from its version and content hash"""
+    return f'"{workflow_id}.{version}.{digest}"'
+
+def etag_matches(header: Optional[str], etag: str, strong: bool = False) -> bool:
+    """Check an If-Match (strong) / If-None-Match (weak) header value against an ETag"""
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            # Weak comparison: W/"x" and "x" refer to the same revision. A weak
+            # validator never matches under strong comparison (RFC 7232).
+            if strong:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
 # Endpoints
 @router.get("/workflows", response_model=List[Workflow])
 async def list_workflows(user: AuthorizedUser):
     """List all workflows for a user"""
     try:
-        workflows = get_workflows(user.sub)
-        return list(workflows.values())
+        index = await run_blocking(get_workflow_index, user.sub)
+        docs = await run_blocking(load_all_workflow_bytes, user.sub, index)
+        return Response(content=b"[" + b",".join(docs) + b"]", media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -107,65 +379,307 @@ async def list_workflows(user: AuthorizedUser):
 async def create_workflow(workflow: WorkflowCreate, user: AuthorizedUser):
     """Create a new workflow"""
     try:
-        workflows = get_workflows(user.sub)
-        
-        # Generate a unique ID
-        workflow_id = f"wf_{len(workflows) + 1}_{int(datetime.now().timestamp())}"
+        async with workflow_index_lock(user.sub):
+            index = await run_blocking(get_workflow_index, user.sub)
+            
+            # Generate a unique ID
+            workflow_id = f"wf_{len(index) + 1}_{int(datetime.now().timestamp())}"
+            
+            # Create workflow object
+            new_workflow = Workflow(
+                id=workflow_id,
+                name=workflow.name,
+                description=workflow.description,
+                nodes=workflow.nodes,
+                edges=workflow.edges,
+                createdAt=datetime.now().isoformat(),
+                updatedAt=datetime.now().isoformat(),
+                createdBy=user.sub,
+                version=1
+            )
+            
+            # Store workflow
+            data = await run_blocking(commit_workflow, user.sub, index, None, new_workflow)
         
-        # Create workflow object
-        new_workflow = Workflow(
-            id=workflow_id,
-            name=workflow.name,
-            description=workflow.description,
-            nodes=workflow.nodes,
-            edges=workflow.edges,
-            createdAt=datetime.now().isoformat(),
-            updatedAt=datetime.now().isoformat(),
-            createdBy=user.sub
-        )
+        return workflow_response(data, workflow_etag(workflow_id, new_workflow.version, index[workflow_id]["hash"]))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/workflows/search", response_model=WorkflowSearchResponse)
+async def search_workflows(user: AuthorizedUser, q: str, limit: int = 20):
+    """Search workflows by name, description, node labels, node types, models and URLs.
+    
+    Every word in the query must match the start of an indexed term; results are
+    ranked by where the terms were found (name > labels > description/types > URLs).
+    `truncated` is set when a very short prefix matched too many terms to consider
+    them all, so the results may be incomplete.
+    """
+    try:
+        search_index = await run_blocking(get_search_index, user.sub)
+        return search_index.search(q, limit=max(1, min(limit, 100)))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Bulk import/export
+IMPORT_BATCH_SIZE = 100
+IMPORT_MAX_LINE_BYTES = 16 * 1024 * 1024
+IMPORT_MAX_REPORTED_ERRORS = 100
+
+@router.get("/workflows/export")
+async def export_workflows(user: AuthorizedUser):
+    """Export all workflows as NDJSON, one workflow per line, streamed as it is read"""
+    try:
+        index = await run_blocking(get_workflow_index, user.sub)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def generate():
+        for workflow_id, entry in index.items():
+            yield await run_blocking(load_workflow_bytes, user.sub, workflow_id, entry) + b"\n"
+    
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="workflows.ndjson"'},
+    )
+
+async def iter_ndjson_lines(request: Request):
+    """Yield (line number, bytes) for each non-empty line of a streamed request body"""
+    # Pieces of the line still being received; joined once it ends, so a long line
+    # arriving in many small chunks is copied once rather than once per chunk
+    pending: List[bytes] = []
+    pending_size = 0
+    line_number = 0
+    async for chunk in request.stream():
+        start = 0
+        end = chunk.find(b"\n")
+        while end != -1:
+            pending.append(chunk[start:end])
+            line = b"".join(pending)
+            pending, pending_size = [], 0
+            line_number += 1
+            if len(line) > IMPORT_MAX_LINE_BYTES:
+                raise HTTPException(status_code=413, detail=f"Line {line_number} exceeds the maximum record size")
+            if line.strip():
+                yield line_number, line
+            start = end + 1
+            end = chunk.find(b"\n", start)
+        if start < len(chunk):
+            pending.append(chunk[start:])
+            pending_size += len(chunk) - start
+            if pending_size > IMPORT_MAX_LINE_BYTES:
+                raise HTTPException(status_code=413, detail=f"Line {line_number + 1} exceeds the maximum record size")
+    line = b"".join(pending)
+    if line.strip():
+        yield line_number + 1, line
+
+@router.post("/workflows/import", response_model=WorkflowImportResult)
+async def import_workflows(request: Request, user: AuthorizedUser):
+    """Import workflows from an NDJSON request body.
+    
+    Each line is validated on its own and becomes a new workflow with a fresh ID.
+    Invalid lines are skipped and reported; the index is written once per batch.
+    A line over IMPORT_MAX_LINE_BYTES stops the import with a 413, keeping the
+    workflows imported before it.
+    """
+    try:
+        imported = 0
+        failed = 0
+        errors = []
         
-        # Store workflow
-        workflows[workflow_id] = new_workflow.dict()
-        save_workflows(user.sub, workflows)
+        async with workflow_index_lock(user.sub):
+            index = await run_blocking(get_workflow_index, user.sub)
+            batch: List[Workflow] = []
+            
+            def flush():
+                save_workflow_index(user.sub, index)
+                for workflow in batch:
+                    record_history(user.sub, None, workflow)
+                update_search_index(user.sub, workflows=[workflow.dict() for workflow in batch])
+            
+            try:
+                async for line_number, line in iter_ndjson_lines(request):
+                    try:
+                        record = WorkflowCreate(**orjson.loads(line))
+                        now = datetime.now().isoformat()
+                        new_workflow = Workflow(
+                            id=f"wf_{len(index) + 1}_{int(datetime.now().timestamp())}",
+                            name=record.name,
+                            description=record.description,
+                            nodes=record.nodes,
+                            edges=record.edges,
+                            createdAt=now,
+                            updatedAt=now,
+                            createdBy=user.sub,
+                            version=1
+                        )
+                        _, digest = await run_blocking(store_workflow, user.sub, new_workflow)
+                    except Exception as e:
+                        failed += 1
+                        if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+                            errors.append(WorkflowImportError(line=line_number, error=str(e)))
+                        continue
+                    
+                    index[new_workflow.id] = {"version": new_workflow.version, "hash": digest}
+                    batch.append(new_workflow)
+                    imported += 1
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        await run_blocking(flush)
+                        batch = []
+            finally:
+                # Also on a rejected line, so workflows already written stay listed and searchable
+                if batch:
+                    await run_blocking(flush)
         
-        return new_workflow
+        return WorkflowImportResult(
+            imported=imported,
+            failed=failed,
+            errors=errors,
+            truncatedErrors=failed > len(errors),
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/workflows/{workflow_id}", response_model=Workflow)
-async def get_workflow(workflow_id: str, user: AuthorizedUser):
+async def get_workflow(
+    workflow_id: str,
+    user: AuthorizedUser,
+    if_none_match: Optional[str] = Header(None),
+):
     """Get workflow details"""
     try:
-        workflows = get_workflows(user.sub)
-        if workflow_id not in workflows:
+        index = await run_blocking(get_workflow_index, user.sub)
+        if workflow_id not in index:
             raise HTTPException(status_code=404, detail="Workflow not found")
         
-        return Workflow(**workflows[workflow_id])
+        entry = index[workflow_id]
+        
+        # Client already has this revision, skip loading the document entirely
+        etag = workflow_etag(workflow_id, entry["version"], entry["hash"])
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        data = await run_blocking(load_workflow_bytes, user.sub, workflow_id, entry)
+        return workflow_response(data, etag)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/workflows/{workflow_id}", response_model=Workflow)
-async def update_workflow(workflow_id: str, workflow: WorkflowUpdate, user: AuthorizedUser):
-    """Update a workflow"""
+async def update_workflow(
+    workflow_id: str,
+    workflow: WorkflowUpdate,
+    user: AuthorizedUser,
+    if_match: Optional[str] = Header(None),
+):
+    """Update a workflow.
+    
+    When an If-Match header is sent, the update is only applied if it matches
+    the stored revision; otherwise 412 is returned so the client can reload.
+    """
     try:
-        workflows = get_workflows(user.sub)
-        if workflow_id not in workflows:
-            raise HTTPException(status_code=404, detail="Workflow not found")
+        async with workflow_index_lock(user.sub):
+            index = await run_blocking(get_workflow_index, user.sub)
+            if workflow_id not in index:
+                raise HTTPException(status_code=404, detail="Workflow not found")
+            
+            # Optimistic concurrency check
+            current_entry = index[workflow_id]
+            current_version = current_entry["version"]
+            current_data, current_digest = await run_blocking(load_workflow_revision, user.sub, workflow_id, current_entry)
+            current_etag = workflow_etag(workflow_id, current_version, current_digest)
+            if if_match is not None and not etag_matches(if_match, current_etag, strong=True):
+                raise HTTPException(
+                    status_code=412,
+                    detail="Workflow has been modified since it was loaded",
+                    headers={"ETag": current_etag},
+                )
+            
+            current_workflow = Workflow(**orjson.loads(current_data))
+            
+            # Update fields if provided, re-validating the merged document
+            update_data = workflow.dict(exclude_unset=True)
+            try:
+                updated_workflow = Workflow(**{**current_workflow.dict(), **update_data})
+            except ValidationError as e:
+                # E.g. an explicit null for a field every workflow must have
+                raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
+            updated_workflow.updatedAt = datetime.now().isoformat()
+            updated_workflow.version = current_version + 1
+            
+            # Store updated workflow
+            data = await run_blocking(commit_workflow, user.sub, index, current_workflow, updated_workflow)
         
-        current_workflow = Workflow(**workflows[workflow_id])
+        return workflow_response(data, workflow_etag(workflow_id, updated_workflow.version, index[workflow_id]["hash"]))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.patch("/workflows/{workflow_id}", response_model=Workflow)
+async def patch_workflow(
+    workflow_id: str,
+    workflow: WorkflowUpdate,
+    user: AuthorizedUser,
+    if_match: Optional[str] = Header(None),
+):
+    """Partially update a workflow (same semantics as PUT, only set fields change)"""
+    return await update_workflow(workflow_id, workflow, user, if_match)
+
+@router.get("/workflows/{workflow_id}/versions", response_model=List[WorkflowVersionInfo])
+async def list_workflow_versions(workflow_id: str, user: AuthorizedUser):
+    """List the retained versions of a workflow, oldest first"""
+    try:
+        index = await run_blocking(get_workflow_index, user.sub)
+        if workflow_id not in index:
+            raise HTTPException(status_code=404, detail="Workflow not found")
         
-        # Update fields if provided
-        update_data = workflow.dict(exclude_unset=True)
-        updated_workflow = current_workflow.copy(update=update_data)
-        updated_workflow.updatedAt = datetime.now().isoformat()
+        return await run_blocking(workflow_history.list_versions, user.sub, workflow_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/workflows/{workflow_id}/versions/{version}", response_model=Workflow)
+async def get_workflow_version(workflow_id: str, version: int, user: AuthorizedUser):
+    """Get a workflow as it was at a given version"""
+    try:
+        doc = await run_blocking(workflow_history.get_version, user.sub, workflow_id, version)
+        if doc is None:
+            raise HTTPException(status_code=404, detail="Workflow version not found")
         
-        # Store updated workflow
-        workflows[workflow_id] = updated_workflow.dict()
-        save_workflows(user.sub, workflows)
+        data = orjson.dumps(doc, option=orjson.OPT_SORT_KEYS)
+        return Response(
+            content=data,
+            media_type="application/json",
+            headers={"ETag": workflow_etag(workflow_id, version, content_hash(data))},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/workflows/{workflow_id}/diff")
+async def diff_workflow_versions(
+    workflow_id: str, from_version: int, to_version: int, user: AuthorizedUser
+) -> Dict[str, Any]:
+    """Compare two versions of a workflow"""
+    try:
+        old, new = await asyncio.gather(
+            run_blocking(workflow_history.get_version, user.sub, workflow_id, from_version),
+            run_blocking(workflow_history.get_version, user.sub, workflow_id, to_version),
+        )
+        if old is None or new is None:
+            raise HTTPException(status_code=404, detail="Workflow version not found")
         
-        return updated_workflow
+        return {
+            "fromVersion": from_version,
+            "toVersion": to_version,
+            **workflow_history.diff_documents(old, new),
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -175,13 +689,13 @@ async def update_workflow(workflow_id: str, workflow: WorkflowUpdate, user: Auth
 async def delete_workflow(workflow_id: str, user: AuthorizedUser):
     """Delete a workflow"""
     try:
-        workflows = get_workflows(user.sub)
-        if workflow_id not in workflows:
-            raise HTTPException(status_code=404, detail="Workflow not found")
-        
-        # Delete workflow
-        del workflows[workflow_id]
-        save_workflows(user.sub, workflows)
+        async with workflow_index_lock(user.sub):
+            index = await run_blocking(get_workflow_index, user.sub)
+            if workflow_id not in index:
+                raise HTTPException(status_code=404, detail="Workflow not found")
+            
+            # Delete workflow
+            await run_blocking(remove_workflow, user.sub, index, workflow_id)
         
         return {"message": "Workflow deleted successfully"}
     except HTTPException:
@@ -197,11 +711,11 @@ async def execute_workflow(execute_input: WorkflowExecuteInput, user: Authorized
         input_data = execute_input.input
         
         # Get the workflow
-        workflows = get_workflows(user.sub)
-        if workflow_id not in workflows:
+        index = await run_blocking(get_workflow_index, user.sub)
+        if workflow_id not in index:
             raise HTTPException(status_code=404, detail="Workflow not found")
         
-        workflow = Workflow(**workflows[workflow_id])
+        workflow = await run_blocking(load_workflow, user.sub, workflow_id, index[workflow_id])
         
         # Generate an execution ID
         execution_id = f"exec_{workflow_id}_{int(datetime.now().timestamp())}"
@@ -6,6 +6,10 @@ if mode == Mode.PROD:
     print("Running in deployed service")
 else:
     print("Running in development workspace")
+
+Storage backend (see app.libs.storage), selected with STORAGE_BACKEND:
+
+from app.env import StorageBackend, storage_backend
 """
 
 import os
@@ -19,7 +23,18 @@ class Mode(str, Enum):
 
 mode = Mode.PROD if os.environ.get("DATABUTTON_SERVICE_TYPE") == "prodx" else Mode.DEV
 
+
+class StorageBackend(str, Enum):
+    DATABUTTON = "databutton"
+    SQLITE = "sqlite"
+    FILESYSTEM = "filesystem"
+
+
+storage_backend = StorageBackend(os.environ.get("STORAGE_BACKEND", StorageBackend.DATABUTTON.value))
+
 __all__ = [
     "Mode",
     "mode",
+    "StorageBackend",
+    "storage_backend",
 ]
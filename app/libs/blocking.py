@@ -0,0 +1,97 @@
+"""Run blocking calls (storage, secrets, synchronous SDKs) off the event loop.
+
+Usage:
+
+    from app.libs.blocking import run_blocking
+
+    workflows = await run_blocking(storage.json.get, key, default={})
+
+Calls run on a bounded thread pool shared by the whole process (size set by
+BLOCKING_IO_WORKERS). Time spent waiting for a free worker is recorded so a
+saturated pool shows up in blocking_io_stats() and in the logs.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+MAX_WORKERS = int(os.environ.get("BLOCKING_IO_WORKERS", "32"))
+
+# Queue waits above this are logged, as they mean requests are stalling on the pool
+SLOW_QUEUE_WAIT_SECONDS = 0.25
+
+# Number of recent samples kept for percentiles
+SAMPLE_SIZE = 1024
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="blocking-io")
+
+_lock = threading.Lock()
+_queue_waits: deque = deque(maxlen=SAMPLE_SIZE)
+_run_times: deque = deque(maxlen=SAMPLE_SIZE)
+_counters = {"submitted": 0, "completed": 0, "failed": 0}
+
+
+async def run_blocking(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run fn(*args, **kwargs) on the blocking I/O pool and await the result"""
+    submitted_at = time.perf_counter()
+    with _lock:
+        _counters["submitted"] += 1
+
+    def call() -> T:
+        started_at = time.perf_counter()
+        queue_wait = started_at - submitted_at
+        if queue_wait > SLOW_QUEUE_WAIT_SECONDS:
+            print(f"Blocking I/O call {getattr(fn, '__qualname__', fn)} waited {queue_wait * 1000:.0f} ms for a worker")
+        failed = False
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            with _lock:
+                _queue_waits.append(queue_wait)
+                _run_times.append(time.perf_counter() - started_at)
+                _counters["failed" if failed else "completed"] += 1
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, call)
+
+
+def _percentile(samples: list, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def blocking_io_stats() -> Dict[str, Any]:
+    """Snapshot of pool usage and queue wait times (in milliseconds)"""
+    with _lock:
+        waits = list(_queue_waits)
+        runs = list(_run_times)
+        counters = dict(_counters)
+
+    return {
+        "max_workers": MAX_WORKERS,
+        "in_flight": counters["submitted"] - counters["completed"] - counters["failed"],
+        **counters,
+        "queue_wait_ms": {
+            "p50": round(_percentile(waits, 0.5) * 1000, 2),
+            "p95": round(_percentile(waits, 0.95) * 1000, 2),
+            "max": round(max(waits, default=0.0) * 1000, 2),
+        },
+        "run_time_ms": {
+            "p50": round(_percentile(runs, 0.5) * 1000, 2),
+            "p95": round(_percentile(runs, 0.95) * 1000, 2),
+        },
+    }
+
+
+__all__ = ["run_blocking", "blocking_io_stats"]
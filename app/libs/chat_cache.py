@@ -0,0 +1,289 @@
+"""Response cache for chat completions, with optional near-duplicate matching.
+
+Usage:
+
+    from app.libs.chat_cache import ChatResponseCache
+
+    cache = ChatResponseCache()
+    cached = cache.get(messages, config, scope=user_id)    # None on miss or bypass
+    if cached is None:
+        text = await provider.generate(...)
+        cache.put(messages, config, text, scope=user_id)
+
+Entries are keyed on the scope (whose replies they are, e.g. the user id), the
+normalized message history and the generation config, so a reply is only ever
+served within the scope it was generated for. When no exact entry exists, the
+last user message is compared against cached prompts of the same scope that
+share the same earlier history and config; a cosine similarity above
+`similarity_threshold` counts as a (semantic) hit. The default embedding is a
+hashed bag of words and bigrams, so no model call is needed; pass `embedder`
+to use a real embedding model instead.
+
+Cached prompts are bucketed by random-hyperplane LSH (`LSH_BANDS` bands of
+`LSH_BAND_BITS` sign bits), so a lookup only scores prompts that share a band
+with it, and at most `MAX_CANDIDATES` of those. Vectors are kept sparse, so
+scoring a candidate costs its non-zero dimensions rather than the full width.
+"""
+
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+Embedding = List[float]
+SparseVector = Dict[int, float]
+
+EMBEDDING_DIMENSIONS = 512
+
+# A prompt at the default threshold (0.92) shares a band with a cached one ~99% of the time
+LSH_BANDS = 12
+LSH_BAND_BITS = 8
+# Most prompts scored per lookup, preferring those sharing the most bands
+MAX_CANDIDATES = 128
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form of a message"""
+    return " ".join(text.split()).casefold()
+
+
+def hashed_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> Embedding:
+    """Cheap local embedding: hashed unigrams and bigrams, L2-normalized"""
+    words = _WORD_RE.findall(text.casefold())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector = [0.0] * dimensions
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        sign = 1.0 if value & 1 else -1.0
+        vector[(value >> 1) % dimensions] += sign
+    norm = math.sqrt(sum(v * v for v in vector))
+    return [v / norm for v in vector] if norm else vector
+
+
+def _sparse(vector: Embedding) -> SparseVector:
+    return {i: v for i, v in enumerate(vector) if v}
+
+
+def _cosine(a: SparseVector, b: SparseVector) -> float:
+    # Embeddings are normalized, so the dot product is the cosine similarity
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(i, 0.0) for i, v in a.items())
+
+
+_planes: Dict[int, List[List[float]]] = {}
+
+
+def _hyperplanes(dimensions: int) -> List[List[float]]:
+    """Fixed random hyperplanes for a vector width (seeded, so signatures are stable)"""
+    planes = _planes.get(dimensions)
+    if planes is None:
+        rng = random.Random(dimensions)
+        planes = [[rng.gauss(0.0, 1.0) for _ in range(dimensions)] for _ in range(LSH_BANDS * LSH_BAND_BITS)]
+        _planes[dimensions] = planes
+    return planes
+
+
+def _band_keys(vector: SparseVector, dimensions: int) -> List[Tuple[int, int]]:
+    """(band, bucket) pairs of a vector's LSH signature"""
+    bits = [sum(v * plane[i] for i, v in vector.items()) >= 0.0 for plane in _hyperplanes(dimensions)]
+    keys = []
+    for band in range(LSH_BANDS):
+        bucket = 0
+        for bit in bits[band * LSH_BAND_BITS:(band + 1) * LSH_BAND_BITS]:
+            bucket = bucket << 1 | bit
+        keys.append((band, bucket))
+    return keys
+
+
+class _ContextIndex:
+    """Cached prompt vectors that share one context, bucketed by LSH band"""
+
+    def __init__(self):
+        self.vectors: Dict[str, Tuple[SparseVector, List[Tuple[int, int]]]] = {}
+        self.buckets: Dict[Tuple[int, int], Set[str]] = {}
+
+    def add(self, key: str, vector: SparseVector, bands: List[Tuple[int, int]]) -> None:
+        self.remove(key)
+        self.vectors[key] = (vector, bands)
+        for band in bands:
+            self.buckets.setdefault(band, set()).add(key)
+
+    def remove(self, key: str) -> None:
+        item = self.vectors.pop(key, None)
+        if item is None:
+            return
+        for band in item[1]:
+            bucket = self.buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band]
+
+    def candidates(self, bands: List[Tuple[int, int]]) -> List[Tuple[str, SparseVector]]:
+        shared = Counter(key for band in bands for key in self.buckets.get(band, ()))
+        return [(key, self.vectors[key][0]) for key, _ in shared.most_common(MAX_CANDIDATES)]
+
+
+def _digest(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+class ChatResponseCache:
+    def __init__(
+        self,
+        max_entries: int = 2000,
+        ttl_seconds: float = 6 * 3600,
+        max_temperature: float = 0.8,
+        similarity_threshold: Optional[float] = 0.92,
+        embedder: Callable[[str], Embedding] = hashed_embedding,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_temperature = max_temperature
+        # None disables near-duplicate matching
+        self.similarity_threshold = similarity_threshold
+        self.embedder = embedder
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._by_context: Dict[str, _ContextIndex] = {}
+        self._lock = threading.Lock()
+        # Counters and entry counts per scope
+        self._stats: Dict[str, Counter] = {}
+        self._sizes: Counter = Counter()
+
+    def _keys(self, messages: List[Dict[str, str]], config: Dict[str, Any], scope: str) -> Tuple[str, str, str]:
+        """(exact key, context key, normalized last message)"""
+        normalized = [(m["role"], normalize_text(m["content"])) for m in messages]
+        last = normalized[-1][1] if normalized else ""
+        exact = _digest({"scope": scope, "messages": normalized, "config": config})
+        context = _digest({"scope": scope, "messages": normalized[:-1], "config": config})
+        return exact, context, last
+
+    def _count(self, scope: str, *names: str) -> None:
+        counters = self._stats.get(scope)
+        if counters is None:
+            counters = self._stats[scope] = Counter()
+        for name in names:
+            counters[name] += 1
+
+    def should_bypass(self, config: Dict[str, Any]) -> bool:
+        """High-temperature requests ask for varied answers, so they aren't cached"""
+        temperature = config.get("temperature")
+        return temperature is not None and temperature > self.max_temperature
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._sizes[entry["scope"]] -= 1
+        if not self._sizes[entry["scope"]]:
+            del self._sizes[entry["scope"]]
+        index = self._by_context.get(entry["context"])
+        if index is not None:
+            index.remove(key)
+            if not index.vectors:
+                del self._by_context[entry["context"]]
+
+    def _live(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["expires_at"] <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, messages: List[Dict[str, str]], config: Dict[str, Any], scope: str) -> Optional[str]:
+        """Cached response for a request within a scope, or None"""
+        if self.should_bypass(config):
+            with self._lock:
+                self._count(scope, "bypassed")
+            return None
+
+        exact, context, last = self._keys(messages, config, scope)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(exact, now)
+            if entry is not None:
+                self._count(scope, "hits")
+                return entry["response"]
+            has_candidates = context in self._by_context
+
+        candidates = []
+        if self.similarity_threshold is not None and has_candidates:
+            embedding = self.embedder(last)
+            vector = _sparse(embedding)
+            bands = _band_keys(vector, len(embedding))
+            with self._lock:
+                index = self._by_context.get(context)
+                candidates = index.candidates(bands) if index is not None else []
+        if candidates:
+            best_key, best_score = max(
+                ((key, _cosine(vector, other)) for key, other in candidates), key=lambda item: item[1]
+            )
+            if best_score >= self.similarity_threshold:
+                with self._lock:
+                    entry = self._live(best_key, now)
+                    if entry is not None:
+                        self._count(scope, "hits", "semantic_hits")
+                        return entry["response"]
+
+        with self._lock:
+            self._count(scope, "misses")
+        return None
+
+    def put(self, messages: List[Dict[str, str]], config: Dict[str, Any], response: str, scope: str) -> None:
+        """Store a response for a scope"""
+        if self.should_bypass(config) or not response:
+            return
+
+        exact, context, last = self._keys(messages, config, scope)
+        vector = None
+        if self.similarity_threshold is not None:
+            embedding = self.embedder(last)
+            vector = _sparse(embedding)
+            bands = _band_keys(vector, len(embedding))
+        with self._lock:
+            self._remove(exact)
+            self._entries[exact] = {
+                "response": response,
+                "context": context,
+                "scope": scope,
+                "expires_at": time.monotonic() + self.ttl_seconds,
+            }
+            self._sizes[scope] += 1
+            if vector is not None:
+                self._by_context.setdefault(context, _ContextIndex()).add(exact, vector, bands)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._count(self._entries[oldest]["scope"], "evictions")
+                self._remove(oldest)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+            self._sizes.clear()
+
+    def stats(self, scope: Optional[str] = None) -> Dict[str, Any]:
+        """Counters plus current size and hit rate (over cacheable requests), for one scope or all of them"""
+        with self._lock:
+            counters = self._stats.get(scope, Counter()) if scope is not None else sum(self._stats.values(), Counter())
+            stats = {name: counters[name] for name in ("hits", "semantic_hits", "misses", "bypassed", "evictions")}
+            stats["size"] = self._sizes[scope] if scope is not None else len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+__all__ = ["ChatResponseCache", "hashed_embedding", "normalize_text"]
@@ -0,0 +1,362 @@
+"""Chat completion providers used by the ai_chat API.
+
+Usage:
+
+    from app.libs.chat_providers import get_chat_provider
+
+    provider = get_chat_provider(api_key)
+    text = await provider.generate(messages, temperature=0.7, max_output_tokens=800)
+    async for chunk in provider.stream(messages, temperature=0.7, max_output_tokens=800):
+        ...
+
+`messages` is a list of {"role": "user" | "model", "content": str}. Set
+CHAT_PROVIDER=fake to use FakeChatProvider, which needs no network or API key
+and is meant for tests and local development. `provider_for_service` builds a
+provider from an api_connections service name and key.
+"""
+
+import asyncio
+import json
+import os
+import random
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.libs.http_client import MAX_RETRIES, get_http_client, request_with_retry
+from app.libs.usage import report_usage
+
+# Base URLs can be pointed elsewhere, e.g. at tools/fake_ai_server.py for load tests
+GEMINI_API_BASE_URL = os.environ.get("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = "gemini-pro"
+OPENAI_API_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_MODEL = "gpt-4o-mini"
+# Vertex AI's host depends on the location unless overridden
+VERTEX_AI_BASE_URL = os.environ.get("VERTEX_AI_BASE_URL")
+VERTEX_AI_MODEL = "gemini-1.5-flash"
+
+
+def vertex_ai_base_url(location: str = "us-central1") -> str:
+    return VERTEX_AI_BASE_URL or f"https://{location}-aiplatform.googleapis.com/v1"
+
+
+class ChatProviderError(Exception):
+    """Error response from a provider, carrying its HTTP status"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ChatProvider:
+    name = "base"
+
+    def identity(self) -> str:
+        """Which service and model produce this provider's replies, e.g. openai/gpt-4o-mini"""
+        model = getattr(self, "model", None)
+        return f"{self.name}/{model}" if model else self.name
+
+    async def generate(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int) -> str:
+        """Return the full completion"""
+        chunks = [chunk async for chunk in self.stream(messages, temperature, max_output_tokens)]
+        return "".join(chunks)
+
+    def stream(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int) -> AsyncIterator[str]:
+        """Yield the completion in pieces as the provider produces them"""
+        raise NotImplementedError
+
+
+def format_gemini_messages(messages: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    """Convert our messages format to Gemini's contents format"""
+    return [
+        {"role": msg["role"], "parts": [{"text": msg["content"]}]}
+        for msg in messages
+        if msg["role"] in ("user", "model")
+    ]
+
+
+def report_gemini_usage(provider: ChatProvider, response_data: Dict[str, Any]) -> None:
+    usage = response_data.get("usageMetadata")
+    if usage:
+        report_usage(provider.name, provider.model, usage.get("promptTokenCount"), usage.get("candidatesTokenCount"))
+
+
+def extract_gemini_text(response_data: Dict[str, Any]) -> Optional[str]:
+    """Text of the first candidate in a Gemini response, or None if there is none"""
+    try:
+        parts = response_data["candidates"][0]["content"]["parts"]
+    except (KeyError, IndexError, TypeError):
+        return None
+    return "".join(part.get("text", "") for part in parts)
+
+
+async def iter_sse_data(response) -> AsyncIterator[str]:
+    """Payloads of the `data:` lines in a Server-Sent Events response"""
+    async for line in response.aiter_lines():
+        if line.startswith("data:"):
+            yield line[len("data:"):].strip()
+
+
+class GeminiProvider(ChatProvider):
+    name = "gemini"
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = GEMINI_MODEL,
+        base_url: str = GEMINI_API_BASE_URL,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url
+        # The chat router sets this to 0 so it can fail over instead of waiting
+        self.max_retries = max_retries
+
+    def url(self, method: str) -> str:
+        return f"{self.base_url}/models/{self.model}:{method}"
+
+    def auth(self) -> Dict[str, Any]:
+        """Request arguments that authenticate a call"""
+        return {"params": {"key": self.api_key}}
+
+    def payload(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int) -> Dict[str, Any]:
+        return {
+            "contents": format_gemini_messages(messages),
+            "generationConfig": {
+                "temperature": temperature,
+                "maxOutputTokens": max_output_tokens,
+                "topP": 0.95,
+                "topK": 40,
+            },
+        }
+
+    async def generate(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int) -> str:
+        response = await request_with_retry(
+            "POST",
+            self.url("generateContent"),
+            max_retries=self.max_retries,
+            json=self.payload(messages, temperature, max_output_tokens),
+            **self.auth(),
+        )
+        if response.status_code != 200:
+            raise ChatProviderError(response.status_code, f"Gemini API error: {response.text}")
+
+        response_data = response.json()
+        text = extract_gemini_text(response_data)
+        if text is None:
+            print(f"Unexpected Gemini API response format: {response.text}")
+            raise ChatProviderError(500, "Unexpected response format from Gemini API")
+        report_gemini_usage(self, response_data)
+        return text
+
+    async def stream(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int) -> AsyncIterator[str]:
+        auth = self.auth()
+        params = {"alt": "sse", **auth.pop("params", {})}
+
+        # Leaving this block (including on cancellation) closes the upstream request
+        async with get_http_client().stream(
+            "POST",
+            self.url("streamGenerateContent"),
+            params=params,
+            json=self.payload(messages, temperature, max_output_tokens),
+            **auth,
+        ) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", "replace")
+                raise ChatProviderError(response.status_code, f"Gemini API error: {body}")
+
+            report_usage(self.name, self.model)
+            async for data in iter_sse_data(response):
+                chunk = json.loads(data)
+                # Every chunk carries the running totals
+                report_gemini_usage(self, chunk)
+                text = extract_gemini_text(chunk)
+                if text:
+                    yield text
+
+
+class VertexAIProvider(GeminiProvider):
+    """Gemini models served from Vertex AI, authenticated with an OAuth access token"""
+
+    name = "vertex_ai"
+
+    def __init__(self, access_token: str, project: str, location: str = "us-central1",
+                 model: str = VERTEX_AI_MODEL, max_retries: int = MAX_RETRIES):
+        base_url = f"{vertex_ai_base_url(location)}/projects/{project}/locations/{location}/publishers/google"
+        super().__init__(access_token, model=model, base_url=base_url, max_retries=max_retries)
+
+    def auth(self) -> Dict[str, Any]:
+        return {"headers": {"Authorization": f"Bearer {self.api_key}"}}
+
+
+def format_openai_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Convert our messages format to OpenAI's, where the model role is called assistant"""
+    return [
+        {"role": "assistant" if msg["role"] == "model" else msg["role"], "content": msg["content"]}
+        for msg in messages
+    ]
+
+
+class OpenAIProvider(ChatProvider):
+    name = "openai"
+
+    def __init__(self, api_key: str, model: str = OPENAI_MODEL, base_url: str = OPENAI_API_BASE_URL,
+                 max_retries: int = MAX_RETRIES):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url
+        self.max_retries = max_retries
+
+    def payload(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int,
+                stream: bool = False) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": format_openai_messages(messages),
+            "temperature": temperature,
+            "max_tokens": max_output_tokens,
+            "stream": stream,
+            # Ask for token counts in the final chunk of a stream
+            **({"stream_options": {"include_usage": True}} if stream else {}),
+        }
+
+    async def generate(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int) -> str:
+        response = await request_with_retry(
+            "POST",
+            f"{self.base_url}/chat/completions",
+            max_retries=self.max_retries,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            json=self.payload(messages, temperature, max_output_tokens),
+        )
+        if response.status_code != 200:
+            raise ChatProviderError(response.status_code, f"OpenAI API error: {response.text}")
+        try:
+            response_data = response.json()
+            text = response_data["choices"][0]["message"]["content"] or ""
+        except (KeyError, IndexError, TypeError):
+            print(f"Unexpected OpenAI API response format: {response.text}")
+            raise ChatProviderError(500, "Unexpected response format from OpenAI API")
+        self.report_usage(response_data)
+        return text
+
+    def report_usage(self, response_data: Dict[str, Any]) -> None:
+        usage = response_data.get("usage") or {}
+        report_usage(self.name, self.model, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+
+    async def stream(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int) -> AsyncIterator[str]:
+        async with get_http_client().stream(
+            "POST",
+            f"{self.base_url}/chat/completions",
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            json=self.payload(messages, temperature, max_output_tokens, stream=True),
+        ) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", "replace")
+                raise ChatProviderError(response.status_code, f"OpenAI API error: {body}")
+
+            report_usage(self.name, self.model)
+            async for data in iter_sse_data(response):
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    self.report_usage(chunk)
+                choices = chunk.get("choices") or [{}]
+                text = choices[0].get("delta", {}).get("content")
+                if text:
+                    yield text
+
+
+class FakeChatProvider(ChatProvider):
+    """Local stand-in that echoes the last user message word by word.
+
+    `latency` delays the first chunk and `failure_rate` makes that fraction of
+    calls fail with `failure_status`, to exercise routing and fallback.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        token_delay: float = 0.02,
+        reply: Optional[str] = None,
+        fail_after: Optional[int] = None,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        failure_status: int = 503,
+    ):
+        self.token_delay = token_delay
+        self.reply = reply
+        self.fail_after = fail_after
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+
+    async def stream(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int) -> AsyncIterator[str]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise ChatProviderError(self.failure_status, "Injected fake provider failure")
+
+        report_usage(self.name, None)
+        reply = self.reply
+        if reply is None:
+            last_user = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+            reply = f"You said: {last_user}"
+
+        for i, word in enumerate(reply.split(" ")[:max_output_tokens]):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise ChatProviderError(500, "Fake provider failure")
+            await asyncio.sleep(self.token_delay)
+            yield word if i == 0 else f" {word}"
+
+
+def get_chat_provider(api_key: Optional[str] = None) -> ChatProvider:
+    """Provider selected by CHAT_PROVIDER (default: gemini)"""
+    if os.environ.get("CHAT_PROVIDER") == "fake":
+        return FakeChatProvider(token_delay=float(os.environ.get("FAKE_CHAT_TOKEN_DELAY", "0.02")))
+    return GeminiProvider(api_key)
+
+
+def provider_for_service(service: str, api_key: str, **kwargs: Any) -> Optional[ChatProvider]:
+    """Chat provider for an api_connections service, or None if it can't serve chat"""
+    if service == "gemini":
+        return GeminiProvider(api_key, **kwargs)
+    if service == "openai":
+        return OpenAIProvider(api_key, **kwargs)
+    if service == "vertex_ai":
+        # Connections only store a token, so the project comes from the environment
+        project = os.environ.get("VERTEX_AI_PROJECT")
+        if not project:
+            return None
+        location = os.environ.get("VERTEX_AI_LOCATION", "us-central1")
+        return VertexAIProvider(api_key, project, location, **kwargs)
+    return None
+
+
+def parse_fake_providers(spec: str) -> Dict[str, ChatProvider]:
+    """Fake providers from "name:latency:failure_rate,..." (FAKE_CHAT_PROVIDERS)"""
+    token_delay = float(os.environ.get("FAKE_CHAT_TOKEN_DELAY", "0.02"))
+    providers: Dict[str, ChatProvider] = {}
+    for item in spec.split(","):
+        name, _, rest = item.strip().partition(":")
+        latency, _, failure_rate = rest.partition(":")
+        if name:
+            providers[name] = FakeChatProvider(
+                token_delay=token_delay,
+                latency=float(latency or 0),
+                failure_rate=float(failure_rate or 0),
+            )
+    return providers
+
+
+__all__ = [
+    "ChatProvider",
+    "ChatProviderError",
+    "FakeChatProvider",
+    "GeminiProvider",
+    "OpenAIProvider",
+    "VertexAIProvider",
+    "get_chat_provider",
+    "parse_fake_providers",
+    "provider_for_service",
+    "vertex_ai_base_url",
+]
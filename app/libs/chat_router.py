@@ -0,0 +1,250 @@
+"""Route chat requests across several providers.
+
+Usage:
+
+    from app.libs.chat_router import ChatRouter
+
+    router = ChatRouter({"conn_1": GeminiProvider(key1), "conn_2": OpenAIProvider(key2)}, hedge=True)
+    text = await router.generate(messages, temperature=0.7, max_output_tokens=800)
+
+A ChatRouter is itself a ChatProvider. Each call goes to the provider with the
+best score: latency EWMA, inflated by error-rate EWMA. A provider that returned
+429 sits out for RATE_LIMIT_COOLDOWN seconds. Errors and 429s fall through to
+the next provider. Only requests that are invalid everywhere (400, 413, 422)
+are not retried elsewhere.
+
+With `hedge=True`, `generate` starts a duplicate request on the next provider
+if the first has not answered within its p95 latency. The first success wins
+and the other request is cancelled. Streams fall back only before their first
+chunk and are never hedged.
+
+Stats are kept per provider id for the life of the process, so they carry over
+between requests (see `router_stats`). `on_outcome(provider_id, error_or_None)`
+is called after every attempt, e.g. to feed circuit breakers.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional
+
+from app.libs.chat_providers import ChatProvider, ChatProviderError
+
+EWMA_ALPHA = 0.2
+LATENCY_WINDOW = 200
+RATE_LIMIT_COOLDOWN = 10.0
+# Error rates fade without traffic so a provider that recovered gets tried again
+ERROR_HALF_LIFE = 60.0
+
+# Hedge delay is the provider's p95 latency once it has enough samples
+MIN_HEDGE_SAMPLES = 20
+DEFAULT_HEDGE_DELAY = 2.0
+MIN_HEDGE_DELAY = 0.25
+
+NO_FALLBACK_STATUSES = {400, 413, 422}
+
+
+class ProviderStats:
+    def __init__(self):
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.cooldown_until = 0.0
+        self.last_failure = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def _update_latency(self, latency: float) -> None:
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += EWMA_ALPHA * (latency - self.latency_ewma)
+
+    def record_success(self, latency: Optional[float]) -> None:
+        self.requests += 1
+        self.error_ewma -= EWMA_ALPHA * self.error_ewma
+        if latency is not None:
+            self.latencies.append(latency)
+            self._update_latency(latency)
+
+    def record_failure(self, error: BaseException) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.error_ewma = self.error_rate(time.monotonic())
+        self.error_ewma += EWMA_ALPHA * (1.0 - self.error_ewma)
+        self.last_failure = time.monotonic()
+        if getattr(error, "status_code", None) == 429:
+            self.cooldown_until = time.monotonic() + RATE_LIMIT_COOLDOWN
+
+    def record_abandoned(self, elapsed: float) -> None:
+        """A hedged request that lost: it took at least `elapsed`"""
+        self.requests += 1
+        self._update_latency(elapsed)
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def error_rate(self, now: float) -> float:
+        return self.error_ewma * 0.5 ** ((now - self.last_failure) / ERROR_HALF_LIFE)
+
+    def score(self, now: float) -> float:
+        """Lower is better; untried providers go first so they get measured"""
+        if now < self.cooldown_until:
+            return float("inf")
+        if self.requests == 0:
+            return 0.0
+        latency = self.latency_ewma if self.latency_ewma is not None else DEFAULT_HEDGE_DELAY
+        return latency * (1.0 + 4.0 * self.error_rate(now))
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_ewma": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+            "error_ewma": round(self.error_rate(time.monotonic()), 4),
+            "p95": self.p95(),
+            "cooling_down": time.monotonic() < self.cooldown_until,
+        }
+
+
+_stats: Dict[str, ProviderStats] = {}
+
+
+def provider_stats(provider_id: str) -> ProviderStats:
+    stats = _stats.get(provider_id)
+    if stats is None:
+        stats = _stats[provider_id] = ProviderStats()
+    return stats
+
+
+def router_stats() -> Dict[str, Dict[str, object]]:
+    return {provider_id: stats.to_dict() for provider_id, stats in _stats.items()}
+
+
+def should_fall_back(error: BaseException) -> bool:
+    return getattr(error, "status_code", None) not in NO_FALLBACK_STATUSES
+
+
+def _final_error(error: Optional[BaseException]) -> ChatProviderError:
+    if isinstance(error, ChatProviderError):
+        return error
+    return ChatProviderError(502, f"All chat providers failed: {error}")
+
+
+class ChatRouter(ChatProvider):
+    name = "router"
+
+    def __init__(self, providers: Dict[str, ChatProvider], hedge: bool = False,
+                 on_outcome: Optional[Callable[[str, Optional[BaseException]], None]] = None):
+        if not providers:
+            raise ValueError("ChatRouter needs at least one provider")
+        self.providers = providers
+        self.hedge = hedge
+        self.on_outcome = on_outcome
+
+    def identity(self) -> str:
+        """Every service/model the router may answer with; any of them can produce a reply"""
+        return ",".join(sorted({provider.identity() for provider in self.providers.values()}))
+
+    def _report(self, provider_id: str, error: Optional[BaseException]) -> None:
+        if self.on_outcome is not None:
+            self.on_outcome(provider_id, error)
+
+    def ranked(self) -> List[str]:
+        """Provider ids, best first"""
+        now = time.monotonic()
+        return sorted(self.providers, key=lambda provider_id: provider_stats(provider_id).score(now))
+
+    def hedge_delay(self, provider_id: str) -> float:
+        p95 = provider_stats(provider_id).p95()
+        return max(MIN_HEDGE_DELAY, p95 if p95 is not None else DEFAULT_HEDGE_DELAY)
+
+    async def _generate_with(self, provider_id: str, messages: List[Dict[str, str]],
+                             temperature: float, max_output_tokens: int) -> str:
+        stats = provider_stats(provider_id)
+        started = time.monotonic()
+        try:
+            text = await self.providers[provider_id].generate(messages, temperature, max_output_tokens)
+        except asyncio.CancelledError:
+            stats.record_abandoned(time.monotonic() - started)
+            raise
+        except Exception as e:
+            print(f"Chat provider {provider_id} failed: {str(e)}")
+            stats.record_failure(e)
+            self._report(provider_id, e)
+            raise
+        stats.record_success(time.monotonic() - started)
+        self._report(provider_id, None)
+        return text
+
+    async def generate(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int) -> str:
+        waiting = self.ranked()
+        pending: Dict[asyncio.Task, str] = {}
+        last_error: Optional[BaseException] = None
+
+        def launch() -> None:
+            provider_id = waiting.pop(0)
+            task = asyncio.create_task(self._generate_with(provider_id, messages, temperature, max_output_tokens))
+            pending[task] = provider_id
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and waiting and len(pending) == 1:
+                    timeout = self.hedge_delay(next(iter(pending.values())))
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The current request is slower than usual; race it against the next provider
+                    launch()
+                    continue
+
+                for task in done:
+                    del pending[task]
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    if not should_fall_back(error):
+                        raise error
+                    last_error = error
+
+                if not pending and waiting:
+                    launch()
+            raise _final_error(last_error)
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def stream(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int) -> AsyncIterator[str]:
+        last_error: Optional[BaseException] = None
+        for provider_id in self.ranked():
+            stats = provider_stats(provider_id)
+            started = False
+            try:
+                async for chunk in self.providers[provider_id].stream(messages, temperature, max_output_tokens):
+                    started = True
+                    yield chunk
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Chat provider {provider_id} failed: {str(e)}")
+                stats.record_failure(e)
+                self._report(provider_id, e)
+                if started or not should_fall_back(e):
+                    raise
+                last_error = e
+                continue
+            # Stream timings aren't comparable with full completions, so only the outcome is recorded
+            stats.record_success(None)
+            self._report(provider_id, None)
+            return
+        raise _final_error(last_error)
+
+
+__all__ = ["ChatRouter", "ProviderStats", "provider_stats", "router_stats"]
@@ -0,0 +1,298 @@
+"""Circuit breakers and a background health monitor for API connections.
+
+Usage:
+
+    from app.libs.connection_health import health_monitor
+
+    if health_monitor.is_available(connection_id):      # no I/O
+        ... call the provider ...
+        health_monitor.record_outcome(connection_id, error_or_none)
+
+    health_monitor.watch(connection_id, service, stored_status, owner)   # connection is in use
+    health_monitor.start(probe, save)                    # app startup
+    await health_monitor.stop()                          # app shutdown
+
+Each connection has a CircuitBreaker:
+- closed: requests flow.
+- open: after FAILURE_THRESHOLD consecutive failures. Requests are refused
+  until the cooldown has passed.
+- half-open: after the cooldown, one trial request or probe is let through.
+  Success closes the breaker; failure re-opens it with the cooldown doubled,
+  up to MAX_COOLDOWN.
+
+Both real traffic (`record_outcome`) and the monitor's probes feed the
+breakers. The monitor only probes connections it has been told about with
+`watch` (when they are created, tested or loaded for a request) and only
+while they are in use: watched or used within ACTIVE_WINDOW, or with a breaker
+that isn't closed. Idle healthy connections are dropped, so no provider quota
+is spent on keys nobody is using. Each probed connection has its own schedule:
+- healthy connections: every HEALTHY_INTERVAL, stretched towards MAX_INTERVAL
+  while they keep passing or have recent successful traffic
+- failing connections: every FAILING_INTERVAL
+- open connections: when their cooldown ends
+When a probe's verdict (connected, or failed once the breaker is open) differs
+from the connection's stored status, the monitor saves it through `save`
+(`owner` tells the caller where it is stored).
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+FAILURE_THRESHOLD = 3
+BASE_COOLDOWN = 15.0
+MAX_COOLDOWN = 300.0
+# A half-open trial that never reports back stops blocking others after this long
+TRIAL_TIMEOUT = 30.0
+
+HEALTHY_INTERVAL = 60.0
+MAX_INTERVAL = 600.0
+FAILING_INTERVAL = 10.0
+TICK = 1.0
+MAX_CONCURRENT_PROBES = 16
+# Connections unused for this long are no longer probed, unless their breaker is open
+ACTIVE_WINDOW = 900.0
+
+# Errors that say nothing about the connection's health
+IGNORED_STATUSES = {400, 404, 413, 422, 429}
+
+Probe = Callable[[str, str], Awaitable[Tuple[str, str]]]
+SaveResults = Callable[[Dict[str, Tuple[str, str]]], Awaitable[None]]
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.cooldown = BASE_COOLDOWN
+        self.open_until = 0.0
+        self.trial_started: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def is_available(self, now: Optional[float] = None) -> bool:
+        """Whether a request could go out now, without claiming the half-open trial"""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic() if now is None else now
+        if self.state == OPEN:
+            return now >= self.open_until
+        return self.trial_started is None or now - self.trial_started >= TRIAL_TIMEOUT
+
+    def allow_request(self, now: Optional[float] = None) -> bool:
+        """Whether a request may go out now; in half-open state this claims the single trial"""
+        now = time.monotonic() if now is None else now
+        if not self.is_available(now):
+            return False
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            self.trial_started = now
+        return True
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self.cooldown = BASE_COOLDOWN
+        self.trial_started = None
+        self.last_error = None
+
+    def record_failure(self, message: Optional[str] = None, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        self.failures += 1
+        self.last_error = message
+        if self.state == HALF_OPEN:
+            self.cooldown = min(self.cooldown * 2, MAX_COOLDOWN)
+            self._open(now)
+        elif self.state == CLOSED and self.failures >= FAILURE_THRESHOLD:
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self.open_until = now + self.cooldown
+        self.trial_started = None
+
+
+class _Schedule:
+    __slots__ = ("service", "status", "owner", "interval", "next_probe", "last_active")
+
+    def __init__(self, service: str, status: Optional[str], owner: Optional[str], now: float):
+        self.service = service
+        self.status = status
+        self.owner = owner
+        self.interval = HEALTHY_INTERVAL
+        self.next_probe = now + HEALTHY_INTERVAL
+        self.last_active = now
+
+
+class HealthMonitor:
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._schedules: Dict[str, _Schedule] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def breaker(self, connection_id: str) -> CircuitBreaker:
+        breaker = self._breakers.get(connection_id)
+        if breaker is None:
+            breaker = self._breakers[connection_id] = CircuitBreaker()
+        return breaker
+
+    def state(self, connection_id: str) -> str:
+        breaker = self._breakers.get(connection_id)
+        return breaker.state if breaker is not None else CLOSED
+
+    def is_available(self, connection_id: str) -> bool:
+        breaker = self._breakers.get(connection_id)
+        return breaker is None or breaker.is_available()
+
+    def allow_request(self, connection_id: str) -> bool:
+        breaker = self._breakers.get(connection_id)
+        return breaker is None or breaker.allow_request()
+
+    def watch(self, connection_id: str, service: str, status: Optional[str] = None, owner: Optional[str] = None) -> None:
+        """Mark a connection as in use so the monitor keeps probing it; status is the stored one"""
+        now = time.monotonic()
+        schedule = self._schedules.get(connection_id)
+        if schedule is None:
+            self._schedules[connection_id] = _Schedule(service, status, owner, now)
+            return
+        if schedule.service != service:
+            schedule.service = service
+            schedule.next_probe = now
+        schedule.status = status if status is not None else schedule.status
+        schedule.owner = owner
+        schedule.last_active = now
+
+    def owner(self, connection_id: str) -> Optional[str]:
+        schedule = self._schedules.get(connection_id)
+        return schedule.owner if schedule is not None else None
+
+    def record_outcome(self, connection_id: str, error: Optional[BaseException] = None) -> None:
+        """Feed the result of a real request into the connection's breaker"""
+        schedule = self._schedules.get(connection_id)
+        if schedule is not None:
+            schedule.last_active = time.monotonic()
+        if error is None:
+            breaker = self._breakers.get(connection_id)
+            if breaker is not None and breaker.state != CLOSED:
+                breaker.record_success()
+            # Traffic is already proving the connection works; probe it less often
+            if schedule is not None:
+                schedule.next_probe = max(schedule.next_probe, time.monotonic() + schedule.interval)
+            return
+        if getattr(error, "status_code", None) in IGNORED_STATUSES:
+            return
+        self.breaker(connection_id).record_failure(str(error))
+
+    def forget(self, connection_id: str) -> None:
+        self._breakers.pop(connection_id, None)
+        self._schedules.pop(connection_id, None)
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        now = time.monotonic()
+        result = {}
+        for connection_id, breaker in self._breakers.items():
+            schedule = self._schedules.get(connection_id)
+            result[connection_id] = {
+                "state": breaker.state,
+                "consecutive_failures": breaker.failures,
+                "retry_in": round(max(0.0, breaker.open_until - now), 1) if breaker.state == OPEN else None,
+                "next_probe_in": round(max(0.0, schedule.next_probe - now), 1) if schedule else None,
+                "last_error": breaker.last_error,
+            }
+        return result
+
+    async def _probe(self, connection_id: str, probe: Probe, semaphore: asyncio.Semaphore) -> Optional[str]:
+        """Probe one connection, returning its status if the probe was conclusive"""
+        # The connection may be forgotten (deleted, disabled or gone idle) at any await
+        schedule = self._schedules.get(connection_id)
+        if schedule is None:
+            return None
+        breaker = self.breaker(connection_id)
+        before = breaker.state
+        async with semaphore:
+            if self._schedules.get(connection_id) is not schedule:
+                return None
+            try:
+                status, message = await probe(connection_id, schedule.service)
+            except Exception as e:
+                status, message = "failed", str(e)
+        if self._schedules.get(connection_id) is not schedule:
+            return None
+
+        now = time.monotonic()
+        if status == "connected":
+            breaker.record_success()
+            schedule.interval = min(schedule.interval * 2, MAX_INTERVAL) if before == CLOSED else HEALTHY_INTERVAL
+            schedule.next_probe = now + schedule.interval
+        else:
+            breaker.record_failure(message, now)
+            schedule.interval = HEALTHY_INTERVAL
+            schedule.next_probe = breaker.open_until if breaker.state == OPEN else now + FAILING_INTERVAL
+
+        if breaker.state == CLOSED and status == "connected":
+            return "connected"
+        if breaker.state == OPEN:
+            return "failed"
+        return None
+
+    async def run_round(self, probe: Probe, save: SaveResults) -> int:
+        """Probe every in-use connection that is due; returns how many were probed"""
+        now = time.monotonic()
+        due = []
+        for connection_id, schedule in list(self._schedules.items()):
+            if self.state(connection_id) == CLOSED and now - schedule.last_active > ACTIVE_WINDOW:
+                # Idle and healthy: stop probing until it is used again
+                self.forget(connection_id)
+            elif schedule.next_probe <= now and self.breaker(connection_id).allow_request(now):
+                due.append(connection_id)
+        if not due:
+            return 0
+
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_PROBES)
+        verdicts = await asyncio.gather(*(self._probe(connection_id, probe, semaphore) for connection_id in due))
+        tested_at = datetime.now().isoformat()
+        changed = {}
+        for connection_id, status in zip(due, verdicts):
+            schedule = self._schedules.get(connection_id)
+            if status and schedule is not None and status != schedule.status:
+                changed[connection_id] = (status, tested_at)
+        if changed:
+            await save(changed)
+            for connection_id, (status, _) in changed.items():
+                schedule = self._schedules.get(connection_id)
+                if schedule is not None:
+                    schedule.status = status
+        return len(due)
+
+    async def _run(self, probe: Probe, save: SaveResults) -> None:
+        while True:
+            try:
+                await self.run_round(probe, save)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in connection health monitor: {str(e)}")
+            await asyncio.sleep(TICK)
+
+    def start(self, probe: Probe, save: SaveResults) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(probe, save))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+health_monitor = HealthMonitor()
+
+__all__ = ["CLOSED", "HALF_OPEN", "OPEN", "CircuitBreaker", "HealthMonitor", "health_monitor"]
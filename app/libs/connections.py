@@ -0,0 +1,107 @@
+"""Per-owner storage for API connection metadata.
+
+Usage:
+
+    from app.libs import connections as conn_store
+
+    connections = conn_store.load_connections(owner)         # {id: metadata}
+    connection_id = conn_store.new_connection_id("openai")
+    connections[connection_id] = {...}
+    conn_store.save_connections(owner, connections)
+
+Each owner's connections live under their own key, so listing or changing them
+reads and writes only that owner's data no matter how many tenants there are.
+IDs are random, so they never collide
+even after connections are deleted, and the API key secret can keep being
+named after the connection id alone.
+
+Connections created before storage was per-owner sit in one blob with no
+recorded owner. Until an admin assigns them (`migrate_legacy_connections`, run
+by tools/migrate_legacy_connections.py) they stay a read-only pool shared by
+every user, as they were before: usable for chat and tests, but not editable.
+"""
+
+import threading
+import time
+import uuid
+from typing import Any, Dict
+
+from app.libs.storage import storage
+from app.libs.storage_utils import sanitize_key
+
+LEGACY_KEY = "api_connections_metadata"
+
+# Seconds the legacy shared pool is kept in memory between reads
+SHARED_POOL_TTL = 300.0
+
+# Guards the legacy blob across worker threads
+_shared_lock = threading.Lock()
+_shared_pool: Dict[str, Dict[str, Any]] = {}
+_shared_pool_loaded = float("-inf")
+
+
+def api_key_name(connection_id: str) -> str:
+    """Name of the secret holding a connection's API key"""
+    return f"API_CONNECTION_{sanitize_key(connection_id)}"
+
+
+def new_connection_id(service: str) -> str:
+    return sanitize_key(f"{service}_{uuid.uuid4().hex[:12]}")
+
+
+def _connections_key(owner: str) -> str:
+    return f"api_connections_{sanitize_key(owner)}"
+
+
+def load_shared_connections() -> Dict[str, Dict[str, Any]]:
+    """Legacy connections without an owner, by id (read-only; cached for SHARED_POOL_TTL seconds)"""
+    global _shared_pool, _shared_pool_loaded
+    if time.monotonic() - _shared_pool_loaded >= SHARED_POOL_TTL:
+        _shared_pool = storage.json.get(LEGACY_KEY, default={})
+        _shared_pool_loaded = time.monotonic()
+    return _shared_pool
+
+
+def migrate_legacy_connections(assignments: Dict[str, str]) -> Dict[str, str]:
+    """
+    Move legacy connections to the owners given as {connection id: owner}, keeping their
+    ids (and so their keys). Connections not listed stay in the shared pool. Returns the
+    assignments that were applied.
+    """
+    global _shared_pool_loaded
+    with _shared_lock:
+        legacy = storage.json.get(LEGACY_KEY, default={})
+        moved = {connection_id: owner for connection_id, owner in assignments.items() if connection_id in legacy}
+        for owner in set(moved.values()):
+            connections = load_connections(owner)
+            for connection_id, connection_owner in moved.items():
+                if connection_owner == owner:
+                    connections[connection_id] = legacy[connection_id]
+            storage.json.put(_connections_key(owner), connections)
+        for connection_id in moved:
+            del legacy[connection_id]
+        if legacy:
+            storage.json.put(LEGACY_KEY, legacy)
+        else:
+            storage.json.delete(LEGACY_KEY)
+        _shared_pool_loaded = float("-inf")
+    return moved
+
+
+def load_connections(owner: str) -> Dict[str, Dict[str, Any]]:
+    """An owner's connections, by id"""
+    return storage.json.get(_connections_key(owner), default={})
+
+
+def save_connections(owner: str, connections: Dict[str, Dict[str, Any]]) -> None:
+    storage.json.put(_connections_key(owner), connections)
+
+
+__all__ = [
+    "api_key_name",
+    "load_connections",
+    "load_shared_connections",
+    "migrate_legacy_connections",
+    "new_connection_id",
+    "save_connections",
+]
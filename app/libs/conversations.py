@@ -0,0 +1,201 @@
+"""Server-side chat conversations with a token-budgeted context window.
+
+Usage:
+
+    from app.libs.conversations import create_conversation, load_conversation, build_context
+
+    conversation = create_conversation(user_id, title)
+    append_message(conversation, "user", text)
+    save_conversation(user_id, conversation)
+    messages, start = build_context(conversation)   # what gets sent to the provider
+
+The full history is stored so it can be shown again, but only the newest
+messages that fit in CONTEXT_TOKEN_BUDGET are sent to the provider. Once
+SUMMARY_TRIGGER_TOKENS worth of messages have dropped out of that window they
+can be folded into a running summary (see `summarize_history`), which is sent
+ahead of the window instead. Token counts come from `estimate_tokens`, a local
+approximation that errs on the high side; no tokenizer or API call is needed.
+"""
+
+import os
+import re
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.libs.storage import storage
+from app.libs.storage_utils import sanitize_key
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CHAT_CONTEXT_TOKENS", "6000"))
+SUMMARY_TRIGGER_TOKENS = 1500
+MAX_SUMMARY_TOKENS = 400
+MESSAGE_OVERHEAD_TOKENS = 4
+MAX_STORED_MESSAGES = 1000
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count: the larger of word/punctuation pieces and chars / 4"""
+    if not text:
+        return 0
+    return max(len(_TOKEN_RE.findall(text)), (len(text) + 3) // 4)
+
+
+# Storage
+
+def _index_key(user_id: str) -> str:
+    return f"conversations_index_{sanitize_key(user_id)}"
+
+
+def _conversation_key(user_id: str, conversation_id: str) -> str:
+    return f"conversation_{sanitize_key(user_id)}_{sanitize_key(conversation_id)}"
+
+
+def list_conversations(user_id: str) -> List[Dict[str, Any]]:
+    """Summaries of a user's conversations, newest first"""
+    index = storage.json.get(_index_key(user_id), default={})
+    items = [{"id": conversation_id, **info} for conversation_id, info in index.items()]
+    return sorted(items, key=lambda item: item["updatedAt"], reverse=True)
+
+
+def create_conversation(user_id: str, title: Optional[str] = None) -> Dict[str, Any]:
+    now = datetime.now().isoformat()
+    conversation = {
+        "id": uuid.uuid4().hex,
+        "title": title or "New conversation",
+        "createdAt": now,
+        "updatedAt": now,
+        "messages": [],
+        "summary": None,
+        # Number of leading messages covered by `summary`
+        "summarizedThrough": 0,
+    }
+    save_conversation(user_id, conversation)
+    return conversation
+
+
+def load_conversation(user_id: str, conversation_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        return storage.json.get(_conversation_key(user_id, conversation_id))
+    except FileNotFoundError:
+        return None
+
+
+def save_conversation(user_id: str, conversation: Dict[str, Any]) -> None:
+    conversation["updatedAt"] = datetime.now().isoformat()
+    storage.json.put(_conversation_key(user_id, conversation["id"]), conversation)
+
+    index = storage.json.get(_index_key(user_id), default={})
+    index[conversation["id"]] = {
+        "title": conversation["title"],
+        "updatedAt": conversation["updatedAt"],
+        "messageCount": len(conversation["messages"]),
+    }
+    storage.json.put(_index_key(user_id), index)
+
+
+def delete_conversation(user_id: str, conversation_id: str) -> bool:
+    index = storage.json.get(_index_key(user_id), default={})
+    if conversation_id not in index:
+        return False
+    del index[conversation_id]
+    storage.json.put(_index_key(user_id), index)
+    storage.json.delete(_conversation_key(user_id, conversation_id))
+    return True
+
+
+def append_message(conversation: Dict[str, Any], role: str, content: str) -> None:
+    """Add a message, dropping the oldest ones beyond MAX_STORED_MESSAGES"""
+    conversation["messages"].append({
+        "role": role,
+        "content": content,
+        "tokens": estimate_tokens(content),
+        "createdAt": datetime.now().isoformat(),
+    })
+    overflow = len(conversation["messages"]) - MAX_STORED_MESSAGES
+    if overflow > 0:
+        del conversation["messages"][:overflow]
+        conversation["summarizedThrough"] = max(0, conversation["summarizedThrough"] - overflow)
+
+
+# Context window
+
+def _summary_messages(summary: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "user", "content": f"Summary of our conversation so far:\n{summary}"},
+        {"role": "model", "content": "Understood."},
+    ]
+
+
+def build_context(
+    conversation: Dict[str, Any], budget: int = CONTEXT_TOKEN_BUDGET
+) -> Tuple[List[Dict[str, str]], int]:
+    """Messages to send to the provider, and the index of the first stored message included.
+
+    The newest message is always included, even if it alone exceeds the budget.
+    """
+    messages = conversation["messages"]
+    summary = conversation.get("summary")
+    if summary:
+        budget -= estimate_tokens(summary) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+    used = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        cost = messages[i]["tokens"] + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget and start < len(messages):
+            break
+        used += cost
+        start = i
+
+    # Gemini expects the contents to open with a user turn
+    while start < len(messages) - 1 and messages[start]["role"] != "user":
+        start += 1
+
+    context = [{"role": m["role"], "content": m["content"]} for m in messages[start:]]
+    if summary and start > 0:
+        context = _summary_messages(summary) + context
+    return context, start
+
+
+def context_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def needs_summary(conversation: Dict[str, Any], window_start: int) -> bool:
+    """True once enough messages outside the window are missing from the summary"""
+    pending = conversation["messages"][conversation["summarizedThrough"]:window_start]
+    return sum(m["tokens"] for m in pending) >= SUMMARY_TRIGGER_TOKENS
+
+
+async def summarize_history(provider, conversation: Dict[str, Any], through: int) -> str:
+    """Ask the provider to fold messages [summarizedThrough, through) into the running summary"""
+    pending = conversation["messages"][conversation["summarizedThrough"]:through]
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in pending)
+    previous = conversation.get("summary") or "(none)"
+    prompt = (
+        "Update the summary of a conversation between a user and an assistant. "
+        "Keep names, facts, decisions and open questions; drop pleasantries. "
+        "Reply with the summary only, in at most 200 words.\n\n"
+        f"Current summary:\n{previous}\n\nNew messages:\n{transcript}"
+    )
+    summary = await provider.generate([{"role": "user", "content": prompt}], 0.2, MAX_SUMMARY_TOKENS)
+    # Keep the summary's share of the context bounded even if the model ignores the word limit
+    return summary.strip()[: MAX_SUMMARY_TOKENS * 4]
+
+
+__all__ = [
+    "CONTEXT_TOKEN_BUDGET",
+    "append_message",
+    "build_context",
+    "context_tokens",
+    "create_conversation",
+    "delete_conversation",
+    "estimate_tokens",
+    "list_conversations",
+    "load_conversation",
+    "needs_summary",
+    "save_conversation",
+    "summarize_history",
+]
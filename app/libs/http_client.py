@@ -0,0 +1,107 @@
+"""Process-wide async HTTP client for outbound provider calls.
+
+Usage:
+
+    from app.libs.http_client import get_http_client, request_with_retry
+
+    response = await request_with_retry("POST", url, json=payload)
+
+    async with get_http_client().stream("POST", url, json=payload) as response:
+        ...
+
+One client (and so one connection pool) is shared by every request in the
+process, keeping TLS connections to providers alive between calls. HTTP/2 is
+used when the h2 package is installed.
+"""
+
+import asyncio
+import importlib.util
+from typing import Any, Optional
+
+import httpx
+
+MAX_CONNECTIONS = 200
+MAX_KEEPALIVE_CONNECTIONS = 50
+KEEPALIVE_EXPIRY_SECONDS = 60.0
+
+DEFAULT_TIMEOUT = httpx.Timeout(60.0, connect=5.0, pool=10.0)
+
+# Connection failures are retried by the transport; these statuses by request_with_retry
+CONNECT_RETRIES = 2
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+MAX_RETRIES = 2
+BACKOFF_SECONDS = 0.5
+MAX_RETRY_AFTER_SECONDS = 10.0
+
+_client: Optional[httpx.AsyncClient] = None
+# Pooled connections belong to the event loop that opened them
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def _retire(client: httpx.AsyncClient, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+    """Close a client left behind by another event loop, on that loop if it still runs"""
+    if loop is not None and loop.is_running():
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+    else:
+        # Its connections can only be closed from their own loop, which is gone
+        print("HTTP client from a stopped event loop was replaced without closing its connections")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """The shared client, created on first use (and again if the event loop changes)"""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        if _client is not None and not _client.is_closed:
+            _retire(_client, _client_loop)
+        _client_loop = loop
+        http2 = http2_available()
+        _client = httpx.AsyncClient(
+            http2=http2,
+            timeout=DEFAULT_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            transport=httpx.AsyncHTTPTransport(http2=http2, retries=CONNECT_RETRIES),
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    """Close the shared client (on application shutdown)"""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    retry_after = response.headers.get("retry-after")
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), MAX_RETRY_AFTER_SECONDS)
+        except ValueError:
+            pass
+    return BACKOFF_SECONDS * (2 ** attempt)
+
+
+async def request_with_retry(method: str, url: str, *, max_retries: int = MAX_RETRIES, **kwargs: Any) -> httpx.Response:
+    """Send a request on the shared client, retrying rate limits and transient server errors"""
+    client = get_http_client()
+    for attempt in range(max_retries + 1):
+        response = await client.request(method, url, **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+            return response
+        delay = _retry_delay(response, attempt)
+        await response.aclose()
+        await asyncio.sleep(delay)
+    return response
+
+
+__all__ = ["get_http_client", "close_http_client", "request_with_retry"]
@@ -0,0 +1,168 @@
+"""Registry of authenticated provider clients, one per API connection.
+
+Usage:
+
+    from app.libs.provider_clients import provider_clients
+
+    client = await provider_clients.get(connection_id, "openai")   # None if it has no key
+    provider = client.chat_provider()                               # ChatProvider, or None
+    models = await client.openai().models.list()
+
+    provider_clients.invalidate(connection_id)   # after the key changes
+
+    cached = provider_clients.user_clients(user_id)           # None until cached
+    provider_clients.cache_user_clients(user_id, UserClients(clients, connections))
+    provider_clients.invalidate_user(user_id)   # after the user's connections change
+
+Clients are built the first time a connection is used and then reused, so
+callers don't rebuild SDK clients or look the key up in storage again. They
+all share the process-wide HTTP client, so TLS connections to the provider
+stay warm too. Keys come from secrets_cache; if a connection's key or service
+changes, its client is rebuilt on the next `get`. Clients that haven't been
+used for `idle_ttl` seconds are dropped.
+
+The clients resolved for a user (from their connections and the shared legacy
+ones) can be cached too, so a chat request doesn't read the user's connections
+from storage. The api_connections API invalidates a user's entry whenever it
+saves their connections; entries also expire after USER_CLIENTS_TTL seconds, to
+pick up changes made by other worker processes.
+"""
+
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import openai
+
+from app.libs.chat_providers import OPENAI_API_BASE_URL, ChatProvider, provider_for_service
+from app.libs.connections import api_key_name
+from app.libs.http_client import get_http_client
+from app.libs.secrets_cache import secrets_cache
+
+IDLE_TTL = 900.0
+# Idle clients are swept at most this often, from within `get`
+SWEEP_INTERVAL = 60.0
+USER_CLIENTS_TTL = 60.0
+
+
+class ProviderClient:
+    """Authenticated clients for one connection, each built on first use"""
+
+    def __init__(self, connection_id: str, service: str, api_key: str):
+        self.connection_id = connection_id
+        self.service = service
+        self.api_key = api_key
+        self.last_used = time.monotonic()
+        self._chat_providers: Dict[Optional[int], Optional[ChatProvider]] = {}
+        self._openai: Optional[openai.AsyncOpenAI] = None
+        self._openai_http: Optional[httpx.AsyncClient] = None
+
+    def chat_provider(self, max_retries: Optional[int] = None) -> Optional[ChatProvider]:
+        """Chat provider for this connection, or None if its service can't serve chat"""
+        if max_retries not in self._chat_providers:
+            kwargs = {} if max_retries is None else {"max_retries": max_retries}
+            self._chat_providers[max_retries] = provider_for_service(self.service, self.api_key, **kwargs)
+        return self._chat_providers[max_retries]
+
+    def openai(self) -> openai.AsyncOpenAI:
+        """OpenAI SDK client using this connection's key"""
+        http_client = get_http_client()
+        # The shared HTTP client is replaced if the event loop changes
+        if self._openai is None or self._openai_http is not http_client:
+            self._openai = openai.AsyncOpenAI(api_key=self.api_key, base_url=OPENAI_API_BASE_URL, http_client=http_client)
+            self._openai_http = http_client
+        return self._openai
+
+
+class UserClients:
+    """The clients resolved for one user, with the connections they were resolved from"""
+
+    def __init__(self, clients: List[ProviderClient], connections: Dict[str, Dict[str, Any]]):
+        self.clients = clients
+        # Connection id -> {"service", "status", "owner"}, including connections without a client
+        self.connections = connections
+        self.loaded = time.monotonic()
+
+    def uses(self, connection_id: str) -> bool:
+        return connection_id in self.connections or any(client.connection_id == connection_id for client in self.clients)
+
+
+class ProviderClientRegistry:
+    def __init__(self, idle_ttl: float = IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._clients: Dict[str, ProviderClient] = {}
+        self._users: Dict[str, UserClients] = {}
+        self._last_sweep = time.monotonic()
+        self.builds = 0
+        self.evictions = 0
+
+    async def get(self, connection_id: str, service: str, secret_name: Optional[str] = None) -> Optional[ProviderClient]:
+        """Client for a connection, or None if its key is missing or empty.
+
+        The key is read from the secret `secret_name`, by default the
+        connection's own API key secret.
+        """
+        now = time.monotonic()
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self.evict_idle(now)
+        try:
+            api_key = await secrets_cache.get(secret_name or api_key_name(connection_id))
+        except KeyError:
+            api_key = ""
+        if not api_key:
+            self.invalidate(connection_id)
+            return None
+
+        client = self._clients.get(connection_id)
+        if client is None or client.api_key != api_key or client.service != service:
+            client = ProviderClient(connection_id, service, api_key)
+            self._clients[connection_id] = client
+            self.builds += 1
+        client.last_used = now
+        return client
+
+    def user_clients(self, user_id: str) -> Optional[UserClients]:
+        """The user's cached clients, or None if there are none or they are older than USER_CLIENTS_TTL"""
+        entry = self._users.get(user_id)
+        now = time.monotonic()
+        if entry is None or now - entry.loaded >= USER_CLIENTS_TTL:
+            return None
+        for client in entry.clients:
+            client.last_used = now
+        return entry
+
+    def cache_user_clients(self, user_id: str, entry: UserClients) -> None:
+        self._users[user_id] = entry
+
+    def invalidate_user(self, user_id: Optional[str] = None) -> None:
+        """Drop a user's cached clients (every user's if user_id is None)"""
+        if user_id is None:
+            self._users.clear()
+        else:
+            self._users.pop(user_id, None)
+
+    def invalidate(self, connection_id: str) -> None:
+        self._clients.pop(connection_id, None)
+        for user_id in [user_id for user_id, entry in self._users.items() if entry.uses(connection_id)]:
+            del self._users[user_id]
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Drop clients unused for idle_ttl seconds; returns how many were dropped"""
+        now = time.monotonic() if now is None else now
+        self._last_sweep = now
+        idle = [connection_id for connection_id, client in self._clients.items() if now - client.last_used >= self.idle_ttl]
+        for connection_id in idle:
+            del self._clients[connection_id]
+        self.evictions += len(idle)
+        expired = [user_id for user_id, entry in self._users.items() if now - entry.loaded >= USER_CLIENTS_TTL]
+        for user_id in expired:
+            del self._users[user_id]
+        return len(idle)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._clients), "users": len(self._users), "builds": self.builds, "evictions": self.evictions}
+
+
+provider_clients = ProviderClientRegistry()
+
+__all__ = ["ProviderClient", "ProviderClientRegistry", "UserClients", "provider_clients"]
@@ -0,0 +1,245 @@
+"""Token-bucket rate limits for AI calls, with a bounded priority queue.
+
+Usage:
+
+    from app.libs.rate_limit import INTERACTIVE, RateLimiter, RateLimitExceeded, Limit
+
+    limiter = RateLimiter(lambda key: Limit(requests_per_minute=30, tokens_per_minute=60000))
+    waited = await limiter.acquire(["user:abc"], tokens=1200, priority=INTERACTIVE)
+
+Every key has up to two buckets: one counting requests and one counting tokens
+(estimated prompt tokens plus max_output_tokens); a limit left as None has no
+bucket. They refill continuously, and each holds at most `burst_seconds`
+(BURST_SECONDS by default) of capacity. As a result, even at high
+utilization calls are spread out evenly instead of bunching at the start of
+each minute.
+
+When a bucket is empty the caller waits in a queue rather than failing. Waiters
+are served by priority (INTERACTIVE before BATCH) and then by arrival. A waiter
+only blocks lower-priority waiters that share one of its keys. Once the queue
+holds `max_queue` waiters, or a waiter has waited `max_wait` seconds,
+RateLimitExceeded is raised with a retry-after hint.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from app.libs.chat_providers import ChatProvider, ChatProviderError
+
+INTERACTIVE = 0
+BATCH = 10
+
+BURST_SECONDS = 10.0
+
+# Priority of the AI calls made while handling the current request
+current_priority: contextvars.ContextVar[int] = contextvars.ContextVar("ai_call_priority", default=INTERACTIVE)
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after: float, message: str = "Rate limit exceeded"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class Limit:
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+    burst_seconds: float = BURST_SECONDS
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, minimum_capacity: float = 1.0, burst_seconds: float = BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(minimum_capacity, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        if now > self.updated:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (requests larger than the bucket take it all)"""
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    keys: List[str] = field(compare=False)
+    tokens: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class RateLimiter:
+    def __init__(self, limit_for: Callable[[str], Optional[Limit]], max_queue: int = 200, max_wait: float = 30.0):
+        # limit_for returns None for keys that aren't limited
+        self.limit_for = limit_for
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._buckets: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _buckets_for(self, key: str) -> Optional[Tuple[Optional[TokenBucket], Optional[TokenBucket]]]:
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            limit = self.limit_for(key)
+            if limit is None or (limit.requests_per_minute is None and limit.tokens_per_minute is None):
+                return None
+            buckets = tuple(
+                TokenBucket(per_minute, burst_seconds=limit.burst_seconds) if per_minute is not None else None
+                for per_minute in (limit.requests_per_minute, limit.tokens_per_minute)
+            )
+            self._buckets[key] = buckets
+        return buckets
+
+    def _wait_time(self, keys: List[str], tokens: int, now: float) -> float:
+        wait = 0.0
+        for key in keys:
+            buckets = self._buckets_for(key)
+            if buckets is not None:
+                for bucket, amount in zip(buckets, (1, tokens)):
+                    if bucket is not None:
+                        wait = max(wait, bucket.wait_time(amount, now))
+        return wait
+
+    def _take(self, keys: List[str], tokens: int) -> None:
+        for key in keys:
+            buckets = self._buckets_for(key)
+            if buckets is not None:
+                for bucket, amount in zip(buckets, (1, tokens)):
+                    if bucket is not None:
+                        bucket.take(amount)
+
+    def _pump(self) -> None:
+        """Grant every waiter that can go now, and schedule a wake-up for the rest"""
+        self._timer = None
+        now = time.monotonic()
+        blocked: set = set()
+        next_wake: Optional[float] = None
+        for waiter in list(self._queue):
+            if waiter.future.done():
+                self._queue.remove(waiter)
+                continue
+            if blocked.intersection(waiter.keys):
+                continue
+            wait = self._wait_time(waiter.keys, waiter.tokens, now)
+            if wait == 0.0:
+                self._take(waiter.keys, waiter.tokens)
+                self._queue.remove(waiter)
+                waiter.future.set_result(None)
+            else:
+                blocked.update(waiter.keys)
+                next_wake = wait if next_wake is None else min(next_wake, wait)
+        if next_wake is not None:
+            self._timer = asyncio.get_running_loop().call_later(next_wake, self._pump)
+
+    def _reschedule(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._pump()
+
+    async def acquire(self, keys: List[str], tokens: int, priority: int = INTERACTIVE) -> float:
+        """Wait for capacity on every key and take it; returns the seconds spent queued"""
+        now = time.monotonic()
+        if not any(set(keys).intersection(w.keys) for w in self._queue):
+            wait = self._wait_time(keys, tokens, now)
+            if wait == 0.0:
+                self._take(keys, tokens)
+                return 0.0
+        else:
+            wait = self._wait_time(keys, tokens, now)
+
+        if len(self._queue) >= self.max_queue:
+            raise RateLimitExceeded(max(wait, 1.0), "Too many queued requests")
+
+        waiter = _Waiter(priority, next(self._seq), list(keys), tokens, asyncio.get_running_loop().create_future())
+        bisect.insort(self._queue, waiter)
+        self._reschedule()
+        try:
+            done, _ = await asyncio.wait({waiter.future}, timeout=self.max_wait)
+        finally:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                if waiter in self._queue:
+                    self._queue.remove(waiter)
+                    self._reschedule()
+        if not done:
+            raise RateLimitExceeded(self._wait_time(keys, tokens, time.monotonic()) or 1.0,
+                                    "Timed out waiting for rate limit")
+        return time.monotonic() - now
+
+    def status(self, key: str) -> Optional[Dict[str, int]]:
+        """Current limits and remaining capacity for a key (only the limited ones), for response headers"""
+        buckets = self._buckets_for(key)
+        if buckets is None:
+            return None
+        now = time.monotonic()
+        status = {"queued": len(self._queue)}
+        for bucket, name in zip(buckets, ("requests", "tokens")):
+            if bucket is not None:
+                bucket.refill(now)
+                status[f"limit_{name}"] = int(bucket.rate * 60)
+                status[f"remaining_{name}"] = max(0, int(bucket.level))
+        return status
+
+
+class RateLimitedProvider(ChatProvider):
+    """Wraps a provider so its calls draw from the provider's own buckets.
+
+    Calls that can't get capacity fail with a 429, so the chat router falls over
+    to another provider instead of queueing behind this one.
+    """
+
+    def __init__(self, provider: ChatProvider, key: str, limiter: RateLimiter, estimate: Callable[..., int]):
+        self.provider = provider
+        self.name = provider.name
+        self.model = getattr(provider, "model", None)
+        self.key = key
+        self.limiter = limiter
+        self.estimate = estimate
+
+    def identity(self) -> str:
+        return self.provider.identity()
+
+    async def _acquire(self, messages: List[Dict[str, str]], max_output_tokens: int) -> None:
+        try:
+            await self.limiter.acquire([self.key], self.estimate(messages, max_output_tokens), current_priority.get())
+        except RateLimitExceeded as e:
+            raise ChatProviderError(429, f"{self.key}: {str(e)}")
+
+    async def generate(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int) -> str:
+        await self._acquire(messages, max_output_tokens)
+        return await self.provider.generate(messages, temperature, max_output_tokens)
+
+    async def stream(self, messages: List[Dict[str, str]], temperature: float, max_output_tokens: int) -> AsyncIterator[str]:
+        await self._acquire(messages, max_output_tokens)
+        async for chunk in self.provider.stream(messages, temperature, max_output_tokens):
+            yield chunk
+
+
+__all__ = [
+    "BATCH",
+    "INTERACTIVE",
+    "Limit",
+    "RateLimitExceeded",
+    "RateLimitedProvider",
+    "RateLimiter",
+    "TokenBucket",
+    "current_priority",
+]
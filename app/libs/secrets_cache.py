@@ -0,0 +1,103 @@
+"""In-process cache in front of app.libs.storage.secrets.
+
+Usage:
+
+    from app.libs.secrets_cache import secrets_cache
+
+    api_key = await secrets_cache.get("GEMINI_API_KEY")   # KeyError if it doesn't exist
+    await secrets_cache.put("API_CONNECTION_x", api_key)   # write-through
+    secrets_cache.invalidate("API_CONNECTION_x")
+
+Values are kept for `ttl` seconds. A lookup during the last `refresh_ahead`
+seconds returns the cached value and starts a background refresh, so
+frequently used secrets are never fetched on a request's critical path.
+Concurrent misses for the same name share a single fetch. Missing secrets are
+remembered for `missing_ttl` seconds.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from app.libs.blocking import run_blocking
+from app.libs.storage import secrets
+
+
+@dataclass
+class _Entry:
+    value: Optional[str]  # None when the secret doesn't exist
+    expires_at: float
+    refresh_at: float
+
+
+class SecretsCache:
+    def __init__(self, ttl: float = 300.0, refresh_ahead: float = 60.0, missing_ttl: float = 30.0):
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.missing_ttl = missing_ttl
+        self._entries: Dict[str, _Entry] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Bumped on every write or invalidation, so a fetch that started earlier can't store a stale value
+        self._generations: Dict[str, int] = {}
+
+    def _entry(self, value: Optional[str]) -> _Entry:
+        now = time.monotonic()
+        ttl = self.ttl if value is not None else self.missing_ttl
+        return _Entry(value, now + ttl, now + max(0.0, ttl - self.refresh_ahead))
+
+    async def _fetch(self, name: str) -> _Entry:
+        generation = self._generations.get(name, 0)
+        try:
+            value: Optional[str] = await run_blocking(secrets.get, name)
+        except KeyError:
+            value = None
+        entry = self._entry(value)
+        if self._generations.get(name, 0) == generation:
+            self._entries[name] = entry
+        return entry
+
+    def _load(self, name: str) -> asyncio.Task:
+        """The in-flight fetch for a name, starting one if needed"""
+        task = self._inflight.get(name)
+        if task is None:
+            task = asyncio.create_task(self._fetch(name))
+            self._inflight[name] = task
+
+            def finished(done: asyncio.Task) -> None:
+                if self._inflight.get(name) is done:
+                    del self._inflight[name]
+                if not done.cancelled() and done.exception() is not None:
+                    print(f"Error fetching secret {name}: {str(done.exception())}")
+
+            task.add_done_callback(finished)
+        return task
+
+    async def get(self, name: str) -> str:
+        entry = self._entries.get(name)
+        now = time.monotonic()
+        if entry is None or now >= entry.expires_at:
+            # Shielded so one caller giving up doesn't cancel the fetch for the others
+            entry = await asyncio.shield(self._load(name))
+        elif now >= entry.refresh_at:
+            self._load(name)
+
+        if entry.value is None:
+            raise KeyError(f"Secret named {name} not found in this app")
+        return entry.value
+
+    async def put(self, name: str, value: str) -> None:
+        """Write a secret and update the cache"""
+        await run_blocking(secrets.put, name, value)
+        self.invalidate(name)
+        self._entries[name] = self._entry(value)
+
+    def invalidate(self, name: str) -> None:
+        self._generations[name] = self._generations.get(name, 0) + 1
+        self._entries.pop(name, None)
+        self._inflight.pop(name, None)
+
+
+secrets_cache = SecretsCache()
+
+__all__ = ["SecretsCache", "secrets_cache"]
@@ -0,0 +1,281 @@
+"""Storage and secrets with a selectable backend.
+
+Usage:
+
+    from app.libs.storage import storage, secrets
+
+    storage.json.put("key", {"a": 1})
+    storage.json.get("key", default={})
+    storage.binary.get("key")            # raises FileNotFoundError if missing
+    [entry.name for entry in storage.text.list()]
+    secrets.get("GEMINI_API_KEY")        # raises KeyError if missing
+
+The objects mirror db.storage and db.secrets from the databutton SDK, which
+remains the default. Set STORAGE_BACKEND (see app.env) to "sqlite" or
+"filesystem" to run without the hosted service; STORAGE_PATH points at the
+database file or directory.
+"""
+
+import json
+import os
+import pathlib
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from pydantic import BaseModel
+
+from app.env import StorageBackend, storage_backend
+
+DEFAULT_SQLITE_PATH = ".storage/storage.sqlite3"
+DEFAULT_FILESYSTEM_PATH = ".storage"
+
+_key_validator = re.compile("[a-zA-Z0-9-_.]+")
+
+
+class StorageEntry(BaseModel):
+    name: str
+    size: int
+
+
+def _validate_key(key: str) -> None:
+    if not _key_validator.fullmatch(key):
+        raise ValueError('Key can only consist of letters (A-Z, a-z), digits (0-9), or the symbols "._-".')
+
+
+def _missing(key: str, default: Optional[Any]) -> Any:
+    # Same semantics as databutton: a default is returned (or called) if given
+    if default is not None:
+        return default() if callable(default) else default
+    raise FileNotFoundError(key)
+
+
+# Value (de)serialization per content type
+
+def _encode(content_type: str, value: Any) -> bytes:
+    if content_type == "json":
+        return json.dumps(value).encode("utf-8")
+    if content_type == "text":
+        return value.encode("utf-8")
+    return bytes(value)
+
+
+def _decode(content_type: str, data: bytes) -> Any:
+    if content_type == "json":
+        return json.loads(data)
+    if content_type == "text":
+        return data.decode("utf-8")
+    return data
+
+
+# SQLite backend
+
+class SqliteDatabase:
+    """SQLite file in WAL mode, one connection per thread"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS storage ("
+                " content_type TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value BLOB NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (content_type, key)"
+                ") WITHOUT ROWID"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS secrets (name TEXT PRIMARY KEY, value BLOB NOT NULL)")
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+class SqliteContentStorage:
+    def __init__(self, database: SqliteDatabase, content_type: str):
+        self.database = database
+        self.content_type = content_type
+
+    def put(self, key: str, value: Any) -> None:
+        _validate_key(key)
+        with self.database.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO storage (content_type, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                (self.content_type, key, _encode(self.content_type, value), time.time()),
+            )
+
+    def get(self, key: str, *, default: Optional[Any] = None) -> Any:
+        _validate_key(key)
+        row = (
+            self.database.connection()
+            .execute("SELECT value FROM storage WHERE content_type = ? AND key = ?", (self.content_type, key))
+            .fetchone()
+        )
+        if row is None:
+            return _missing(key, default)
+        return _decode(self.content_type, row[0])
+
+    def delete(self, key: str) -> None:
+        _validate_key(key)
+        with self.database.connection() as conn:
+            conn.execute("DELETE FROM storage WHERE content_type = ? AND key = ?", (self.content_type, key))
+
+    def list(self) -> List[StorageEntry]:
+        rows = (
+            self.database.connection()
+            .execute("SELECT key, length(value) FROM storage WHERE content_type = ? ORDER BY key", (self.content_type,))
+            .fetchall()
+        )
+        return [StorageEntry(name=name, size=size) for name, size in rows]
+
+
+class SqliteSecrets:
+    def __init__(self, database: SqliteDatabase):
+        self.database = database
+
+    def put(self, name: str, value: str | bytes) -> None:
+        _validate_key(name)
+        data = value.encode("utf-8") if isinstance(value, str) else value
+        with self.database.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO secrets (name, value) VALUES (?, ?)", (name, data))
+
+    def get_as_bytes(self, name: str) -> bytes:
+        _validate_key(name)
+        row = self.database.connection().execute("SELECT value FROM secrets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(f"Secret named {name} not found in this app")
+        return row[0]
+
+    def get(self, name: str) -> str:
+        return self.get_as_bytes(name).decode("utf-8")
+
+    def delete(self, name: str) -> bool:
+        _validate_key(name)
+        with self.database.connection() as conn:
+            return conn.execute("DELETE FROM secrets WHERE name = ?", (name,)).rowcount > 0
+
+    def get_names(self) -> List[str]:
+        rows = self.database.connection().execute("SELECT name FROM secrets ORDER BY name").fetchall()
+        return [name for (name,) in rows]
+
+
+# Filesystem backend
+
+def _write_atomic(path: pathlib.Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class FilesystemContentStorage:
+    def __init__(self, root: pathlib.Path, content_type: str):
+        self.directory = root / content_type
+        self.content_type = content_type
+
+    def put(self, key: str, value: Any) -> None:
+        _validate_key(key)
+        _write_atomic(self.directory / key, _encode(self.content_type, value))
+
+    def get(self, key: str, *, default: Optional[Any] = None) -> Any:
+        _validate_key(key)
+        try:
+            data = (self.directory / key).read_bytes()
+        except FileNotFoundError:
+            return _missing(key, default)
+        return _decode(self.content_type, data)
+
+    def delete(self, key: str) -> None:
+        _validate_key(key)
+        (self.directory / key).unlink(missing_ok=True)
+
+    def list(self) -> List[StorageEntry]:
+        if not self.directory.exists():
+            return []
+        return [
+            StorageEntry(name=path.name, size=path.stat().st_size)
+            for path in sorted(self.directory.iterdir())
+            if not path.name.startswith(".tmp-")
+        ]
+
+
+class FilesystemSecrets:
+    def __init__(self, root: pathlib.Path):
+        self.directory = root / "secrets"
+
+    def put(self, name: str, value: str | bytes) -> None:
+        _validate_key(name)
+        _write_atomic(self.directory / name, value.encode("utf-8") if isinstance(value, str) else value)
+
+    def get_as_bytes(self, name: str) -> bytes:
+        _validate_key(name)
+        try:
+            return (self.directory / name).read_bytes()
+        except FileNotFoundError:
+            raise KeyError(f"Secret named {name} not found in this app")
+
+    def get(self, name: str) -> str:
+        return self.get_as_bytes(name).decode("utf-8")
+
+    def delete(self, name: str) -> bool:
+        _validate_key(name)
+        try:
+            (self.directory / name).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def get_names(self) -> List[str]:
+        if not self.directory.exists():
+            return []
+        return sorted(p.name for p in self.directory.iterdir() if not p.name.startswith(".tmp-"))
+
+
+class LocalStorage:
+    """Container with the same .json/.text/.binary layout as db.storage"""
+
+    def __init__(self, factory: Callable[[str], Any]):
+        self.json = factory("json")
+        self.text = factory("text")
+        self.binary = factory("binary")
+
+
+def create_backend(backend: StorageBackend, path: Optional[str] = None) -> tuple:
+    """Create (storage, secrets) for a backend"""
+    if backend == StorageBackend.SQLITE:
+        database = SqliteDatabase(path or DEFAULT_SQLITE_PATH)
+        return LocalStorage(lambda content_type: SqliteContentStorage(database, content_type)), SqliteSecrets(database)
+
+    if backend == StorageBackend.FILESYSTEM:
+        root = pathlib.Path(path or DEFAULT_FILESYSTEM_PATH)
+        return LocalStorage(lambda content_type: FilesystemContentStorage(root, content_type)), FilesystemSecrets(root)
+
+    import databutton as db
+
+    return db.storage, db.secrets
+
+
+storage, secrets = create_backend(storage_backend, os.environ.get("STORAGE_PATH"))
+
+__all__ = [
+    "StorageEntry",
+    "create_backend",
+    "storage",
+    "secrets",
+]
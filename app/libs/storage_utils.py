@@ -0,0 +1,42 @@
+"""Helpers shared by the modules that keep per-user data in storage.
+
+Usage:
+
+    from app.libs.storage_utils import KeyedLocks, sanitize_key
+
+    key = f"workflows_index_{sanitize_key(user_id)}"
+
+    index_locks = KeyedLocks()
+    async with index_locks.get(user_id):   # one read-modify-write per user at a time
+        ...
+
+Storage calls block, and so do the library functions built on them
+(app.libs.connections, conversations, usage, workflow_history); call them
+through run_blocking.
+"""
+
+import asyncio
+import re
+import weakref
+
+
+def sanitize_key(key: str) -> str:
+    """Sanitize storage key to only allow alphanumeric and ._- symbols"""
+    return re.sub(r"[^a-zA-Z0-9._-]", "", key)
+
+
+class KeyedLocks:
+    """asyncio locks by key, dropped once nothing holds or waits on them"""
+
+    def __init__(self):
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def get(self, key: str) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+
+__all__ = ["KeyedLocks", "sanitize_key"]
@@ -0,0 +1,297 @@
+"""Usage metering for AI calls: tokens and latency per user, rolled up per day.
+
+Usage:
+
+    from app.libs.usage import usage_meter
+
+    with usage_meter.track(user_id, "chat", messages) as call:
+        text = await provider.generate(messages, temperature, max_output_tokens)
+        call.completion = text
+
+Providers call `report_usage(...)` with the token counts the API returned;
+they land on the innermost `track` block of the current task. Without a
+report, tokens are estimated from the prompt and completion text.
+
+Recording only appends a tuple to an in-memory ring buffer. `flush` (run
+periodically off the event loop by `run_flusher`) drains the buffer and
+merges it into a rollup per user and day. Each process writes its own rollup
+shard, `usage.{shard}_{user}_{YYYY-MM-DD}`, so workers never overwrite each
+other's counts. `get_usage` finds a user's shards with one storage listing
+(no registry to keep in sync) and reads them concurrently. Events whose write
+fails go back into the buffer. When the buffer is full the oldest events are
+dropped and counted in `dropped`.
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import date, datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.libs.blocking import run_blocking
+from app.libs.conversations import estimate_tokens
+from app.libs.storage import storage
+from app.libs.storage_utils import sanitize_key
+
+BUFFER_SIZE = 20000
+FLUSH_INTERVAL = 30.0
+# Rollup shards read at once by get_usage
+READ_CONCURRENCY = 8
+
+SHARD_KEY_PREFIX = "usage."
+
+# (timestamp, user, kind, provider, model, prompt tokens, completion tokens, latency ms, ok, cached)
+UsageEvent = Tuple[float, str, str, str, str, int, int, float, bool, bool]
+
+
+def usage_shard_key(shard: str, user_id: str, day: str) -> str:
+    return f"{SHARD_KEY_PREFIX}{shard}_{sanitize_key(user_id)}_{day}"
+
+
+def stored_shard_keys(user_id: str, start: date, end: date) -> List[str]:
+    """Keys of every process's rollup shard for a user from `start` to `end` (one listing, blocking)"""
+    user_part = f"{sanitize_key(user_id)}_"
+    first, last = start.isoformat(), end.isoformat()
+    keys = []
+    for entry in storage.json.list():
+        name = entry.name
+        if not name.startswith(SHARD_KEY_PREFIX):
+            continue
+        # "{shard}_{user}_" and the day; shard ids contain no "_"
+        head, day = name[len(SHARD_KEY_PREFIX):-10], name[-10:]
+        shard, _, rest = head.partition("_")
+        if shard and rest == user_part and first <= day <= last:
+            keys.append(name)
+    return keys
+
+
+class CallUsage:
+    """Details of one call, filled in while it runs"""
+
+    __slots__ = ("provider", "model", "prompt_tokens", "completion_tokens", "completion", "cached")
+
+    def __init__(self):
+        self.provider = ""
+        self.model = ""
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.completion = ""
+        self.cached = False
+
+
+_current_call: contextvars.ContextVar[Optional[CallUsage]] = contextvars.ContextVar("usage_call", default=None)
+
+
+def report_usage(provider: str, model: Optional[str], prompt_tokens: Optional[int] = None,
+                 completion_tokens: Optional[int] = None) -> None:
+    """Called by providers with the usage their API reported"""
+    call = _current_call.get()
+    if call is None:
+        return
+    call.provider = provider
+    call.model = model or ""
+    if prompt_tokens is not None:
+        call.prompt_tokens = prompt_tokens
+    if completion_tokens is not None:
+        call.completion_tokens = completion_tokens
+
+
+class _Tracker:
+    def __init__(self, meter: "UsageMeter", user_id: str, kind: str, messages: List[Dict[str, str]]):
+        self.meter = meter
+        self.user_id = user_id
+        self.kind = kind
+        self.messages = messages
+        self.call = CallUsage()
+
+    def __enter__(self) -> CallUsage:
+        self.started = time.perf_counter()
+        self.token = _current_call.set(self.call)
+        return self.call
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            _current_call.reset(self.token)
+        except ValueError:
+            # Exited from another context, e.g. a stream finalized after its task ended
+            pass
+        call = self.call
+        if call.cached:
+            prompt_tokens = completion_tokens = 0
+        else:
+            prompt_tokens = call.prompt_tokens
+            if prompt_tokens is None:
+                prompt_tokens = sum(estimate_tokens(m["content"]) for m in self.messages)
+            completion_tokens = call.completion_tokens
+            if completion_tokens is None:
+                completion_tokens = estimate_tokens(call.completion)
+        self.meter.record((
+            time.time(),
+            self.user_id,
+            self.kind,
+            call.provider,
+            call.model,
+            prompt_tokens,
+            completion_tokens,
+            (time.perf_counter() - self.started) * 1000.0,
+            exc_type is None,
+            call.cached,
+        ))
+
+
+def _empty_rollup(day: str) -> Dict[str, Any]:
+    return {
+        "date": day,
+        "requests": 0,
+        "errors": 0,
+        "cached": 0,
+        "promptTokens": 0,
+        "completionTokens": 0,
+        "latencyMsTotal": 0.0,
+        "models": {},
+    }
+
+
+def _add_event(rollup: Dict[str, Any], event: UsageEvent) -> None:
+    _, _, _, provider, model, prompt_tokens, completion_tokens, latency_ms, ok, cached = event
+    rollup["requests"] += 1
+    rollup["errors"] += 0 if ok else 1
+    rollup["cached"] += 1 if cached else 0
+    rollup["promptTokens"] += prompt_tokens
+    rollup["completionTokens"] += completion_tokens
+    rollup["latencyMsTotal"] += latency_ms
+    if provider:
+        name = f"{provider}/{model}" if model else provider
+        per_model = rollup["models"].setdefault(name, {"requests": 0, "promptTokens": 0, "completionTokens": 0})
+        per_model["requests"] += 1
+        per_model["promptTokens"] += prompt_tokens
+        per_model["completionTokens"] += completion_tokens
+
+
+def _merge_rollup(rollup: Dict[str, Any], other: Dict[str, Any]) -> None:
+    for field in ("requests", "errors", "cached", "promptTokens", "completionTokens", "latencyMsTotal"):
+        rollup[field] += other.get(field, 0)
+    for name, other_model in other.get("models", {}).items():
+        per_model = rollup["models"].setdefault(name, {"requests": 0, "promptTokens": 0, "completionTokens": 0})
+        for field in per_model:
+            per_model[field] += other_model.get(field, 0)
+
+
+def _event_day(event: UsageEvent) -> str:
+    return datetime.fromtimestamp(event[0], tz=timezone.utc).date().isoformat()
+
+
+class UsageMeter:
+    def __init__(self, capacity: int = BUFFER_SIZE, shard: Optional[str] = None):
+        self._buffer: Deque[UsageEvent] = deque(maxlen=capacity)
+        self.dropped = 0
+        # This process's rollup shard; no other process writes it
+        self.shard = shard or uuid.uuid4().hex[:12]
+        if "_" in self.shard:
+            raise ValueError("Usage shard ids can't contain '_'")
+        # Flushes read-modify-write the shard, so only one may run at a time
+        self._flush_lock = threading.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+
+    def track(self, user_id: str, kind: str, messages: List[Dict[str, str]]) -> _Tracker:
+        return _Tracker(self, user_id, kind, messages)
+
+    def record(self, event: UsageEvent) -> None:
+        buffer = self._buffer
+        if len(buffer) == buffer.maxlen:
+            self.dropped += 1
+        buffer.append(event)
+
+    def pending(self, user_id: str) -> List[UsageEvent]:
+        """Unflushed events for a user"""
+        return [event for event in list(self._buffer) if event[1] == user_id]
+
+    def flush(self) -> int:
+        """Merge buffered events into the stored rollups; blocking, returns the number flushed"""
+        events: List[UsageEvent] = []
+        buffer = self._buffer
+        while True:
+            try:
+                events.append(buffer.popleft())
+            except IndexError:
+                break
+        if not events:
+            return 0
+
+        batches: Dict[Tuple[str, str], List[UsageEvent]] = {}
+        for event in events:
+            batches.setdefault((event[1], _event_day(event)), []).append(event)
+        with self._flush_lock:
+            for (user_id, day), batch in list(batches.items()):
+                try:
+                    self._write(user_id, day, batch)
+                except Exception:
+                    self._restore([event for unwritten in batches.values() for event in unwritten])
+                    raise
+                del batches[(user_id, day)]
+        return len(events)
+
+    def _write(self, user_id: str, day: str, batch: List[UsageEvent]) -> None:
+        key = usage_shard_key(self.shard, user_id, day)
+        rollup = storage.json.get(key, default={}) or _empty_rollup(day)
+        for event in batch:
+            _add_event(rollup, event)
+        storage.json.put(key, rollup)
+
+    def _restore(self, events: List[UsageEvent]) -> None:
+        """Put unwritten events back at the front of the buffer, dropping the oldest if it's full"""
+        buffer = self._buffer
+        room = buffer.maxlen - len(buffer)
+        if len(events) > room:
+            self.dropped += len(events) - room
+            events = events[len(events) - room:]
+        buffer.extendleft(reversed(events))
+
+    async def run_flusher(self, interval: float = FLUSH_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_blocking(self.flush)
+            except Exception as e:
+                print(f"Error flushing usage events: {str(e)}")
+
+    def start(self) -> None:
+        """Start the periodic flush (app startup)"""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self.run_flusher())
+
+    async def stop(self) -> None:
+        """Stop the periodic flush and write what's left (app shutdown)"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await run_blocking(self.flush)
+
+
+async def get_usage(meter: UsageMeter, user_id: str, start: date, end: date) -> List[Dict[str, Any]]:
+    """Daily rollups for a user from `start` to `end` inclusive, including unflushed events"""
+    keys = await run_blocking(stored_shard_keys, user_id, start, end)
+    semaphore = asyncio.Semaphore(READ_CONCURRENCY)
+
+    async def read(key: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await run_blocking(storage.json.get, key, default={})
+
+    rollups: Dict[str, Dict[str, Any]] = {}
+    for rollup in await asyncio.gather(*(read(key) for key in keys)):
+        if rollup:
+            _merge_rollup(rollups.setdefault(rollup["date"], _empty_rollup(rollup["date"])), rollup)
+
+    for event in meter.pending(user_id):
+        event_day = _event_day(event)
+        if start.isoformat() <= event_day <= end.isoformat():
+            _add_event(rollups.setdefault(event_day, _empty_rollup(event_day)), event)
+    return [rollups[d] for d in sorted(rollups)]
+
+
+usage_meter = UsageMeter()
+
+__all__ = ["CallUsage", "UsageMeter", "get_usage", "report_usage", "usage_meter"]
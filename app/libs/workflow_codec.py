@@ -0,0 +1,147 @@
+"""Compact binary storage format for workflow documents.
+
+Usage:
+
+    from app.libs.workflow_codec import encode_document, decode_document, to_json_bytes
+
+    data = encode_document(workflow.dict())  # bytes for storage.binary
+    doc = decode_document(data)              # dict, also accepts legacy JSON bytes
+    raw = to_json_bytes(data)                # canonical JSON bytes for responses
+
+Layout of an encoded document:
+
+    b"DCWF" | format version (1 byte) | codec id (1 byte) | payload
+
+Documents that don't start with the magic prefix are treated as plain JSON,
+so bytes written before this format existed keep working.
+"""
+
+import zlib
+from enum import IntEnum
+from typing import Any, Dict
+
+import orjson
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+
+MAGIC = b"DCWF"
+FORMAT_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 2
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+class Codec(IntEnum):
+    JSON = 0
+    JSON_ZLIB = 1
+    MSGPACK_ZLIB = 2
+    MSGPACK_ZSTD = 3
+
+
+def available_codecs() -> list[Codec]:
+    """Codecs usable with the packages installed in this environment"""
+    codecs = [Codec.JSON, Codec.JSON_ZLIB]
+    if msgpack is not None:
+        codecs.append(Codec.MSGPACK_ZLIB)
+        if zstandard is not None:
+            codecs.append(Codec.MSGPACK_ZSTD)
+    return codecs
+
+
+def default_codec() -> Codec:
+    """Best codec available, used for new writes"""
+    return available_codecs()[-1]
+
+
+def _pack(doc: Dict[str, Any], codec: Codec) -> bytes:
+    if codec in (Codec.JSON, Codec.JSON_ZLIB):
+        payload = orjson.dumps(doc, option=orjson.OPT_SORT_KEYS)
+    else:
+        payload = msgpack.packb(doc, use_bin_type=True)
+
+    if codec == Codec.JSON_ZLIB or codec == Codec.MSGPACK_ZLIB:
+        return zlib.compress(payload, ZLIB_LEVEL)
+    if codec == Codec.MSGPACK_ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(payload)
+    return payload
+
+
+def _unpack(payload: bytes, codec: Codec) -> Dict[str, Any]:
+    if codec == Codec.JSON:
+        return orjson.loads(payload)
+    if codec == Codec.JSON_ZLIB:
+        return orjson.loads(zlib.decompress(payload))
+    if msgpack is None:
+        raise RuntimeError("msgpack is required to read this workflow document")
+    if codec == Codec.MSGPACK_ZLIB:
+        return msgpack.unpackb(zlib.decompress(payload), raw=False)
+    if codec == Codec.MSGPACK_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read this workflow document")
+        return msgpack.unpackb(zstandard.ZstdDecompressor().decompress(payload), raw=False)
+    raise ValueError(f"Unknown workflow codec: {codec}")
+
+
+def is_encoded(data: bytes) -> bool:
+    """Whether the bytes use the binary format (as opposed to legacy JSON)"""
+    return data[: len(MAGIC)] == MAGIC
+
+
+def encode_document(doc: Dict[str, Any], codec: Codec | None = None) -> bytes:
+    """Encode a workflow document for storage"""
+    codec = default_codec() if codec is None else Codec(codec)
+    return MAGIC + bytes((FORMAT_VERSION, codec)) + _pack(doc, codec)
+
+
+def decode_document(data: bytes) -> Dict[str, Any]:
+    """Decode a stored workflow document, accepting both binary and legacy JSON.
+
+    Raises ValueError for corrupt or truncated documents.
+    """
+    if not is_encoded(data):
+        return orjson.loads(data)
+
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Truncated workflow document header")
+    version, codec = data[len(MAGIC)], data[len(MAGIC) + 1]
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported workflow format version: {version}")
+    try:
+        return _unpack(data[HEADER_SIZE:], Codec(codec))
+    except (ValueError, RuntimeError):
+        raise
+    except Exception as e:
+        # Decompressors raise their own error types for corrupt or truncated payloads
+        raise ValueError(f"Corrupt workflow document: {e}") from e
+
+
+def to_json_bytes(data: bytes) -> bytes:
+    """Canonical JSON bytes for a stored document, without a round trip for legacy JSON"""
+    if not is_encoded(data):
+        return data
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Truncated workflow document header")
+    if data[len(MAGIC)] == FORMAT_VERSION and data[len(MAGIC) + 1] == Codec.JSON:
+        return data[HEADER_SIZE:]
+    return orjson.dumps(decode_document(data), option=orjson.OPT_SORT_KEYS)
+
+
+__all__ = [
+    "Codec",
+    "available_codecs",
+    "default_codec",
+    "encode_document",
+    "decode_document",
+    "is_encoded",
+    "to_json_bytes",
+]
@@ -0,0 +1,243 @@
+"""Per-workflow version history built from periodic snapshots and deltas.
+
+Usage:
+
+    from app.libs.workflow_history import record_version, list_versions, get_version
+
+    record_version(user_id, previous_doc, new_doc)  # after every save
+    versions = list_versions(user_id, workflow_id)
+    doc = get_version(user_id, workflow_id, 12)
+
+Every SNAPSHOT_INTERVAL versions a full document is stored; the versions in
+between only store a delta against the version before them. Rebuilding a
+version therefore touches at most SNAPSHOT_INTERVAL entries. Only the newest
+MAX_VERSIONS versions are kept; when older ones are dropped, the oldest
+retained version is rewritten as a snapshot so the chain stays complete.
+"""
+
+from typing import Any, Dict, List, Optional
+
+from app.libs.storage import storage
+from app.libs.storage_utils import sanitize_key
+
+from app.libs.workflow_codec import decode_document, encode_document
+
+SNAPSHOT_INTERVAL = 20
+MAX_VERSIONS = 200
+
+# Lists of objects that are diffed element-wise by their "id"; a list whose ids
+# aren't unique is stored whole instead
+KEYED_COLLECTIONS = ("nodes", "edges")
+
+
+def _manifest_key(user_id: str, workflow_id: str) -> str:
+    return f"workflow_history_{sanitize_key(user_id)}_{sanitize_key(workflow_id)}"
+
+
+def _entry_key(user_id: str, workflow_id: str, version: int) -> str:
+    return f"{_manifest_key(user_id, workflow_id)}_{version}"
+
+
+# Delta encoding
+
+def compute_delta(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Compute the changes needed to turn `old` into `new`"""
+    delta: Dict[str, Any] = {}
+
+    fields = {k: v for k, v in new.items() if k not in KEYED_COLLECTIONS and old.get(k) != v}
+    removed_fields = [k for k in old if k not in KEYED_COLLECTIONS and k not in new]
+    if fields:
+        delta["fields"] = fields
+    if removed_fields:
+        delta["removed_fields"] = removed_fields
+
+    for name in KEYED_COLLECTIONS:
+        if not (_has_unique_ids(old.get(name, [])) and _has_unique_ids(new.get(name, []))):
+            if old.get(name, []) != new.get(name, []):
+                delta[name] = {"replace": new.get(name, [])}
+            continue
+
+        old_items = {item["id"]: item for item in old.get(name, [])}
+        new_items = new.get(name, [])
+        new_ids = [item["id"] for item in new_items]
+        new_id_set = set(new_ids)
+
+        upsert = [item for item in new_items if old_items.get(item["id"]) != item]
+        remove = [item_id for item_id in old_items if item_id not in new_id_set]
+        change: Dict[str, Any] = {}
+        if upsert:
+            change["upsert"] = upsert
+        if remove:
+            change["remove"] = remove
+        # Only record the ordering when applying the delta wouldn't reproduce it
+        if _apply_collection(old.get(name, []), change) != new_items:
+            change["order"] = new_ids
+        if change:
+            delta[name] = change
+
+    return delta
+
+
+def _has_unique_ids(items: List[Dict[str, Any]]) -> bool:
+    ids = [item.get("id") for item in items]
+    return None not in ids and len(set(ids)) == len(ids)
+
+
+def _apply_collection(items: List[Dict[str, Any]], change: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if "replace" in change:
+        return change["replace"]
+    removed = set(change.get("remove", []))
+    upserts = {item["id"]: item for item in change.get("upsert", [])}
+
+    result = []
+    for item in items:
+        if item["id"] in removed:
+            continue
+        result.append(upserts.pop(item["id"], item))
+    result.extend(upserts.values())
+
+    if "order" in change:
+        by_id = {item["id"]: item for item in result}
+        result = [by_id[item_id] for item_id in change["order"]]
+    return result
+
+
+def apply_delta(doc: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply a delta produced by compute_delta"""
+    result = {k: v for k, v in doc.items() if k not in delta.get("removed_fields", [])}
+    result.update(delta.get("fields", {}))
+    for name in KEYED_COLLECTIONS:
+        if name in delta:
+            result[name] = _apply_collection(doc.get(name, []), delta[name])
+    return result
+
+
+def diff_documents(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Summarize the differences between two documents for display.
+
+    Nodes and edges are listed by id as added, removed or changed; a list whose
+    ids aren't unique is only reported as replaced (or not) as a whole.
+    """
+    keys = (set(old) | set(new)) - set(KEYED_COLLECTIONS)
+    fields = {
+        k: {"from": old.get(k), "to": new.get(k)}
+        for k in sorted(keys)
+        if old.get(k) != new.get(k)
+    }
+
+    result: Dict[str, Any] = {"fields": fields}
+    for name in KEYED_COLLECTIONS:
+        # As in compute_delta, a list whose ids aren't unique is compared whole
+        if not (_has_unique_ids(old.get(name, [])) and _has_unique_ids(new.get(name, []))):
+            result[name] = {
+                "added": [],
+                "removed": [],
+                "changed": [],
+                "replaced": old.get(name, []) != new.get(name, []),
+            }
+            continue
+        old_items = {item["id"]: item for item in old.get(name, [])}
+        new_items = {item["id"]: item for item in new.get(name, [])}
+        result[name] = {
+            "added": [i for i in new_items if i not in old_items],
+            "removed": [i for i in old_items if i not in new_items],
+            "changed": [i for i in new_items if i in old_items and old_items[i] != new_items[i]],
+            "replaced": False,
+        }
+    return result
+
+
+# Storage
+
+def _get_manifest(user_id: str, workflow_id: str) -> List[Dict[str, Any]]:
+    return storage.json.get(_manifest_key(user_id, workflow_id), default={}).get("versions", [])
+
+
+def _save_manifest(user_id: str, workflow_id: str, versions: List[Dict[str, Any]]) -> None:
+    storage.json.put(_manifest_key(user_id, workflow_id), {"versions": versions})
+
+
+def _put_entry(user_id: str, workflow_id: str, version: int, payload: Dict[str, Any]) -> int:
+    data = encode_document(payload)
+    storage.binary.put(_entry_key(user_id, workflow_id, version), data)
+    return len(data)
+
+
+def _get_entry(user_id: str, workflow_id: str, version: int) -> Dict[str, Any]:
+    return decode_document(storage.binary.get(_entry_key(user_id, workflow_id, version)))
+
+
+def _rebuild(user_id: str, workflow_id: str, versions: List[Dict[str, Any]], version: int) -> Dict[str, Any]:
+    position = next(i for i, entry in enumerate(versions) if entry["version"] == version)
+    start = position
+    while versions[start]["kind"] != "snapshot":
+        start -= 1
+
+    doc = _get_entry(user_id, workflow_id, versions[start]["version"])
+    for entry in versions[start + 1 : position + 1]:
+        doc = apply_delta(doc, _get_entry(user_id, workflow_id, entry["version"]))
+    return doc
+
+
+def _compact(user_id: str, workflow_id: str, versions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop versions beyond the retention limit, re-basing the oldest kept one"""
+    if len(versions) <= MAX_VERSIONS:
+        return versions
+
+    dropped, kept = versions[:-MAX_VERSIONS], versions[-MAX_VERSIONS:]
+    if kept[0]["kind"] != "snapshot":
+        doc = _rebuild(user_id, workflow_id, versions, kept[0]["version"])
+        kept[0] = {**kept[0], "kind": "snapshot", "size": _put_entry(user_id, workflow_id, kept[0]["version"], doc)}
+
+    for entry in dropped:
+        storage.binary.delete(_entry_key(user_id, workflow_id, entry["version"]))
+    return kept
+
+
+def record_version(user_id: str, previous: Optional[Dict[str, Any]], current: Dict[str, Any]) -> None:
+    """Append the current state of a workflow to its history"""
+    workflow_id = current["id"]
+    version = current["version"]
+    versions = _get_manifest(user_id, workflow_id)
+
+    # A delta is only valid against the version directly before it
+    chained = (
+        previous is not None
+        and bool(versions)
+        and versions[-1]["version"] == previous.get("version")
+        and version == previous.get("version", 0) + 1
+    )
+    since_snapshot = 0
+    for entry in reversed(versions):
+        if entry["kind"] == "snapshot":
+            break
+        since_snapshot += 1
+
+    if chained and since_snapshot + 1 < SNAPSHOT_INTERVAL:
+        kind, payload = "delta", compute_delta(previous, current)
+    else:
+        kind, payload = "snapshot", current
+
+    size = _put_entry(user_id, workflow_id, version, payload)
+    versions.append({"version": version, "kind": kind, "savedAt": current.get("updatedAt"), "size": size})
+    _save_manifest(user_id, workflow_id, _compact(user_id, workflow_id, versions))
+
+
+def list_versions(user_id: str, workflow_id: str) -> List[Dict[str, Any]]:
+    """List retained versions, oldest first"""
+    return _get_manifest(user_id, workflow_id)
+
+
+def get_version(user_id: str, workflow_id: str, version: int) -> Optional[Dict[str, Any]]:
+    """Rebuild a specific version, or None if it isn't retained"""
+    versions = _get_manifest(user_id, workflow_id)
+    if not any(entry["version"] == version for entry in versions):
+        return None
+    return _rebuild(user_id, workflow_id, versions, version)
+
+
+def delete_history(user_id: str, workflow_id: str) -> None:
+    """Remove all stored versions of a workflow"""
+    for entry in _get_manifest(user_id, workflow_id):
+        storage.binary.delete(_entry_key(user_id, workflow_id, entry["version"]))
+    storage.json.delete(_manifest_key(user_id, workflow_id))
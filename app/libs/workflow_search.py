@@ -0,0 +1,262 @@
+"""In-memory inverted index for searching a user's workflows.
+
+Usage:
+
+    from app.libs.workflow_search import WorkflowSearchIndex
+
+    index = WorkflowSearchIndex.from_shards(storage.json.get(key, default={}) for key in shard_keys)
+    index.add(workflow_dict)       # on create/update
+    index.remove(workflow_id)      # on delete
+    found = index.search("gem summ", limit=20)   # {"results": [...], "truncated": bool}
+
+    shard = shard_of(workflow_id, len(shard_keys))   # the stored shard a workflow's entry lives in
+
+Only the forward index (workflow -> weighted terms) is persisted, split into
+shards by workflow id so a change rewrites one shard rather than every entry;
+postings and the sorted term list used for prefix lookups are rebuilt when
+loading. The index is safe to search from several threads while it's updated.
+
+Very broad prefixes only expand to a bounded number of terms and postings;
+when that leaves matches out, the search result says so with "truncated".
+"""
+
+import heapq
+import re
+import threading
+import zlib
+from bisect import bisect_left
+from operator import itemgetter
+from typing import Any, Collection, Dict, Iterable, List, Optional, Set, Tuple
+
+# Relative importance of each source of terms
+FIELD_WEIGHTS = {
+    "name": 5.0,
+    "label": 3.0,
+    "description": 2.0,
+    "node_type": 2.0,
+    "model": 2.0,
+    "url": 1.0,
+}
+
+# Prefix matches rank below exact term matches
+PREFIX_MATCH_FACTOR = 0.5
+
+# Upper bound on index terms a single prefix expands to
+MAX_PREFIX_EXPANSIONS = 200
+
+# Upper bound on postings merged for one prefix; beyond it, the longest prefix matches are dropped
+MAX_PREFIX_POSTINGS = 10000
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase alphanumeric tokens of a string"""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(str(text).lower())
+
+
+def extract_terms(workflow: Dict[str, Any]) -> Dict[str, float]:
+    """Weighted searchable terms of a workflow document"""
+    terms: Dict[str, float] = {}
+
+    def add(text: Optional[str], field: str) -> None:
+        for token in tokenize(text):
+            terms[token] = terms.get(token, 0.0) + FIELD_WEIGHTS[field]
+
+    add(workflow.get("name"), "name")
+    add(workflow.get("description"), "description")
+    for node in workflow.get("nodes", []):
+        data = node.get("data") or {}
+        add(node.get("type"), "node_type")
+        if data.get("type") != node.get("type"):
+            add(data.get("type"), "node_type")
+        add(data.get("label"), "label")
+        add(data.get("model"), "model")
+        add(data.get("url"), "url")
+    return terms
+
+
+def index_entry(workflow: Dict[str, Any]) -> Dict[str, Any]:
+    """Stored forward-index entry of a workflow document"""
+    return {
+        "name": workflow.get("name"),
+        "description": workflow.get("description"),
+        "terms": extract_terms(workflow),
+    }
+
+
+def shard_of(workflow_id: str, shards: int) -> int:
+    """Stable shard number of a workflow id"""
+    return zlib.crc32(workflow_id.encode("utf-8")) % shards
+
+
+class WorkflowSearchIndex:
+    """Inverted index over a set of workflows, maintained incrementally"""
+
+    def __init__(self):
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self._sorted_terms: Optional[List[str]] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_shards(cls, shards: Iterable[Dict[str, Any]]) -> "WorkflowSearchIndex":
+        index = cls()
+        for shard in shards:
+            for workflow_id, doc in shard.get("docs", {}).items():
+                index._insert(workflow_id, doc)
+        return index
+
+    def to_shards(self, shards: int) -> List[Dict[str, Any]]:
+        """The forward index split as stored, one {"docs": ...} per shard"""
+        split: List[Dict[str, Any]] = [{"docs": {}} for _ in range(shards)]
+        with self._lock:
+            for workflow_id, doc in self.docs.items():
+                split[shard_of(workflow_id, shards)]["docs"][workflow_id] = doc
+        return split
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _insert(self, workflow_id: str, doc: Dict[str, Any]) -> None:
+        self.docs[workflow_id] = doc
+        for term, weight in doc["terms"].items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                self._sorted_terms = None
+            self.postings[term][workflow_id] = weight
+
+    def add(self, workflow: Dict[str, Any]) -> None:
+        """Index a workflow, replacing any previous entry for it"""
+        self.set_entry(workflow["id"], index_entry(workflow))
+
+    def set_entry(self, workflow_id: str, doc: Dict[str, Any]) -> None:
+        """Index a stored entry (see `index_entry`), replacing any previous one"""
+        with self._lock:
+            self._remove(workflow_id)
+            self._insert(workflow_id, doc)
+
+    def remove(self, workflow_id: str) -> None:
+        """Drop a workflow from the index"""
+        with self._lock:
+            self._remove(workflow_id)
+
+    def _remove(self, workflow_id: str) -> None:
+        doc = self.docs.pop(workflow_id, None)
+        if doc is None:
+            return
+        for term in doc["terms"]:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(workflow_id, None)
+            if not posting:
+                del self.postings[term]
+                self._sorted_terms = None
+
+    def _expand(self, prefix: str) -> Tuple[List[str], bool]:
+        """Up to MAX_PREFIX_EXPANSIONS terms starting with a prefix, and whether more exist"""
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.postings)
+        terms = self._sorted_terms
+        start = bisect_left(terms, prefix)
+        end = start
+        limit = min(len(terms), start + MAX_PREFIX_EXPANSIONS)
+        while end < limit and terms[end].startswith(prefix):
+            end += 1
+        return terms[start:end], end < len(terms) and terms[end].startswith(prefix)
+
+    def _expansion(self, token: str) -> Tuple[List[str], bool]:
+        """Terms a query token matches, bounded by MAX_PREFIX_POSTINGS, and whether any were left out"""
+        terms, truncated = self._expand(token)
+        if sum(len(self.postings[term]) for term in terms) <= MAX_PREFIX_POSTINGS:
+            return terms, truncated
+        # A very broad prefix (say one letter): keep the matches closest to what was typed
+        terms.sort(key=lambda term: (len(term), len(self.postings[term])))
+        kept, total = [], 0
+        for term in terms:
+            if kept and total + len(self.postings[term]) > MAX_PREFIX_POSTINGS:
+                break
+            kept.append(term)
+            total += len(self.postings[term])
+        return kept, True
+
+    def _token_scores(self, token: str, terms: List[str], within: Optional[Collection[str]] = None) -> Dict[str, float]:
+        """Best score per workflow over a token's terms, limited to `within` if given"""
+        # Probing is slower per entry than merging, hence the factor
+        if within is not None and 4 * len(within) * len(terms) < sum(len(self.postings[term]) for term in terms):
+            # Few candidates left: look each one up instead of merging the postings
+            scores: Dict[str, float] = {}
+            for term in terms:
+                factor = 1.0 if term == token else PREFIX_MATCH_FACTOR
+                posting = self.postings[term]
+                for workflow_id in within:
+                    weight = posting.get(workflow_id)
+                    if weight is not None and weight * factor > scores.get(workflow_id, 0.0):
+                        scores[workflow_id] = weight * factor
+            return scores
+
+        if len(terms) == 1:
+            # Common case: avoid merging, the posting itself is only read here
+            posting = self.postings[terms[0]]
+            if terms[0] == token:
+                return posting
+            return {wid: weight * PREFIX_MATCH_FACTOR for wid, weight in posting.items()}
+
+        scores = {}
+        for term in terms:
+            factor = 1.0 if term == token else PREFIX_MATCH_FACTOR
+            for workflow_id, weight in self.postings[term].items():
+                score = weight * factor
+                if score > scores.get(workflow_id, 0.0):
+                    scores[workflow_id] = score
+        return scores
+
+    def search(self, query: str, limit: int = 20) -> Dict[str, Any]:
+        """Find workflows matching every query token (as a term prefix), best first.
+        
+        Returns {"results": [...], "truncated": bool}; truncated means a broad prefix
+        left some matching terms out, so there may be matches that aren't listed.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return {"results": [], "truncated": False}
+        with self._lock:
+            results, truncated = self._search(set(tokens), limit)
+        return {"results": results, "truncated": truncated}
+
+    def _search(self, tokens: Set[str], limit: int) -> Tuple[List[Dict[str, Any]], bool]:
+        expansions = []
+        truncated = False
+        for token in tokens:
+            terms, token_truncated = self._expansion(token)
+            expansions.append((token, terms))
+            truncated = truncated or token_truncated
+        # Intersect starting from the most selective token; the rest only score its matches
+        expansions.sort(key=lambda item: sum(len(self.postings[term]) for term in item[1]))
+        scores: Optional[Dict[str, float]] = None
+        for token, terms in expansions:
+            if not terms:
+                return [], False
+            if scores is None:
+                scores = self._token_scores(token, terms)
+            else:
+                token_scores = self._token_scores(token, terms, within=scores.keys())
+                scores = {wid: score + token_scores[wid] for wid, score in scores.items() if wid in token_scores}
+            if not scores:
+                return [], truncated
+
+        top = heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+        ranked = sorted(top, key=lambda item: (-item[1], self.docs[item[0]]["name"] or ""))
+        results = [
+            {
+                "id": workflow_id,
+                "name": self.docs[workflow_id]["name"],
+                "description": self.docs[workflow_id]["description"],
+                "score": round(score, 3),
+            }
+            for workflow_id, score in ranked
+        ]
+        return results, truncated
@@ -0,0 +1,29 @@
+import os
+import pathlib
+import sys
+import tempfile
+
+import pytest
+
+# Tests import the app the same way the tools do, from the repository root
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# Run against the local filesystem backend (see app.libs.storage) instead of the hosted service
+os.environ.setdefault("STORAGE_BACKEND", "filesystem")
+os.environ.setdefault("STORAGE_PATH", tempfile.mkdtemp(prefix="app-tests-"))
+
+
+@pytest.fixture
+def api_client():
+    """TestClient factory for one API module, signed in as the given user"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from databutton_app.mw.auth_mw import User, get_authorized_user
+
+    def client_for(router, user_id: str = "user-1") -> TestClient:
+        app = FastAPI()
+        app.include_router(router, prefix="/routes")
+        app.dependency_overrides[get_authorized_user] = lambda: User(sub=user_id)
+        return TestClient(app)
+
+    return client_for
@@ -0,0 +1,56 @@
+from app.libs.chat_cache import ChatResponseCache
+
+CONFIG = {"providers": "fake", "temperature": 0.2, "max_output_tokens": 100}
+
+
+def ask(text):
+    return [{"role": "user", "content": text}]
+
+
+def test_exact_and_normalized_hits():
+    cache = ChatResponseCache()
+    cache.put(ask("What is the capital of France?"), CONFIG, "Paris", scope="alice")
+
+    assert cache.get(ask("what is  the capital of france?"), CONFIG, scope="alice") == "Paris"
+    assert cache.get(ask("What is the capital of France?"), {**CONFIG, "max_output_tokens": 50}, scope="alice") is None
+
+
+def test_near_duplicate_hit():
+    cache = ChatResponseCache()
+    cache.put(ask("Summarize the quarterly sales report for the northern region please"), CONFIG, "summary", scope="alice")
+
+    assert cache.get(ask("Summarize the quarterly sales report for the northern region"), CONFIG, scope="alice") == "summary"
+
+
+def test_replies_are_not_shared_between_scopes():
+    cache = ChatResponseCache()
+    prompt = "Summarize the quarterly sales report for the northern region please"
+    cache.put(ask(prompt), CONFIG, "alice's summary", scope="alice")
+
+    assert cache.get(ask(prompt), CONFIG, scope="bob") is None
+    assert cache.get(ask("Summarize the quarterly sales report for the northern region"), CONFIG, scope="bob") is None
+
+
+def test_high_temperature_bypasses_the_cache():
+    cache = ChatResponseCache(max_temperature=0.8)
+    config = {**CONFIG, "temperature": 1.0}
+    cache.put(ask("hello"), config, "hi", scope="alice")
+
+    assert cache.get(ask("hello"), config, scope="alice") is None
+    assert cache.stats("alice")["bypassed"] == 1
+    assert cache.stats("alice")["size"] == 0
+
+
+def test_stats_per_scope():
+    cache = ChatResponseCache(max_entries=2)
+    cache.put(ask("one"), CONFIG, "1", scope="alice")
+    cache.get(ask("one"), CONFIG, scope="alice")
+    cache.get(ask("two"), CONFIG, scope="bob")
+    cache.put(ask("two"), CONFIG, "2", scope="bob")
+    cache.put(ask("three"), CONFIG, "3", scope="bob")  # evicts alice's entry
+
+    alice, bob = cache.stats("alice"), cache.stats("bob")
+    assert (alice["hits"], alice["misses"], alice["evictions"], alice["size"]) == (1, 0, 1, 0)
+    assert (bob["hits"], bob["misses"], bob["size"]) == (0, 1, 2)
+    assert cache.stats()["size"] == 2
+    assert cache.stats("carol")["hit_rate"] == 0.0
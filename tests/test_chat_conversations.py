@@ -0,0 +1,95 @@
+import uuid
+
+import pytest
+from starlette.requests import Request
+
+from app.apis import ai_chat
+from app.libs import conversations as convo
+from app.libs.chat_providers import FakeChatProvider
+from app.libs.chat_router import ChatRouter
+
+
+@pytest.fixture
+def user_id():
+    return f"user-{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture
+def client(api_client, user_id):
+    return api_client(ai_chat.router, user_id)
+
+
+def use_provider(monkeypatch, provider):
+    async def get_provider(user_id):
+        return ChatRouter({"fake": provider})
+
+    monkeypatch.setattr(ai_chat, "get_provider", get_provider)
+
+
+def new_conversation(client):
+    return client.post("/routes/chat/conversations", json={}).json()["id"]
+
+
+def stored_messages(user_id, conversation_id):
+    return [(m["role"], m["content"]) for m in convo.load_conversation(user_id, conversation_id)["messages"]]
+
+
+def test_reply_is_stored_with_the_message(monkeypatch, client, user_id):
+    use_provider(monkeypatch, FakeChatProvider(token_delay=0, reply="hi there"))
+    conversation_id = new_conversation(client)
+
+    response = client.post(f"/routes/chat/conversations/{conversation_id}/messages", json={"content": "hello"})
+
+    assert response.status_code == 200
+    assert response.json()["response"] == "hi there"
+    assert stored_messages(user_id, conversation_id) == [("user", "hello"), ("model", "hi there")]
+
+
+@pytest.mark.parametrize("status", [503, 429])
+def test_failed_reply_stores_nothing(monkeypatch, client, user_id, status):
+    use_provider(monkeypatch, FakeChatProvider(token_delay=0, failure_rate=1.0, failure_status=status))
+    conversation_id = new_conversation(client)
+
+    response = client.post(f"/routes/chat/conversations/{conversation_id}/messages", json={"content": "hello"})
+
+    assert response.status_code == status
+    assert stored_messages(user_id, conversation_id) == []
+
+    # The next message is sent on its own, not after an unanswered one
+    use_provider(monkeypatch, FakeChatProvider(token_delay=0, reply="ok"))
+    client.post(f"/routes/chat/conversations/{conversation_id}/messages", json={"content": "again"})
+    assert stored_messages(user_id, conversation_id) == [("user", "again"), ("model", "ok")]
+
+
+def test_failed_stream_stores_nothing(monkeypatch, client, user_id):
+    use_provider(monkeypatch, FakeChatProvider(token_delay=0, reply="one two three", fail_after=1))
+    conversation_id = new_conversation(client)
+
+    response = client.post(f"/routes/chat/conversations/{conversation_id}/messages/stream", json={"content": "hello"})
+
+    assert "event: error" in response.text
+    assert stored_messages(user_id, conversation_id) == []
+
+
+def test_disconnected_stream_stores_nothing(monkeypatch, client, user_id):
+    use_provider(monkeypatch, FakeChatProvider(token_delay=0, reply="one two three"))
+    conversation_id = new_conversation(client)
+
+    async def is_disconnected(self):
+        return True
+
+    monkeypatch.setattr(Request, "is_disconnected", is_disconnected)
+    response = client.post(f"/routes/chat/conversations/{conversation_id}/messages/stream", json={"content": "hello"})
+
+    assert "event: done" not in response.text
+    assert stored_messages(user_id, conversation_id) == []
+
+
+def test_completed_stream_stores_the_message_and_reply(monkeypatch, client, user_id):
+    use_provider(monkeypatch, FakeChatProvider(token_delay=0, reply="one two"))
+    conversation_id = new_conversation(client)
+
+    response = client.post(f"/routes/chat/conversations/{conversation_id}/messages/stream", json={"content": "hello"})
+
+    assert response.text.rstrip().endswith("event: done\ndata: {}")
+    assert stored_messages(user_id, conversation_id) == [("user", "hello"), ("model", "one two")]
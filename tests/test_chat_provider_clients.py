@@ -0,0 +1,78 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app.apis import ai_chat, api_connections
+from app.libs import connections as conn_store
+from app.libs.connection_health import health_monitor
+
+
+@pytest.fixture
+def user_id():
+    return f"user-{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture
+def connections_client(api_client, user_id):
+    return api_client(api_connections.router, user_id)
+
+
+@pytest.fixture
+def storage_reads(monkeypatch):
+    """Count reads of a user's connections from storage"""
+    reads = []
+    load_connections = conn_store.load_connections
+
+    def counting(owner):
+        reads.append(owner)
+        return load_connections(owner)
+
+    monkeypatch.setattr(conn_store, "load_connections", counting)
+    return reads
+
+
+def create_connection(client, name="main"):
+    response = client.post("/routes/connections", json={"name": name, "service": "openai", "api_key": "sk-test"})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def client_ids(user_id):
+    return sorted(client.connection_id for client in asyncio.run(ai_chat.load_provider_clients(user_id)).clients)
+
+
+def test_resolved_clients_are_cached_per_user(connections_client, user_id, storage_reads):
+    connection_id = create_connection(connections_client)
+    storage_reads.clear()
+
+    assert connection_id in client_ids(user_id)
+    assert connection_id in client_ids(user_id)
+    assert storage_reads == [user_id]
+
+
+def test_connection_changes_invalidate_the_cache(connections_client, user_id, storage_reads):
+    first = create_connection(connections_client, "first")
+    assert first in client_ids(user_id)
+
+    second = create_connection(connections_client, "second")
+    assert {first, second} <= set(client_ids(user_id))
+
+    assert connections_client.delete(f"/routes/connections/{first}").status_code == 200
+    remaining = client_ids(user_id)
+    assert first not in remaining and second in remaining
+    assert storage_reads.count(user_id) >= 3
+
+
+def test_only_the_connection_used_is_watched(connections_client, user_id):
+    first = create_connection(connections_client, "first")
+    second = create_connection(connections_client, "second")
+    for connection_id in (first, second):
+        health_monitor.forget(connection_id)
+
+    router = asyncio.run(ai_chat.get_provider(user_id))
+    assert health_monitor.owner(first) is None and health_monitor.owner(second) is None
+
+    router.on_outcome(second, None)
+    assert health_monitor.owner(first) is None
+    assert health_monitor.owner(second) == user_id
@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import pytest
+
+from app.libs import chat_router
+from app.libs.chat_providers import ChatProviderError, FakeChatProvider
+from app.libs.chat_router import ChatRouter, provider_stats
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    # Provider stats are process-wide; each test starts from none
+    monkeypatch.setattr(chat_router, "_stats", {})
+
+
+def generate(router):
+    return asyncio.run(router.generate(MESSAGES, temperature=0.2, max_output_tokens=50))
+
+
+def test_falls_back_to_the_next_provider_on_server_errors():
+    outcomes = []
+    router = ChatRouter(
+        {
+            "down": FakeChatProvider(token_delay=0, failure_rate=1.0, failure_status=503),
+            "up": FakeChatProvider(token_delay=0, reply="from up"),
+        },
+        on_outcome=lambda provider_id, error: outcomes.append((provider_id, error is None)),
+    )
+
+    assert generate(router) == "from up"
+    assert outcomes == [("down", False), ("up", True)]
+    assert provider_stats("down").failures == 1
+    # The failed provider now ranks below the one that answered
+    assert router.ranked() == ["up", "down"]
+
+
+def test_invalid_requests_are_not_retried_elsewhere():
+    second = FakeChatProvider(token_delay=0, reply="unused")
+    router = ChatRouter({
+        "first": FakeChatProvider(token_delay=0, failure_rate=1.0, failure_status=400),
+        "second": second,
+    })
+
+    with pytest.raises(ChatProviderError) as raised:
+        generate(router)
+    assert raised.value.status_code == 400
+    assert provider_stats("second").requests == 0
+
+
+def test_raises_the_last_error_when_every_provider_fails():
+    router = ChatRouter({
+        "a": FakeChatProvider(token_delay=0, failure_rate=1.0, failure_status=503),
+        "b": FakeChatProvider(token_delay=0, failure_rate=1.0, failure_status=500),
+    })
+
+    with pytest.raises(ChatProviderError) as raised:
+        generate(router)
+    assert raised.value.status_code == 500
+
+
+def test_rate_limited_provider_sits_out():
+    router = ChatRouter({
+        "limited": FakeChatProvider(token_delay=0, failure_rate=1.0, failure_status=429),
+        "spare": FakeChatProvider(token_delay=0, reply="spare"),
+    })
+
+    assert generate(router) == "spare"
+    assert router.ranked()[-1] == "limited"
+    assert provider_stats("limited").to_dict()["cooling_down"] is True
+
+
+def test_hedges_a_slow_provider_and_keeps_the_first_answer(monkeypatch):
+    monkeypatch.setattr(chat_router, "DEFAULT_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(chat_router, "MIN_HEDGE_DELAY", 0.01)
+    router = ChatRouter(
+        {
+            "slow": FakeChatProvider(token_delay=0, latency=1.0, reply="slow"),
+            "fast": FakeChatProvider(token_delay=0, reply="fast"),
+        },
+        hedge=True,
+    )
+
+    started = time.monotonic()
+    assert generate(router) == "fast"
+    assert time.monotonic() - started < 0.5
+    # The losing request was cancelled: counted, but not as a failure
+    slow = provider_stats("slow")
+    assert slow.requests == 1
+    assert slow.failures == 0
+
+
+def test_does_not_hedge_when_disabled(monkeypatch):
+    monkeypatch.setattr(chat_router, "DEFAULT_HEDGE_DELAY", 0.01)
+    monkeypatch.setattr(chat_router, "MIN_HEDGE_DELAY", 0.01)
+    router = ChatRouter({
+        "slow": FakeChatProvider(token_delay=0, latency=0.1, reply="slow"),
+        "fast": FakeChatProvider(token_delay=0, reply="fast"),
+    })
+
+    assert generate(router) == "slow"
+    assert provider_stats("fast").requests == 0
+
+
+def test_stream_falls_back_before_the_first_chunk():
+    router = ChatRouter({
+        "down": FakeChatProvider(token_delay=0, failure_rate=1.0, failure_status=503),
+        "up": FakeChatProvider(token_delay=0, reply="one two"),
+    })
+
+    async def collect():
+        return [chunk async for chunk in router.stream(MESSAGES, 0.2, 50)]
+
+    assert "".join(asyncio.run(collect())) == "one two"
+
+
+def test_stream_does_not_fall_back_after_output_started():
+    router = ChatRouter({
+        "flaky": FakeChatProvider(token_delay=0, reply="one two three", fail_after=1),
+        "spare": FakeChatProvider(token_delay=0, reply="spare"),
+    })
+
+    async def collect():
+        chunks = []
+        with pytest.raises(ChatProviderError):
+            async for chunk in router.stream(MESSAGES, 0.2, 50):
+                chunks.append(chunk)
+        return chunks
+
+    assert len(asyncio.run(collect())) == 1
+    assert provider_stats("spare").requests == 0
+
+
+def test_identity_covers_every_provider():
+    router = ChatRouter({"a": FakeChatProvider(), "b": FakeChatProvider()})
+
+    assert router.identity() == FakeChatProvider().identity()
@@ -0,0 +1,82 @@
+import json
+import uuid
+
+import pytest
+
+from app.apis import ai_chat
+from app.apis.ai_chat import sse_event
+from app.libs.chat_providers import FakeChatProvider
+from app.libs.chat_router import ChatRouter
+
+REQUEST = {"messages": [{"role": "user", "content": "hello"}], "temperature": 0.2}
+
+
+@pytest.fixture
+def client(api_client):
+    return api_client(ai_chat.router, f"user-{uuid.uuid4().hex[:8]}")
+
+
+def use_provider(monkeypatch, provider):
+    async def get_provider(user_id):
+        return ChatRouter({"fake": provider})
+
+    monkeypatch.setattr(ai_chat, "get_provider", get_provider)
+
+
+def events(body):
+    """(event, data) pairs of an SSE body; event is None for plain data frames"""
+    parsed = []
+    for frame in body.strip().split("\n\n"):
+        event, data = None, None
+        for line in frame.split("\n"):
+            field, _, value = line.partition(": ")
+            if field == "event":
+                event = value
+            elif field == "data":
+                data = json.loads(value)
+        parsed.append((event, data))
+    return parsed
+
+
+def test_sse_event_format():
+    assert sse_event({"text": "hi"}) == 'data: {"text": "hi"}\n\n'
+    assert sse_event({}, event="done") == "event: done\ndata: {}\n\n"
+
+
+def test_streams_chunks_then_done(monkeypatch, client):
+    use_provider(monkeypatch, FakeChatProvider(token_delay=0, reply="one two three"))
+
+    response = client.post("/routes/chat/stream", json=REQUEST)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+    received = events(response.text)
+    assert [event for event, _ in received] == [None] * (len(received) - 1) + ["done"]
+    assert "".join(data["text"] for _, data in received[:-1]) == "one two three"
+
+
+def test_provider_error_mid_stream_ends_with_an_error_event(monkeypatch, client):
+    use_provider(monkeypatch, FakeChatProvider(token_delay=0, reply="one two three", fail_after=1))
+
+    received = events(client.post("/routes/chat/stream", json=REQUEST).text)
+
+    assert received == [(None, {"text": "one"}), ("error", {"status": 500, "error": "Fake provider failure"})]
+
+
+def test_provider_error_before_output_sends_only_the_error(monkeypatch, client):
+    use_provider(monkeypatch, FakeChatProvider(token_delay=0, failure_rate=1.0, failure_status=503))
+
+    received = events(client.post("/routes/chat/stream", json=REQUEST).text)
+
+    assert received == [("error", {"status": 503, "error": "Injected fake provider failure"})]
+
+
+def test_repeated_prompt_is_streamed_from_the_cache(monkeypatch, client):
+    use_provider(monkeypatch, FakeChatProvider(token_delay=0, reply="cached reply"))
+    client.post("/routes/chat/stream", json=REQUEST)
+
+    response = client.post("/routes/chat/stream", json=REQUEST)
+
+    assert response.headers["x-cache"] == "HIT"
+    assert events(response.text) == [(None, {"text": "cached reply"}), ("done", {})]
@@ -0,0 +1,127 @@
+import asyncio
+
+from app.libs.connection_health import (
+    BASE_COOLDOWN,
+    CLOSED,
+    FAILURE_THRESHOLD,
+    HALF_OPEN,
+    MAX_COOLDOWN,
+    OPEN,
+    TRIAL_TIMEOUT,
+    CircuitBreaker,
+    HealthMonitor,
+)
+
+
+def opened_breaker(now=0.0):
+    breaker = CircuitBreaker()
+    for _ in range(FAILURE_THRESHOLD):
+        breaker.record_failure("boom", now)
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker()
+    for _ in range(FAILURE_THRESHOLD - 1):
+        breaker.record_failure("boom", 0.0)
+    assert breaker.state == CLOSED
+    assert breaker.allow_request(0.0)
+
+    breaker.record_failure("boom", 0.0)
+    assert breaker.state == OPEN
+    assert breaker.last_error == "boom"
+    assert not breaker.allow_request(BASE_COOLDOWN - 1)
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker()
+    for _ in range(FAILURE_THRESHOLD - 1):
+        breaker.record_failure("boom", 0.0)
+    breaker.record_success()
+    breaker.record_failure("boom", 0.0)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_a_single_trial():
+    breaker = opened_breaker()
+
+    assert breaker.is_available(BASE_COOLDOWN)
+    assert breaker.state == OPEN  # checking doesn't claim the trial
+    assert breaker.allow_request(BASE_COOLDOWN)
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request(BASE_COOLDOWN + 1)
+    # A trial that never reported back is given up on
+    assert breaker.allow_request(BASE_COOLDOWN + TRIAL_TIMEOUT)
+
+
+def test_successful_trial_closes_the_breaker():
+    breaker = opened_breaker()
+    breaker.allow_request(BASE_COOLDOWN)
+    breaker.record_success()
+
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+    assert breaker.cooldown == BASE_COOLDOWN
+    assert breaker.last_error is None
+
+
+def test_failed_trial_reopens_with_a_longer_cooldown():
+    breaker = opened_breaker()
+    now = float(BASE_COOLDOWN)
+    cooldown = BASE_COOLDOWN
+    while cooldown < MAX_COOLDOWN:
+        assert breaker.allow_request(now)
+        breaker.record_failure("still down", now)
+        cooldown = min(cooldown * 2, MAX_COOLDOWN)
+        assert breaker.state == OPEN
+        assert breaker.open_until == now + cooldown
+        assert not breaker.is_available(now + cooldown - 1)
+        now += cooldown
+
+    assert breaker.allow_request(now)
+    breaker.record_failure("still down", now)
+    assert breaker.cooldown == MAX_COOLDOWN
+
+
+def monitor_with(*connection_ids):
+    monitor = HealthMonitor()
+    for connection_id in connection_ids:
+        monitor.watch(connection_id, "gemini", "connected")
+        monitor._schedules[connection_id].next_probe = 0.0
+        for _ in range(FAILURE_THRESHOLD):
+            monitor.breaker(connection_id).record_failure("boom", 0.0)
+        monitor.breaker(connection_id).open_until = 0.0
+    return monitor
+
+
+def test_round_survives_a_connection_forgotten_while_probing():
+    monitor = monitor_with("gone", "kept")
+    saved = {}
+
+    async def probe(connection_id, service):
+        if connection_id == "gone":
+            monitor.forget("gone")
+        return "failed", "still down"
+
+    async def save(changed):
+        saved.update(changed)
+
+    assert asyncio.run(monitor.run_round(probe, save)) == 2
+    assert set(saved) == {"kept"}
+    assert "gone" not in monitor.snapshot()
+
+
+def test_round_survives_a_connection_forgotten_while_saving():
+    monitor = monitor_with("gone", "kept")
+    saved = {}
+
+    async def probe(connection_id, service):
+        return "failed", "still down"
+
+    async def save(changed):
+        saved.update(changed)
+        monitor.forget("gone")
+
+    asyncio.run(monitor.run_round(probe, save))
+    assert set(saved) == {"gone", "kept"}
+    assert monitor._schedules["kept"].status == "failed"
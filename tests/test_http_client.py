@@ -0,0 +1,51 @@
+import asyncio
+import threading
+
+from app.libs import http_client
+
+
+async def get_client():
+    return http_client.get_http_client()
+
+
+def client_in_new_loop():
+    return asyncio.run(get_client())
+
+
+def test_client_is_shared_within_a_loop():
+    async def run():
+        return http_client.get_http_client() is http_client.get_http_client()
+
+    assert asyncio.run(run())
+
+
+def test_client_from_a_running_loop_is_closed_on_that_loop():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        old = asyncio.run_coroutine_threadsafe(get_client(), loop).result()
+
+        async def replace_and_wait():
+            new = http_client.get_http_client()
+            for _ in range(100):
+                if old.is_closed:
+                    break
+                await asyncio.sleep(0.01)
+            return new
+
+        new = asyncio.run(replace_and_wait())
+        assert new is not old
+        assert old.is_closed
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def test_client_from_a_stopped_loop_is_replaced_and_reported(capsys):
+    old = client_in_new_loop()
+    new = client_in_new_loop()
+
+    assert new is not old
+    assert "without closing its connections" in capsys.readouterr().out
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from app.libs.rate_limit import BATCH, INTERACTIVE, Limit, RateLimiter, RateLimitExceeded
+
+
+def limiter_with(limit, **kwargs):
+    return RateLimiter(lambda key: limit, **kwargs)
+
+
+def test_acquire_within_capacity_does_not_wait():
+    limiter = limiter_with(Limit(requests_per_minute=60, tokens_per_minute=6000))
+
+    async def run():
+        return [await limiter.acquire(["user:a"], tokens=100) for _ in range(3)]
+
+    assert asyncio.run(run()) == [0.0, 0.0, 0.0]
+
+
+def test_unlimited_keys_never_wait():
+    limiter = RateLimiter(lambda key: None)
+
+    async def run():
+        return [await limiter.acquire(["user:a"], tokens=10 ** 9) for _ in range(5)]
+
+    assert asyncio.run(run()) == [0.0] * 5
+    assert limiter.status("user:a") is None
+
+
+def test_interactive_waiters_go_before_batch():
+    # One request of capacity, refilled every 0.1s
+    limiter = limiter_with(Limit(requests_per_minute=600, burst_seconds=0.1))
+    granted = []
+
+    async def call(name, priority):
+        await limiter.acquire(["user:a"], tokens=1, priority=priority)
+        granted.append(name)
+
+    async def run():
+        await limiter.acquire(["user:a"], tokens=1)
+        batch = asyncio.create_task(call("batch", BATCH))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(call("interactive", INTERACTIVE))
+        await asyncio.gather(batch, interactive)
+
+    asyncio.run(run())
+    assert granted == ["interactive", "batch"]
+
+
+def test_waiters_on_other_keys_are_not_blocked():
+    limiter = limiter_with(Limit(requests_per_minute=6, burst_seconds=1.0), max_wait=0.2)
+
+    async def run():
+        await limiter.acquire(["user:a"], tokens=1)
+        queued = asyncio.create_task(limiter.acquire(["user:a"], tokens=1))
+        await asyncio.sleep(0)
+        waited = await limiter.acquire(["user:b"], tokens=1)
+        with pytest.raises(RateLimitExceeded):
+            await queued
+        return waited
+
+    assert asyncio.run(run()) == 0.0
+
+
+def test_times_out_with_a_retry_hint():
+    # A request every 10s, so the second call can't be served within max_wait
+    limiter = limiter_with(Limit(requests_per_minute=6, burst_seconds=1.0), max_wait=0.05)
+
+    async def run():
+        await limiter.acquire(["user:a"], tokens=1)
+        with pytest.raises(RateLimitExceeded) as raised:
+            await limiter.acquire(["user:a"], tokens=1)
+        return raised.value
+
+    error = asyncio.run(run())
+    assert 5.0 < error.retry_after <= 10.0
+    assert limiter.status("user:a")["queued"] == 0
+
+
+def test_rejects_callers_once_the_queue_is_full():
+    limiter = limiter_with(Limit(requests_per_minute=6, burst_seconds=1.0), max_queue=1, max_wait=0.2)
+
+    async def run():
+        await limiter.acquire(["user:a"], tokens=1)
+        queued = asyncio.create_task(limiter.acquire(["user:a"], tokens=1))
+        await asyncio.sleep(0)
+        with pytest.raises(RateLimitExceeded) as raised:
+            await limiter.acquire(["user:a"], tokens=1)
+        assert str(raised.value) == "Too many queued requests"
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+
+    asyncio.run(run())
@@ -0,0 +1,119 @@
+import pytest
+
+from app.env import StorageBackend
+from app.libs.storage import create_backend
+from app.libs.storage_utils import sanitize_key
+
+
+@pytest.fixture(params=[StorageBackend.SQLITE, StorageBackend.FILESYSTEM], ids=lambda backend: backend.value)
+def backend(request, tmp_path):
+    path = tmp_path / "storage.sqlite3" if request.param == StorageBackend.SQLITE else tmp_path / "storage"
+    return create_backend(request.param, str(path))
+
+
+@pytest.fixture
+def storage(backend):
+    return backend[0]
+
+
+@pytest.fixture
+def secrets(backend):
+    return backend[1]
+
+
+@pytest.mark.parametrize(
+    "content_type, value",
+    [
+        ("json", {"name": "Summarize ✓", "nodes": [1, 2.5, None, True], "nested": {"a": []}}),
+        ("text", "line one\nline two ✓"),
+        ("binary", bytes(range(256))),
+    ],
+)
+def test_round_trip(storage, content_type, value):
+    store = getattr(storage, content_type)
+    store.put("doc_1", value)
+    assert store.get("doc_1") == value
+
+    store.put("doc_1", value * 2 if content_type != "json" else {"replaced": True})
+    assert store.get("doc_1") == (value * 2 if content_type != "json" else {"replaced": True})
+
+
+def test_content_types_are_separate(storage):
+    storage.json.put("shared-name", {"a": 1})
+    storage.text.put("shared-name", "text")
+    assert storage.json.get("shared-name") == {"a": 1}
+    assert storage.text.get("shared-name") == "text"
+    with pytest.raises(FileNotFoundError):
+        storage.binary.get("shared-name")
+
+
+def test_missing_key(storage):
+    with pytest.raises(FileNotFoundError):
+        storage.json.get("missing")
+    assert storage.json.get("missing", default={}) == {}
+    assert storage.json.get("missing", default=lambda: {"built": True}) == {"built": True}
+    assert storage.text.get("missing", default="fallback") == "fallback"
+
+
+def test_delete(storage):
+    storage.json.put("doc_1", {"a": 1})
+    storage.json.delete("doc_1")
+    with pytest.raises(FileNotFoundError):
+        storage.json.get("doc_1")
+    # Deleting a key that doesn't exist is not an error
+    storage.json.delete("doc_1")
+
+
+def test_list(storage):
+    assert storage.binary.list() == []
+    storage.binary.put("b", b"12345")
+    storage.binary.put("a", b"1")
+    storage.text.put("other", "not binary")
+
+    entries = storage.binary.list()
+    assert [entry.name for entry in entries] == ["a", "b"]
+    assert [entry.size for entry in entries] == [1, 5]
+
+
+@pytest.mark.parametrize("key", ["../escape", "a/b", "with space", "", "ünïcode", "semi;colon", "trailing-newline\n"])
+def test_invalid_keys_are_rejected(storage, secrets, key):
+    with pytest.raises(ValueError):
+        storage.json.put(key, {})
+    with pytest.raises(ValueError):
+        storage.json.get(key, default={})
+    with pytest.raises(ValueError):
+        storage.json.delete(key)
+    with pytest.raises(ValueError):
+        secrets.put(key, "value")
+    with pytest.raises(ValueError):
+        secrets.get(key)
+
+
+@pytest.mark.parametrize("key", ["../escape", "a/b", "with space", "user@example.com", "ünïcode"])
+def test_sanitized_keys_are_accepted(storage, key):
+    safe = sanitize_key(f"workflow_{key}")
+    storage.json.put(safe, {"key": key})
+    assert storage.json.get(safe) == {"key": key}
+
+
+def test_secrets(secrets):
+    assert secrets.get_names() == []
+    secrets.put("API_KEY", "sk-test ✓")
+    secrets.put("RAW_KEY", b"\x00\x01")
+    assert secrets.get("API_KEY") == "sk-test ✓"
+    assert secrets.get_as_bytes("RAW_KEY") == b"\x00\x01"
+    assert secrets.get_names() == ["API_KEY", "RAW_KEY"]
+
+    secrets.put("API_KEY", "rotated")
+    assert secrets.get("API_KEY") == "rotated"
+
+    assert secrets.delete("API_KEY") is True
+    assert secrets.delete("API_KEY") is False
+    assert secrets.get_names() == ["RAW_KEY"]
+
+
+def test_missing_secret(secrets):
+    with pytest.raises(KeyError):
+        secrets.get("MISSING")
+    with pytest.raises(KeyError):
+        secrets.get_as_bytes("MISSING")
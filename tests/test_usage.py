@@ -0,0 +1,81 @@
+import asyncio
+import uuid
+from datetime import date, datetime, timezone
+
+import pytest
+
+from app.libs import usage
+from app.libs.usage import UsageMeter, get_usage
+
+
+def event(user_id, day, prompt_tokens=10, completion_tokens=5, provider="gemini", model="flash"):
+    timestamp = datetime.fromisoformat(day).replace(hour=12, tzinfo=timezone.utc).timestamp()
+    return (timestamp, user_id, "chat", provider, model, prompt_tokens, completion_tokens, 100.0, True, False)
+
+
+@pytest.fixture
+def user_id():
+    return f"user-{uuid.uuid4().hex[:8]}"
+
+
+def usage_between(meter, user_id, start, end):
+    return asyncio.run(get_usage(meter, user_id, date.fromisoformat(start), date.fromisoformat(end)))
+
+
+def test_rollups_from_every_process_are_summed(user_id):
+    first, second = UsageMeter(), UsageMeter()
+    first.record(event(user_id, "2026-03-01"))
+    second.record(event(user_id, "2026-03-01", prompt_tokens=20))
+    second.record(event(user_id, "2026-03-02"))
+    second.record(event("someone-else", "2026-03-01"))
+    first.flush()
+    second.flush()
+
+    days = usage_between(first, user_id, "2026-03-01", "2026-03-31")
+
+    assert [day["date"] for day in days] == ["2026-03-01", "2026-03-02"]
+    assert days[0]["requests"] == 2
+    assert days[0]["promptTokens"] == 30
+    assert days[0]["models"]["gemini/flash"]["requests"] == 2
+
+
+def test_days_outside_the_range_are_left_out(user_id):
+    meter = UsageMeter()
+    for day in ("2026-02-28", "2026-03-01", "2026-03-02"):
+        meter.record(event(user_id, day))
+    meter.flush()
+
+    assert [day["date"] for day in usage_between(meter, user_id, "2026-03-01", "2026-03-01")] == ["2026-03-01"]
+
+
+def test_unflushed_events_are_included(user_id):
+    meter = UsageMeter()
+    meter.record(event(user_id, "2026-03-01"))
+    meter.flush()
+    meter.record(event(user_id, "2026-03-01"))
+
+    assert usage_between(meter, user_id, "2026-03-01", "2026-03-01")[0]["requests"] == 2
+
+
+def test_failed_flush_keeps_the_events(monkeypatch, user_id):
+    meter = UsageMeter()
+    meter.record(event(user_id, "2026-03-01"))
+    meter.record(event(user_id, "2026-03-02"))
+
+    def fail(key, value):
+        raise OSError("storage unavailable")
+
+    monkeypatch.setattr(usage.storage.json, "put", fail)
+    with pytest.raises(OSError):
+        meter.flush()
+    assert len(meter.pending(user_id)) == 2
+    monkeypatch.undo()
+
+    assert meter.flush() == 2
+    assert meter.pending(user_id) == []
+    assert len(usage_between(meter, user_id, "2026-03-01", "2026-03-02")) == 2
+
+
+def test_shard_ids_cannot_contain_the_key_separator():
+    with pytest.raises(ValueError):
+        UsageMeter(shard="a_b")
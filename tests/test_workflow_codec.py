@@ -0,0 +1,103 @@
+import json
+
+import orjson
+import pytest
+
+from app.libs.workflow_codec import (
+    FORMAT_VERSION,
+    HEADER_SIZE,
+    MAGIC,
+    Codec,
+    available_codecs,
+    decode_document,
+    default_codec,
+    encode_document,
+    is_encoded,
+    to_json_bytes,
+)
+
+DOC = {
+    "id": "wf_1",
+    "name": "Summarize ✓",
+    "version": 3,
+    "nodes": [{"id": f"n{i}", "type": "llm", "data": {"label": "Model", "temperature": 0.5}} for i in range(20)],
+    "edges": [{"id": "n0-n1", "source": "n0", "target": "n1"}],
+    "tags": [],
+    "published": None,
+}
+
+
+@pytest.fixture(params=available_codecs(), ids=lambda codec: codec.name)
+def codec(request):
+    return request.param
+
+
+def test_round_trip(codec):
+    data = encode_document(DOC, codec)
+    assert decode_document(data) == DOC
+
+
+def test_header_records_format_version_and_codec(codec):
+    data = encode_document(DOC, codec)
+    assert is_encoded(data)
+    assert data[:len(MAGIC)] == b"DCWF"
+    assert data[len(MAGIC)] == FORMAT_VERSION
+    assert data[len(MAGIC) + 1] == codec
+
+
+def test_new_writes_use_the_best_available_codec():
+    assert encode_document(DOC)[len(MAGIC) + 1] == default_codec() == available_codecs()[-1]
+
+
+def test_to_json_bytes_is_canonical_json(codec):
+    raw = to_json_bytes(encode_document(DOC, codec))
+    assert json.loads(raw) == DOC
+    assert raw == orjson.dumps(DOC, option=orjson.OPT_SORT_KEYS)
+
+
+def test_legacy_json_is_passed_through():
+    legacy = json.dumps(DOC).encode("utf-8")
+    assert not is_encoded(legacy)
+    assert decode_document(legacy) == DOC
+    assert to_json_bytes(legacy) is legacy
+
+
+def test_unsupported_format_version_is_rejected():
+    data = bytearray(encode_document(DOC, Codec.JSON))
+    data[len(MAGIC)] = FORMAT_VERSION + 1
+    with pytest.raises(ValueError, match="version"):
+        decode_document(bytes(data))
+    with pytest.raises(ValueError, match="version"):
+        to_json_bytes(bytes(data))
+
+
+def test_unknown_codec_is_rejected():
+    data = bytearray(encode_document(DOC, Codec.JSON))
+    data[len(MAGIC) + 1] = 200
+    with pytest.raises(ValueError):
+        decode_document(bytes(data))
+
+
+@pytest.mark.parametrize("length", range(len(MAGIC), HEADER_SIZE))
+def test_truncated_header_is_rejected(length):
+    data = encode_document(DOC, Codec.JSON)[:length]
+    with pytest.raises(ValueError, match="header"):
+        decode_document(data)
+    with pytest.raises(ValueError, match="header"):
+        to_json_bytes(data)
+
+
+def test_truncated_payload_is_rejected(codec):
+    data = encode_document(DOC, codec)
+    for length in (HEADER_SIZE, HEADER_SIZE + 1, len(data) // 2, len(data) - 1):
+        with pytest.raises(ValueError):
+            decode_document(data[:length])
+
+
+def test_corrupt_payload_is_rejected(codec):
+    data = bytearray(encode_document(DOC, codec))
+    # Flip bytes near the start of the payload, where every codec notices
+    for i in range(HEADER_SIZE, HEADER_SIZE + 4):
+        data[i] ^= 0xFF
+    with pytest.raises(ValueError):
+        decode_document(bytes(data))
@@ -0,0 +1,112 @@
+import copy
+import random
+
+from app.libs.workflow_history import apply_delta, compute_delta, diff_documents
+
+
+def node(node_id, label="node", **data):
+    return {"id": node_id, "type": "llm", "data": {"label": label, **data}}
+
+
+def edge(source, target):
+    return {"id": f"{source}-{target}", "source": source, "target": target}
+
+
+BASE = {
+    "id": "wf_1",
+    "name": "Summarize",
+    "description": "Summarize a page",
+    "version": 1,
+    "nodes": [node("a", "Input"), node("b", "Model", model="gemini"), node("c", "Output")],
+    "edges": [edge("a", "b"), edge("b", "c")],
+}
+
+
+def round_trip(old, new):
+    delta = compute_delta(old, new)
+    assert apply_delta(copy.deepcopy(old), delta) == new
+    return delta
+
+
+def test_unchanged_document_has_an_empty_delta():
+    assert round_trip(BASE, copy.deepcopy(BASE)) == {}
+
+
+def test_field_changes_and_removals():
+    new = {**BASE, "name": "Summarize v2", "version": 2, "tags": ["demo"]}
+    del new["description"]
+
+    delta = round_trip(BASE, new)
+    assert delta["fields"] == {"name": "Summarize v2", "version": 2, "tags": ["demo"]}
+    assert delta["removed_fields"] == ["description"]
+
+
+def test_node_changes_only_store_what_changed():
+    new = copy.deepcopy(BASE)
+    new["nodes"][1] = node("b", "Model", model="gpt-4o")
+    new["nodes"] = [n for n in new["nodes"] if n["id"] != "c"] + [node("d", "Notify")]
+    new["edges"] = [edge("a", "b"), edge("b", "d")]
+
+    delta = round_trip(BASE, new)
+    assert [n["id"] for n in delta["nodes"]["upsert"]] == ["b", "d"]
+    assert delta["nodes"]["remove"] == ["c"]
+    assert "order" not in delta["nodes"]
+
+
+def test_reordering_is_recorded():
+    new = copy.deepcopy(BASE)
+    new["nodes"].reverse()
+
+    delta = round_trip(BASE, new)
+    assert delta["nodes"] == {"order": ["c", "b", "a"]}
+
+
+def test_lists_with_duplicate_ids_are_stored_whole():
+    old = {**BASE, "edges": [edge("a", "b"), edge("a", "b")]}
+    new = {**BASE, "edges": [edge("a", "b"), edge("b", "c"), edge("a", "b")]}
+
+    delta = round_trip(old, new)
+    assert delta["edges"] == {"replace": new["edges"]}
+    # ...and back to unique ids
+    assert round_trip(new, BASE)["edges"] == {"replace": BASE["edges"]}
+
+
+def test_diff_lists_node_changes_by_id():
+    new = copy.deepcopy(BASE)
+    new["nodes"][1] = node("b", "Model", model="gpt-4o")
+    new["nodes"] = [n for n in new["nodes"] if n["id"] != "c"] + [node("d", "Notify")]
+
+    diff = diff_documents(BASE, new)
+    assert diff["nodes"] == {"added": ["d"], "removed": ["c"], "changed": ["b"], "replaced": False}
+    assert diff["edges"] == {"added": [], "removed": [], "changed": [], "replaced": False}
+
+
+def test_diff_compares_lists_with_duplicate_ids_whole():
+    old = {**BASE, "edges": [edge("a", "b"), edge("a", "b")]}
+    new = {**BASE, "edges": [edge("a", "b"), {**edge("a", "b"), "label": "retry"}]}
+
+    assert diff_documents(old, new)["edges"] == {"added": [], "removed": [], "changed": [], "replaced": True}
+    assert diff_documents(old, copy.deepcopy(old))["edges"]["replaced"] is False
+    # Nodes still have unique ids, so they are diffed by id
+    assert diff_documents(old, new)["nodes"]["replaced"] is False
+
+
+def test_random_edits_round_trip():
+    rng = random.Random(1234)
+    ids = [f"n{i}" for i in range(8)]
+    doc = copy.deepcopy(BASE)
+    for version in range(300):
+        new = copy.deepcopy(doc)
+        new["version"] = version
+        if rng.random() < 0.3:
+            new["name"] = f"name {rng.randrange(5)}"
+        if rng.random() < 0.1:
+            new.pop("description", None)
+        nodes = [n for n in new["nodes"] if rng.random() > 0.15]
+        for _ in range(rng.randrange(3)):
+            nodes.insert(rng.randrange(len(nodes) + 1), node(rng.choice(ids), f"label {rng.randrange(4)}"))
+        if rng.random() < 0.2:
+            rng.shuffle(nodes)
+        new["nodes"] = nodes
+        round_trip(doc, new)
+        doc = new
@@ -0,0 +1,84 @@
+from app.libs import workflow_search
+from app.libs.workflow_search import WorkflowSearchIndex, shard_of
+
+
+def workflow(workflow_id, name, *labels, description=None):
+    return {
+        "id": workflow_id,
+        "name": name,
+        "description": description,
+        "nodes": [{"id": f"n{i}", "type": "llm", "data": {"label": label}} for i, label in enumerate(labels)],
+    }
+
+
+def build(*workflows):
+    index = WorkflowSearchIndex()
+    for item in workflows:
+        index.add(item)
+    return index
+
+
+def ids(found):
+    return [result["id"] for result in found["results"]]
+
+
+def test_every_token_must_match_a_term_prefix():
+    index = build(
+        workflow("a", "Summarize pages", "Gemini model"),
+        workflow("b", "Summarize emails", "OpenAI model"),
+        workflow("c", "Translate pages", "Gemini model"),
+    )
+
+    assert ids(index.search("summ gem")) == ["a"]
+    assert sorted(ids(index.search("pages"))) == ["a", "c"]
+    assert index.search("summ nothing") == {"results": [], "truncated": False}
+    assert index.search("   ") == {"results": [], "truncated": False}
+
+
+def test_name_matches_rank_above_label_matches():
+    index = build(workflow("label", "Other", "report"), workflow("name", "Report"))
+
+    assert ids(index.search("report")) == ["name", "label"]
+
+
+def test_exact_terms_rank_above_prefix_matches():
+    index = build(workflow("prefix", "Reporting"), workflow("exact", "Report"))
+
+    assert ids(index.search("report")) == ["exact", "prefix"]
+
+
+def test_updates_and_removals():
+    index = build(workflow("a", "Summarize pages"))
+    index.add(workflow("a", "Translate pages"))
+    assert ids(index.search("summ")) == []
+    assert ids(index.search("trans")) == ["a"]
+
+    index.remove("a")
+    assert ids(index.search("pages")) == []
+    assert len(index) == 0
+
+
+def test_broad_prefix_reports_truncation(monkeypatch):
+    index = build(*(workflow(f"w{i}", f"alpha{i:03d}") for i in range(50)))
+    assert index.search("alpha")["truncated"] is False
+
+    monkeypatch.setattr(workflow_search, "MAX_PREFIX_EXPANSIONS", 10)
+    found = index.search("alpha", limit=100)
+    assert found["truncated"] is True
+    assert len(found["results"]) == 10
+
+    monkeypatch.setattr(workflow_search, "MAX_PREFIX_EXPANSIONS", 200)
+    monkeypatch.setattr(workflow_search, "MAX_PREFIX_POSTINGS", 20)
+    found = index.search("alpha", limit=100)
+    assert found["truncated"] is True
+    assert len(found["results"]) == 20
+
+
+def test_shards_round_trip():
+    index = build(*(workflow(f"w{i}", f"Workflow {i}", "step") for i in range(40)))
+    shards = index.to_shards(8)
+
+    for shard, data in enumerate(shards):
+        assert all(shard_of(workflow_id, 8) == shard for workflow_id in data["docs"])
+    restored = WorkflowSearchIndex.from_shards(shards)
+    assert restored.search("step", limit=100) == index.search("step", limit=100)
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from app.apis import workflows
+
+
+@pytest.fixture
+def client(api_client):
+    return api_client(workflows.router, f"user-{uuid.uuid4().hex[:8]}")
+
+
+def create(client, name, **fields):
+    response = client.post("/routes/workflows", json={"name": name, **fields})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_search_sees_writes_and_deletes(client):
+    first = create(client, "Summarize pages")
+    create(client, "Translate pages")
+
+    found = client.get("/routes/workflows/search", params={"q": "pag"}).json()
+    assert found["truncated"] is False
+    assert len(found["results"]) == 2
+
+    client.delete(f"/routes/workflows/{first['id']}")
+    found = client.get("/routes/workflows/search", params={"q": "summ"}).json()
+    assert found == {"results": [], "truncated": False}
+
+
+def test_etag_revalidation_and_conditional_updates(client):
+    created = create(client, "Summarize pages")
+    url = f"/routes/workflows/{created['id']}"
+    etag = client.get(url).headers["etag"]
+
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+
+    updated = client.put(url, json={"name": "Summarize articles"}, headers={"If-Match": etag})
+    assert updated.status_code == 200
+    assert updated.json()["version"] == 2
+    assert updated.headers["etag"] != etag
+
+    stale = client.put(url, json={"name": "Lost update"}, headers={"If-Match": etag})
+    assert stale.status_code == 412
+    assert stale.headers["etag"] == updated.headers["etag"]
+    # A weak validator never satisfies If-Match
+    weak = client.put(url, json={"name": "Weak"}, headers={"If-Match": f"W/{updated.headers['etag']}"})
+    assert weak.status_code == 412
+
+
+@pytest.mark.parametrize("field", ["name", "nodes", "edges"])
+def test_null_for_a_required_field_is_rejected(client, field):
+    created = create(client, "Summarize pages")
+    url = f"/routes/workflows/{created['id']}"
+
+    response = client.put(url, json={field: None})
+
+    assert response.status_code == 422
+    assert client.get(url).json()["version"] == 1
+
+
+class ChunkedBody:
+    """Stands in for a Request whose body arrives in the given chunks"""
+
+    def __init__(self, *chunks):
+        self.chunks = chunks
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def ndjson_lines(*chunks):
+    async def collect():
+        return [item async for item in workflows.iter_ndjson_lines(ChunkedBody(*chunks))]
+
+    return asyncio.run(collect())
+
+
+def test_ndjson_lines_split_across_chunks():
+    assert ndjson_lines(b'{"a"', b": 1}\n\n", b"{", b'"b": 2}\n{"c"', b": 3}") == [
+        (1, b'{"a": 1}'),
+        (3, b'{"b": 2}'),
+        (4, b'{"c": 3}'),
+    ]
+    assert ndjson_lines() == []
+    assert ndjson_lines(b"\n\n") == []
+
+
+def test_ndjson_line_limit_applies_per_line(monkeypatch):
+    monkeypatch.setattr(workflows, "IMPORT_MAX_LINE_BYTES", 8)
+
+    # Many lines in one chunk are fine as long as each fits
+    assert len(ndjson_lines(b"12345678\n" * 5)) == 5
+    for chunks in [[b"123456789\n"], [b"1234", b"56789"], [bytes([c]) for c in b"123456789"]]:
+        with pytest.raises(HTTPException) as raised:
+            ndjson_lines(b"ok\n", *chunks)
+        assert raised.value.status_code == 413
+        assert "Line 2" in raised.value.detail
+
+
+def test_export_and_import_round_trip(client):
+    create(client, "Summarize pages", description="first")
+    create(client, "Translate pages")
+
+    exported = client.get("/routes/workflows/export")
+    assert exported.headers["content-type"].startswith("application/x-ndjson")
+    lines = exported.content.splitlines()
+    assert sorted(json.loads(line)["name"] for line in lines) == ["Summarize pages", "Translate pages"]
+
+    body = b"\n".join(lines) + b"\nnot json\n"
+    result = client.post("/routes/workflows/import", content=body).json()
+    assert (result["imported"], result["failed"]) == (2, 1)
+    assert result["errors"][0]["line"] == 3
+    assert len(client.get("/routes/workflows").json()) == 4
@@ -0,0 +1,114 @@
+"""Benchmark workflow storage formats: size and encode/decode speed.
+
+Usage (from the repository root):
+
+    python tools/bench_workflow_codec.py --nodes 2000 --repeat 20
+
+Builds a synthetic ReactFlow-style workflow graph and compares legacy JSON
+storage against every codec available in app.libs.workflow_codec.
+"""
+
+import argparse
+import json
+import pathlib
+import random
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from app.libs.workflow_codec import available_codecs, decode_document, encode_document  # noqa: E402
+
+NODE_TYPES = ["input", "llm", "api", "database", "transform", "filter", "code", "switch", "output"]
+
+
+def build_workflow(node_count: int, seed: int = 42) -> dict:
+    rng = random.Random(seed)
+    nodes = []
+    for i in range(node_count):
+        node_type = rng.choice(NODE_TYPES)
+        nodes.append(
+            {
+                "id": f"node_{i}",
+                "type": node_type,
+                "position": {"x": rng.uniform(0, 5000), "y": rng.uniform(0, 5000)},
+                "data": {
+                    "label": f"{node_type.title()} {i}",
+                    "type": node_type,
+                    "inputs": [{"id": "in", "type": "any"}],
+                    "outputs": [{"id": "out", "type": "any"}],
+                    "model": "gemini-pro" if node_type == "llm" else None,
+                    "prompt": "Summarize the deal notes for the account manager." if node_type == "llm" else None,
+                },
+            }
+        )
+    edges = [
+        {
+            "id": f"edge_{i}",
+            "source": f"node_{i}",
+            "target": f"node_{i + 1}",
+            "sourceHandle": "out",
+            "targetHandle": "in",
+        }
+        for i in range(node_count - 1)
+    ]
+    return {
+        "id": "wf_bench",
+        "name": "Benchmark workflow",
+        "description": "Synthetic graph for storage benchmarks",
+        "nodes": nodes,
+        "edges": edges,
+        "createdAt": "2025-01-01T00:00:00",
+        "updatedAt": "2025-01-01T00:00:00",
+        "createdBy": "bench",
+        "version": 1,
+    }
+
+
+def timed(fn, repeat: int) -> float:
+    """Best-of-N wall time in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    doc = build_workflow(args.nodes)
+    legacy = json.dumps(doc).encode()
+
+    rows = [
+        (
+            "legacy json",
+            len(legacy),
+            timed(lambda: json.dumps(doc).encode(), args.repeat),
+            timed(lambda: json.loads(legacy), args.repeat),
+        )
+    ]
+    for codec in available_codecs():
+        data = encode_document(doc, codec)
+        assert decode_document(data) == doc
+        rows.append(
+            (
+                codec.name.lower(),
+                len(data),
+                timed(lambda: encode_document(doc, codec), args.repeat),
+                timed(lambda: decode_document(data), args.repeat),
+            )
+        )
+
+    print(f"{args.nodes} nodes, {args.nodes - 1} edges, best of {args.repeat}")
+    print(f"{'format':<14}{'bytes':>12}{'ratio':>8}{'encode ms':>12}{'decode ms':>12}")
+    for name, size, encode_ms, decode_ms in rows:
+        print(f"{name:<14}{size:>12}{len(legacy) / size:>8.1f}{encode_ms:>12.2f}{decode_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""Local stand-in for the Gemini, Vertex AI and OpenAI APIs, for load testing.
+
+Usage (from the repository root):
+
+    python tools/fake_ai_server.py --port 8900 --latency-ms 300 --latency-p99-ms 2000 \
+        --error-rate 0.01 --rate-limit-rate 0.02 --tokens-per-second 80
+
+Then point the backend at it:
+
+    GEMINI_API_BASE_URL=http://127.0.0.1:8900/v1beta
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1
+    VERTEX_AI_BASE_URL=http://127.0.0.1:8900/v1  VERTEX_AI_PROJECT=fake
+
+Implements only the endpoints the app calls:
+
+    GET  /v1beta/models                                    Gemini key check
+    POST /v1beta/models/{model}:generateContent            Gemini chat
+    POST /v1beta/models/{model}:streamGenerateContent      (alt=sse)
+    GET  /v1/projects                                      Vertex AI token check
+    POST /v1/projects/.../models/{model}:generateContent   Vertex AI chat (and streaming)
+    GET  /v1/models                                        OpenAI models.list
+    POST /v1/chat/completions                              OpenAI chat (stream and stream_options)
+
+Time to first byte follows a log-normal distribution set by its median
+(--latency-ms) and p99 (--latency-p99-ms). Replies echo the last user message
+followed by filler words, up to maxOutputTokens / max_tokens (or --reply-words).
+Streams emit one word per chunk at --tokens-per-second. A request fails with
+500 at --error-rate and with 429 at --rate-limit-rate. --seed makes the random
+draws reproducible.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Any, AsyncIterator, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FILLER = (
+    "this is a simulated response from the local fake AI server used for load testing "
+    "the deepcanvas backend without calling a real provider"
+).split()
+
+# z-score of the 99th percentile of a standard normal distribution
+Z_99 = 2.326
+
+
+class Behaviour:
+    def __init__(self, args: argparse.Namespace):
+        self.rng = random.Random(args.seed)
+        self.median = args.latency_ms / 1000.0
+        p99 = max(args.latency_p99_ms, args.latency_ms) / 1000.0
+        self.sigma = math.log(p99 / self.median) / Z_99 if self.median > 0 else 0.0
+        self.error_rate = args.error_rate
+        self.rate_limit_rate = args.rate_limit_rate
+        self.token_interval = 1.0 / args.tokens_per_second if args.tokens_per_second > 0 else 0.0
+        self.reply_words = args.reply_words
+        self.requests = 0
+        self.started = time.monotonic()
+
+    def latency(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(self.rng.gauss(0.0, self.sigma))
+
+    def failure(self) -> int:
+        """Status to fail this request with, or 0"""
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500
+        return 0
+
+    def reply(self, prompt: str, max_tokens: int) -> List[str]:
+        words = f"You said: {prompt}".split() + FILLER
+        limit = min(self.reply_words, max_tokens) if max_tokens else self.reply_words
+        return words[:max(1, limit)]
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def create_app(behaviour: Behaviour) -> FastAPI:
+    app = FastAPI(title="Fake AI server")
+
+    async def before_reply() -> int:
+        behaviour.requests += 1
+        await asyncio.sleep(behaviour.latency())
+        return behaviour.failure()
+
+    def error(status: int, openai: bool = False) -> JSONResponse:
+        message = "Resource has been exhausted (simulated)" if status == 429 else "Internal error (simulated)"
+        if openai:
+            body = {"error": {"message": message, "type": "rate_limit" if status == 429 else "server_error"}}
+        else:
+            body = {"error": {"code": status, "message": message, "status": "RESOURCE_EXHAUSTED" if status == 429 else "INTERNAL"}}
+        headers = {"Retry-After": "1"} if status == 429 else {}
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    async def word_stream(words: List[str]) -> AsyncIterator[str]:
+        for i, word in enumerate(words):
+            if i and behaviour.token_interval:
+                await asyncio.sleep(behaviour.token_interval)
+            yield word if i == 0 else f" {word}"
+
+    # Gemini / Vertex AI
+
+    def gemini_prompt(body: Dict[str, Any]) -> str:
+        for content in reversed(body.get("contents", [])):
+            if content.get("role", "user") == "user":
+                return " ".join(part.get("text", "") for part in content.get("parts", []))
+        return ""
+
+    def gemini_chunk(text: str, prompt_tokens: int, completion_tokens: int, finished: bool) -> Dict[str, Any]:
+        candidate: Dict[str, Any] = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+        if finished:
+            candidate["finishReason"] = "STOP"
+        return {
+            "candidates": [candidate],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": completion_tokens,
+                "totalTokenCount": prompt_tokens + completion_tokens,
+            },
+        }
+
+    async def gemini_generate(request: Request, method: str):
+        body = await request.json()
+        status = await before_reply()
+        if status:
+            return error(status)
+
+        prompt = gemini_prompt(body)
+        prompt_tokens = count_tokens(json.dumps(body.get("contents", [])))
+        max_tokens = body.get("generationConfig", {}).get("maxOutputTokens", 0)
+        words = behaviour.reply(prompt, max_tokens)
+
+        if method == "generateContent":
+            text = " ".join(words)
+            return gemini_chunk(text, prompt_tokens, count_tokens(text), True)
+        if method != "streamGenerateContent":
+            return JSONResponse({"error": {"code": 404, "message": f"Unknown method {method}"}}, status_code=404)
+
+        async def events():
+            produced = ""
+            i = 0
+            async for chunk in word_stream(words):
+                produced += chunk
+                i += 1
+                data = gemini_chunk(chunk, prompt_tokens, count_tokens(produced), finished=i == len(words))
+                yield f"data: {json.dumps(data)}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1beta/models")
+    async def gemini_list_models():
+        return {"models": [{"name": "models/gemini-pro"}, {"name": "models/gemini-1.5-flash"}]}
+
+    @app.post("/v1beta/models/{model_method}")
+    async def gemini_model(model_method: str, request: Request):
+        _, _, method = model_method.partition(":")
+        return await gemini_generate(request, method)
+
+    @app.get("/v1/projects")
+    async def vertex_projects():
+        return {"projects": [{"projectId": "fake"}]}
+
+    @app.post("/v1/projects/{project}/locations/{location}/publishers/google/models/{model_method}")
+    async def vertex_model(project: str, location: str, model_method: str, request: Request):
+        _, _, method = model_method.partition(":")
+        return await gemini_generate(request, method)
+
+    # OpenAI
+
+    @app.get("/v1/models")
+    async def openai_list_models():
+        return {
+            "object": "list",
+            "data": [
+                {"id": "gpt-4o-mini", "object": "model", "created": 0, "owned_by": "fake"},
+                {"id": "gpt-4o", "object": "model", "created": 0, "owned_by": "fake"},
+            ],
+        }
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        body = await request.json()
+        status = await before_reply()
+        if status:
+            return error(status, openai=True)
+
+        messages = body.get("messages", [])
+        prompt = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        prompt_tokens = count_tokens(json.dumps(messages))
+        words = behaviour.reply(prompt, body.get("max_tokens") or 0)
+        model = body.get("model", "gpt-4o-mini")
+        created = int(time.time())
+
+        if not body.get("stream"):
+            text = " ".join(words)
+            return {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": count_tokens(text),
+                    "total_tokens": prompt_tokens + count_tokens(text),
+                },
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        async def events():
+            produced = ""
+
+            def chunk(delta: Dict[str, Any], finish_reason=None) -> str:
+                data = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                return f"data: {json.dumps(data)}\n\n"
+
+            yield chunk({"role": "assistant", "content": ""})
+            async for text in word_stream(words):
+                produced += text
+                yield chunk({"content": text})
+            yield chunk({}, "stop")
+            if include_usage:
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": count_tokens(produced),
+                    "total_tokens": prompt_tokens + count_tokens(produced),
+                }
+                data = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created,
+                        "model": model, "choices": [], "usage": usage}
+                yield f"data: {json.dumps(data)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        elapsed = time.monotonic() - behaviour.started
+        return {"requests": behaviour.requests, "requests_per_second": round(behaviour.requests / elapsed, 2)}
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="median time to first byte")
+    parser.add_argument("--latency-p99-ms", type=float, default=1000.0, help="99th percentile time to first byte")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests failing with 429")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="streaming speed (0 = no delay)")
+    parser.add_argument("--reply-words", type=int, default=60, help="longest reply, in words")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(Behaviour(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
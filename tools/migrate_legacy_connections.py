@@ -0,0 +1,56 @@
+"""Assign legacy (shared, ownerless) API connections to their owners.
+
+Usage (from the repository root, with the app's STORAGE_BACKEND / STORAGE_PATH):
+
+    python tools/migrate_legacy_connections.py                       # list the shared pool
+    python tools/migrate_legacy_connections.py --assign openai_1=<user id> --assign gemini_2=<user id>
+    python tools/migrate_legacy_connections.py --all-to <user id>
+
+Connections created before storage was per-owner have no recorded owner, so
+the app keeps them as a read-only pool visible to every user. This moves the
+chosen ones into their owners' storage, keeping their ids and API keys.
+Unassigned connections stay shared.
+"""
+
+import argparse
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from app.libs.connections import load_shared_connections, migrate_legacy_connections  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assign", action="append", default=[], metavar="ID=OWNER",
+                        help="move one connection to an owner (repeatable)")
+    parser.add_argument("--all-to", metavar="OWNER", help="move every shared connection to one owner")
+    args = parser.parse_args()
+
+    shared = load_shared_connections()
+    if not args.assign and not args.all_to:
+        if not shared:
+            print("No legacy shared connections")
+        for connection_id, connection in shared.items():
+            print(f"{connection_id}\t{connection.get('service')}\t{connection.get('name')}")
+        return
+
+    assignments = {connection_id: args.all_to for connection_id in shared} if args.all_to else {}
+    for item in args.assign:
+        connection_id, sep, owner = item.partition("=")
+        if not sep or not connection_id or not owner:
+            parser.error(f"--assign expects ID=OWNER, got {item!r}")
+        assignments[connection_id] = owner
+
+    unknown = sorted(set(assignments) - set(shared))
+    if unknown:
+        parser.error(f"Not in the shared pool: {', '.join(unknown)}")
+
+    moved = migrate_legacy_connections(assignments)
+    for connection_id, owner in moved.items():
+        print(f"Moved {connection_id} to {owner}")
+
+
+if __name__ == "__main__":
+    main()